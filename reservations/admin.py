@@ -1,20 +1,83 @@
 # reservations/admin.py
 from django.contrib import admin
-from .models import SportFacility, TimeSlot, Reservation
+from django.utils import timezone
+from .models import ArchivedReservation, FacilityClosure, Job, SportFacility, TimeSlot, Reservation, WaitlistEntry
+
+class FacilityClosureInline(admin.TabularInline):
+    model = FacilityClosure
+    extra = 0
 
 @admin.register(SportFacility)
 class SportFacilityAdmin(admin.ModelAdmin):
-    list_display = ('name', 'facility_type')
+    list_display = ('name', 'facility_type', 'schedule_mode')
+    list_filter = ('schedule_mode',)
     search_fields = ('name', 'facility_type')
+    inlines = [FacilityClosureInline]
+
+class AvailabilityListFilter(admin.SimpleListFilter):
+    title = 'availability'
+    parameter_name = 'is_available'
+
+    def lookups(self, request, model_admin):
+        return (('1', 'Available'), ('0', 'Booked'))
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            return queryset.filter(is_available=True)
+        if self.value() == '0':
+            return queryset.filter(is_available=False)
+        return queryset
 
 @admin.register(TimeSlot)
 class TimeSlotAdmin(admin.ModelAdmin):
     list_display = ('facility', 'date', 'start_time', 'end_time', 'is_available')
-    list_filter = ('facility', 'date', 'is_available')
+    list_filter = ('facility', 'date', AvailabilityListFilter)
     search_fields = ('facility__name',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_availability()
+
+    @admin.display(boolean=True)
+    def is_available(self, obj):
+        return obj.is_available
+
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
     list_display = ('user', 'time_slot', 'created_at')
     list_filter = ('time_slot__facility', 'time_slot__date')
-    search_fields = ('user__username', 'time_slot__facility__name')
\ No newline at end of file
+    search_fields = ('user__username', 'time_slot__facility__name')
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'time_slot', 'created_at')
+    list_filter = ('time_slot__facility', 'time_slot__date')
+    search_fields = ('user__username', 'time_slot__facility__name')
+    list_select_related = ('user', 'time_slot__facility')
+
+@admin.register(ArchivedReservation)
+class ArchivedReservationAdmin(admin.ModelAdmin):
+    """Read-only booking history moved out by archive_history"""
+    list_display = ('user', 'time_slot', 'created_at', 'is_cancelled', 'archived_at')
+    list_filter = ('time_slot__facility', 'time_slot__date', 'is_cancelled')
+    search_fields = ('user__username', 'time_slot__facility__name')
+    list_select_related = ('user', 'time_slot__facility')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'run_at', 'attempts', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    actions = ['retry']
+
+    @admin.action(description='Queue selected failed jobs again')
+    def retry(self, request, queryset):
+        # Periodic jobs are queued again by the workers anyway
+        queryset.filter(status=Job.FAILED, key='').update(
+            status=Job.QUEUED, run_at=timezone.now(), attempts=0, finished_at=None,
+        )
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class ReservationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservations'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from rest_framework.authtoken.models import Token
+
+        from .authentication import token_deleted, user_saved
+        from .metrics import install_query_recorder
+
+        connection_created.connect(install_query_recorder, dispatch_uid='reservations.query_recorder')
+        post_delete.connect(token_deleted, sender=Token, dispatch_uid='reservations.token_deleted')
+        post_save.connect(user_saved, sender=get_user_model(), dispatch_uid='reservations.user_saved')
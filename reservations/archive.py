@@ -0,0 +1,93 @@
+# reservations/archive.py
+"""
+Retention of booking history.
+
+Slots dated before a cutoff move with all their reservations, cancelled or
+not, from TimeSlot and Reservation to ArchivedTimeSlot and
+ArchivedReservation. Each batch is one transaction and rows keep their ids.
+Slots that were never reserved are purged rather than archived
+(slots.purge_time_slots). The hot tables stay sized to the booking horizon,
+and reservation_history() still reports over both.
+
+Batches can instead be exported as gzipped JSON lines for storage outside
+the database, where reports no longer see them.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+SLOT_FIELDS = ('id', 'facility_id', 'date', 'start_time', 'end_time')
+RESERVATION_FIELDS = ('id', 'user_id', 'time_slot_id', 'created_at', 'is_cancelled')
+HISTORY_FIELDS = ('id', 'user_id', 'facility_id', 'date', 'start_time', 'end_time', 'created_at', 'is_cancelled')
+
+
+def archive_history(before, batch_size=1000, dry_run=False, export=None):
+    """
+    Move the reserved slots dated before `before` and their reservations to
+    the archive tables, or write them to the text stream export as JSON
+    lines of {"model": "time_slot" | "reservation", ...fields}. Returns
+    the number of (slots, reservations) (to be) moved.
+    """
+    from .models import ArchivedReservation, ArchivedTimeSlot, Reservation, TimeSlot
+
+    stale = TimeSlot.objects.filter(date__lt=before).filter(
+        Exists(Reservation.objects.filter(time_slot=OuterRef('pk')))
+    )
+    if dry_run:
+        return stale.count(), Reservation.objects.filter(time_slot__date__lt=before).count()
+
+    moved_slots = moved_reservations = 0
+    while True:
+        with transaction.atomic():
+            slots = list(stale.order_by('date', 'start_time', 'id').values(*SLOT_FIELDS)[:batch_size])
+            if not slots:
+                return moved_slots, moved_reservations
+            slot_ids = [slot['id'] for slot in slots]
+            reservations = list(
+                Reservation.objects.filter(time_slot_id__in=slot_ids).order_by('id').values(*RESERVATION_FIELDS)
+            )
+            if export is None:
+                ArchivedTimeSlot.objects.bulk_create([ArchivedTimeSlot(**slot) for slot in slots])
+                ArchivedReservation.objects.bulk_create(
+                    [ArchivedReservation(**reservation) for reservation in reservations], batch_size=batch_size,
+                )
+            else:
+                # Written before the batch commits: a failed batch is exported again by the next run
+                export.writelines(
+                    json.dumps({'model': model, **row}, cls=DjangoJSONEncoder) + '\n'
+                    for model, rows in (('time_slot', slots), ('reservation', reservations))
+                    for row in rows
+                )
+            # Past days only, so there is no cached availability to invalidate
+            Reservation.objects.filter(time_slot_id__in=slot_ids).delete()
+            TimeSlot.objects.filter(pk__in=slot_ids).delete()
+        moved_slots += len(slots)
+        moved_reservations += len(reservations)
+
+
+def reservation_history(user=None, facility=None, start_date=None, end_date=None):
+    """
+    Reservations of the hot and archive tables as dicts of HISTORY_FIELDS,
+    optionally of one user or facility and within slot dates. The result is
+    a union: it can be ordered, sliced and counted, not filtered further.
+    """
+    from .models import ArchivedReservation, Reservation
+
+    querysets = []
+    for model in (Reservation, ArchivedReservation):
+        queryset = model.objects.annotate(
+            facility_id=F('time_slot__facility_id'), date=F('time_slot__date'),
+            start_time=F('time_slot__start_time'), end_time=F('time_slot__end_time'),
+        )
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        if facility is not None:
+            queryset = queryset.filter(time_slot__facility=facility)
+        if start_date is not None:
+            queryset = queryset.filter(time_slot__date__gte=start_date)
+        if end_date is not None:
+            queryset = queryset.filter(time_slot__date__lte=end_date)
+        querysets.append(queryset.order_by().values(*HISTORY_FIELDS))
+    return querysets[0].union(querysets[1], all=True)
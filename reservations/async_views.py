@@ -0,0 +1,202 @@
+# reservations/async_views.py
+"""
+Async read endpoints for the bursts at booking-open time.
+
+DRF views are sync only, so these are plain Django async views over the
+async ORM. Under ASGI a request waiting on the cache or the database does
+not hold a worker thread. They answer GET only and return the same JSON as
+their DRF counterparts under /api/.
+"""
+import asyncio
+import json
+from contextlib import nullcontext
+from functools import wraps
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import (
+    APIException, AuthenticationFailed, NotAuthenticated, NotFound, ValidationError,
+)
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .authentication import acached_token, check_user
+from .cache import acached_day_slots, acached_facility, aload_day_rows, availability_cache, day_slots
+from .events import get_broadcaster, setting as events_setting, slot_channel
+from .filters import filter_reservations, param_bool, param_date, param_int, param_int_list
+from .models import Reservation, SportFacility, TimeSlot
+from .pagination import FacilityPagination, ReservationPagination
+from .serializers import ReservationSerializer, SportFacilitySerializer, TimeSlotSerializer
+from .slots import virtual_time_slots
+
+MAX_FACILITIES = 50
+
+
+class ASGIRequired(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = 'Event streams are only served by the ASGI application.'
+
+
+def async_api_view(view):
+    """
+    GET-only async view taking a DRF Request (for query_params) and
+    answering API errors the way DRF's exception handler does.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            response = JsonResponse(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED,
+            )
+            response['Allow'] = 'GET'
+            return response
+        try:
+            return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            response = JsonResponse(data, encoder=JSONEncoder, safe=False, status=exc.status_code)
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                response.status_code = status.HTTP_401_UNAUTHORIZED
+                response['WWW-Authenticate'] = 'Token'
+            return response
+    return wrapper
+
+
+def respond(request, serialize):
+    """JSON response of serialize(), timed as serialization"""
+    timings = getattr(request, 'timings', None)
+    with timings.serializing() if timings is not None else nullcontext():
+        return JsonResponse(serialize(), encoder=JSONEncoder, safe=False)
+
+
+async def authenticate(request):
+    """Token authentication, the only kind the API accepts"""
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != 'token':
+        raise NotAuthenticated()
+    if len(header) != 2:
+        raise AuthenticationFailed('Invalid token header.')
+    token = await acached_token(header[1])
+    if token is None:
+        raise AuthenticationFailed('Invalid token.')
+    return check_user(token)[0]
+
+
+@async_api_view
+async def facility_list(request):
+    now = timezone.localtime()
+    queryset = SportFacility.objects.with_booked_count(now.date(), after=now.time())
+    paginator = FacilityPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    return respond(request, lambda: paginator.get_paginated_data(
+        SportFacilitySerializer(page, many=True, context={'request': request}).data
+    ))
+
+
+async def facilities_day_slots(facility_ids, date):
+    """
+    Slots of each facility on date, in order. The async ORM runs queries one
+    at a time on a single thread, so rather than gathering a load per
+    facility, every day goes through one cache lookup and one query.
+    """
+    facilities = []
+    for facility_id in facility_ids:
+        facility = await acached_facility(facility_id)
+        if facility is not None:
+            facilities.append(facility)
+    keys = [(facility.id, date) for facility in facilities]
+    rows = await availability_cache.aget_days(keys, aload_day_rows) if keys else {}
+    return [
+        slot for facility in facilities
+        for slot in virtual_time_slots(facility, date, stored=day_slots(facility, date, rows[(facility.id, date)]))
+    ]
+
+
+@async_api_view
+async def time_slot_list(request):
+    """
+    Slots of a facility-day, or of several facilities on a date with
+    ?facility_ids=1,2,3.
+    """
+    params = request.query_params
+    date = param_date(params, 'date')
+    facility_ids = param_int_list(params, 'facility_ids')
+    facility_id = param_int(params, 'facility_id')
+    if facility_id is not None:
+        facility_ids.insert(0, facility_id)
+    if date is None or not facility_ids:
+        raise ValidationError({'date': 'date and facility_id or facility_ids are required.'})
+    if len(facility_ids) > MAX_FACILITIES:
+        raise ValidationError({'facility_ids': f'At most {MAX_FACILITIES} facilities.'})
+
+    slots = await facilities_day_slots(dict.fromkeys(facility_ids), date)
+    available = param_bool(params, 'available')
+    if available is not None:
+        slots = [slot for slot in slots if slot.is_available == available]
+    return respond(request, lambda: TimeSlotSerializer(slots, many=True).data)
+
+
+@async_api_view
+async def reservation_list(request):
+    """The user's own reservations (everyone's for staff)"""
+    user = await authenticate(request)
+    queryset = Reservation.objects.prefetch_related(Prefetch(
+        'time_slot',
+        queryset=TimeSlot.objects.with_availability().select_related('facility'),
+    ))
+    queryset = filter_reservations(queryset, request.query_params)
+    if not user.is_staff:
+        queryset = queryset.filter(user=user)
+    paginator = ReservationPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    return respond(request, lambda: paginator.get_paginated_data(
+        ReservationSerializer(page, many=True, context={'request': request}).data
+    ))
+
+
+def server_sent_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n'
+
+
+@async_api_view
+async def time_slot_events(request):
+    """
+    Server-sent events of a facility-day: a 'snapshot' of its slots, then a
+    'slot' event each time one is booked or freed, and 'resync' when events
+    were lost and the client should refetch. Needs the ASGI application,
+    where a waiting client costs no thread.
+    """
+    if not isinstance(request._request, ASGIRequest):
+        raise ASGIRequired()
+    params = request.query_params
+    facility_id = param_int(params, 'facility_id')
+    date = param_date(params, 'date')
+    if facility_id is None or date is None:
+        raise ValidationError({'date': 'facility_id and date are required.'})
+    facility = await acached_facility(facility_id)
+    if facility is None:
+        raise NotFound()
+    heartbeat = events_setting('HEARTBEAT_SECONDS', 15)
+
+    async def stream():
+        # Subscribe before taking the snapshot, so no change falls between
+        async with get_broadcaster().subscribe(slot_channel(facility_id, date)) as subscription:
+            yield f'retry: {events_setting("RETRY_MS", 3000)}\n\n'
+            slots = virtual_time_slots(facility, date, stored=await acached_day_slots(facility, date))
+            yield server_sent_event('snapshot', TimeSlotSerializer(slots, many=True).data)
+            while True:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                else:
+                    yield server_sent_event(event['type'], event)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,164 @@
+# reservations/authentication.py
+"""
+Token authentication without a query per request.
+
+DRF's TokenAuthentication joins the token to its user on every call.
+CachedTokenAuthentication looks the key up in a small in-process LRU, then
+in the shared cache, and only then in the database. Entries hold the token
+with its user and are keyed by a hash of the token, never the token itself.
+
+Deleting a token (logout, rotation) or saving its user forgets the token
+in the shared cache and in this process once the transaction commits.
+Other processes drop their local copy within
+RESERVATIONS_AUTH_CACHE['LOCAL_TTL'] seconds, which bounds how long a
+revoked token keeps working there. When the cache alias is a per-process
+locmem cache, forgetting cannot reach other processes at all, so entries
+there also expire after LOCAL_TTL rather than TIMEOUT.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+PREFIX = 'reservations:auth'
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_AUTH_CACHE', {}).get(name, default)
+
+
+class LocalTokenCache:
+    """Bounded LRU of cache key -> (expiry, token), safe across threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, token):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + setting('LOCAL_TTL', 10), token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > setting('LOCAL_SIZE', 1024):
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_tokens = LocalTokenCache()
+
+
+def shared_cache():
+    return caches[setting('ALIAS', 'default')]
+
+
+def shared_timeout():
+    """TIMEOUT, or LOCAL_TTL when the "shared" cache is only this process's"""
+    from .cache import is_per_process
+
+    if is_per_process(shared_cache()):
+        return setting('LOCAL_TTL', 10)
+    return setting('TIMEOUT', 300)
+
+
+def token_cache_key(key):
+    return f'{PREFIX}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def cached_token(key):
+    """The Token of key with its user loaded, or None if there is no such token"""
+    from rest_framework.authtoken.models import Token
+
+    cache_key = token_cache_key(key)
+    token = local_tokens.get(cache_key)
+    if token is None:
+        token = shared_cache().get(cache_key)
+        if token is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                return None
+            shared_cache().set(cache_key, token, shared_timeout())
+        local_tokens.set(cache_key, token)
+    return token
+
+
+async def acached_token(key):
+    from rest_framework.authtoken.models import Token
+
+    cache_key = token_cache_key(key)
+    token = local_tokens.get(cache_key)
+    if token is None:
+        token = await shared_cache().aget(cache_key)
+        if token is None:
+            try:
+                token = await Token.objects.select_related('user').aget(key=key)
+            except Token.DoesNotExist:
+                return None
+            await shared_cache().aset(cache_key, token, shared_timeout())
+        local_tokens.set(cache_key, token)
+    return token
+
+
+def forget_tokens(keys):
+    """Drop tokens from both caches once the current transaction commits"""
+    cache_keys = [token_cache_key(key) for key in keys]
+
+    def forget():
+        shared_cache().delete_many(cache_keys)
+        for cache_key in cache_keys:
+            local_tokens.discard(cache_key)
+
+    if cache_keys:
+        transaction.on_commit(forget)
+
+
+def token_deleted(sender, instance, **kwargs):
+    forget_tokens([instance.key])
+
+
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which nothing reads from request.user
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    from rest_framework.authtoken.models import Token
+
+    forget_tokens(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+
+
+def check_user(token):
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return token.user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication resolving keys through cached_token()"""
+
+    def authenticate_credentials(self, key):
+        token = cached_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        return check_user(token)
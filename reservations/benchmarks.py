@@ -0,0 +1,414 @@
+# reservations/benchmarks.py
+"""
+Benchmark scenarios for the reservation API.
+
+Requests go through DRF's APIClient, so the whole Django stack (middleware,
+token authentication, views, serializers, ORM) is measured without network
+noise. Every scenario reports latency percentiles, throughput, the number of
+SQL statements per request and the responses that were not successful.
+Run it with ``manage.py benchmark_api``.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import AsyncClient, Client, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .cache import availability_cache
+from .intake import get_intake, reset_intake
+from .models import Reservation, SportFacility, TimeSlot
+from .slots import extend_horizon
+
+SLOT_DURATIONS = (30, 60, 90)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    """Aggregate per-request samples (seconds, statement counts) of one scenario"""
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3),
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        },
+    }
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements on the current thread's connection"""
+    counter = [0]
+
+    def wrapper(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+
+class Benchmark:
+    def __init__(self, facilities=10, days=7, users=50, iterations=200, threads=8,
+                 booked_ratio=0.3, seed=0, log=None):
+        self.facility_count = facilities
+        self.days = days
+        self.user_count = users
+        self.iterations = iterations
+        self.threads = threads
+        self.booked_ratio = booked_ratio
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.results = {}
+
+    # Data -----------------------------------------------------------------
+
+    def seed(self):
+        started = time.perf_counter()
+        SportFacility.objects.bulk_create([
+            SportFacility(
+                name=f'Facility {i}', description='Benchmark facility', facility_type='court',
+                slot_duration=SLOT_DURATIONS[i % len(SLOT_DURATIONS)],
+            )
+            for i in range(self.facility_count)
+        ])
+        self.facilities = list(SportFacility.objects.order_by('id'))
+        until = timezone.localdate() + timedelta(days=self.days)
+        for facility in self.facilities:
+            extend_horizon(facility, until)
+
+        User.objects.bulk_create([
+            User(username=f'bench{i}', password='!') for i in range(self.user_count)
+        ])
+        self.users = list(User.objects.filter(username__startswith='bench').order_by('id'))
+        Token.objects.bulk_create([
+            Token(user=user, key=Token.generate_key()) for user in self.users
+        ])
+        self.tokens = dict(Token.objects.values_list('user_id', 'key'))
+
+        # Book a share of tomorrow onwards so listings see realistic data
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        slot_ids = list(TimeSlot.objects.filter(date__gte=tomorrow).values_list('id', flat=True))
+        booked = self.random.sample(slot_ids, int(len(slot_ids) * self.booked_ratio))
+        Reservation.objects.bulk_create([
+            Reservation(user=self.random.choice(self.users), time_slot_id=slot_id)
+            for slot_id in booked
+        ])
+        self.free_slots = list(
+            TimeSlot.objects.available().filter(date__gte=tomorrow).values_list('id', flat=True)
+        )
+        self.random.shuffle(self.free_slots)
+
+        self.results['seed'] = {
+            'facilities': len(self.facilities),
+            'days': self.days,
+            'users': len(self.users),
+            'slots': TimeSlot.objects.count(),
+            'reservations': len(booked),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+
+    def client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[user.id]}')
+        return client
+
+    # Scenarios ------------------------------------------------------------
+
+    def measure(self, name, request, iterations=None, before=None, ok=(200, 201, 204)):
+        """
+        Run request(i) -> response sequentially and record its samples.
+        before(i), if given, runs untimed ahead of each request.
+        """
+        iterations = iterations or self.iterations
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            if before is not None:
+                before(i)
+            with count_queries() as counter:
+                begin = time.perf_counter()
+                response = request(i)
+                latencies.append(time.perf_counter() - begin)
+            queries.append(counter[0])
+            if response.status_code not in ok:
+                errors += 1
+        self.results[name] = summarize(latencies, queries, errors, time.perf_counter() - started)
+        self.log(f'{name}: {self.results[name].get("latency_ms", {}).get("p50")} ms p50')
+
+    def day_params(self, i):
+        facility = self.facilities[i % len(self.facilities)]
+        day = timezone.localdate() + timedelta(days=1 + i // len(self.facilities) % self.days)
+        return {'facility_id': facility.id, 'date': day.isoformat()}
+
+    def run_slot_listing(self):
+        client = self.client()
+        self.measure('slot_listing_cold', lambda i: client.get('/api/timeslots/', self.day_params(i)),
+                     before=lambda i: availability_cache.cache.clear())
+        self.measure('slot_listing', lambda i: client.get('/api/timeslots/', self.day_params(i)))
+
+    def run_availability_matrix(self):
+        client = self.client()
+        start = timezone.localdate() + timedelta(days=1)
+        params = {'start': start.isoformat(), 'end': (start + timedelta(days=6)).isoformat()}
+        self.measure('availability_matrix', lambda i: client.get('/api/availability/', params))
+
+    def run_facility_listing(self):
+        client = self.client()
+        self.measure('facility_listing', lambda i: client.get('/api/facilities/'))
+
+    def run_reservation_listing(self):
+        clients = [self.client(user) for user in self.users]
+        self.measure('reservation_listing',
+                     lambda i: clients[i % len(clients)].get('/api/reservations/'))
+
+    def run_booking_and_cancellation(self):
+        clients = [self.client(user) for user in self.users]
+        slots = [self.free_slots.pop() for _ in range(min(self.iterations, len(self.free_slots)))]
+        created = []
+
+        def book(i):
+            response = clients[i % len(clients)].post(
+                '/api/reservations/', {'time_slot': slots[i]}, format='json'
+            )
+            if response.status_code == 201:
+                created.append((i % len(clients), response.data['id']))
+            return response
+
+        self.measure('booking', book, iterations=len(slots))
+        self.measure(
+            'cancellation',
+            lambda i: clients[created[i][0]].delete(f'/api/reservations/{created[i][1]}/'),
+            iterations=len(created),
+        )
+
+    def run_auto_manage_slots(self):
+        days = str(self.days + 8)
+        for name in ('auto_manage_slots', 'auto_manage_slots_noop'):
+            begin = time.perf_counter()
+            with count_queries() as counter:
+                call_command('auto_manage_slots', '--days', days, stdout=StringIO())
+            self.results[name] = {
+                'seconds': round(time.perf_counter() - begin, 4),
+                'queries': counter[0],
+            }
+            self.log(f'{name}: {self.results[name]["seconds"]}s')
+
+    def run_concurrent_booking(self, hot_slots=5, name='concurrent_booking'):
+        """All threads race for the same few slots"""
+        slots = [self.free_slots.pop() for _ in range(min(hot_slots, len(self.free_slots)))]
+        barrier = threading.Barrier(self.threads)
+        lock = threading.Lock()
+        latencies, outcomes = [], {}
+
+        def worker(index):
+            client = self.client(self.users[index % len(self.users)])
+            samples, statuses = [], []
+            barrier.wait()
+            try:
+                for slot_id in slots:
+                    begin = time.perf_counter()
+                    try:
+                        status = client.post(
+                            '/api/reservations/', {'time_slot': slot_id}, format='json'
+                        ).status_code
+                    except Exception as exc:  # e.g. "database is locked"
+                        status = type(exc).__name__
+                    samples.append(time.perf_counter() - begin)
+                    statuses.append(status)
+                    # As the request handler does, which the test client skips
+                    close_old_connections()
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(samples)
+                for status in statuses:
+                    outcomes[str(status)] = outcomes.get(str(status), 0) + 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        active = Reservation.objects.filter(time_slot_id__in=slots, is_cancelled=False)
+        result = summarize(latencies, [0], 0, elapsed)
+        result.pop('queries', None)
+        result.update({
+            'threads': self.threads,
+            'hot_slots': len(slots),
+            'outcomes': outcomes,
+            'booked': outcomes.get('201', 0),
+            'conflicts': outcomes.get('409', 0),
+            'double_bookings': active.count() - active.values('time_slot').distinct().count(),
+        })
+        result['errors'] = len(latencies) - result['booked'] - result['conflicts']
+        self.results[name] = result
+        self.log(f'{name}: {result["throughput_rps"]} attempts/s, '
+                 f'{result["double_bookings"]} double bookings')
+
+    def run_concurrent_booking_surge(self):
+        """concurrent_booking through the surge-mode intake, with its queue stats"""
+        surge = {**settings.RESERVATIONS_SURGE, 'ENABLED': True, 'RATE': None}
+        with override_settings(RESERVATIONS_SURGE=surge):
+            try:
+                self.run_concurrent_booking(name='concurrent_booking_surge')
+                self.results['concurrent_booking_surge']['intake'] = get_intake().stats()
+            finally:
+                # Its writer thread holds a connection that would block later scenarios
+                reset_intake()
+
+    @contextmanager
+    def database_settings(self, **values):
+        """Connections opened meanwhile, on any thread, use these settings"""
+        previous = {key: connection.settings_dict.get(key) for key in values}
+        reset_intake()  # Its writer thread's connection would hold the journal mode switch
+        connection.close()
+        connection.settings_dict.update(values)
+        # Switch the journal mode once, before worker threads race to do it
+        connection.ensure_connection()
+        try:
+            yield
+        finally:
+            connection.close()
+            connection.settings_dict.update(previous)
+
+    def run_database_profiles(self):
+        """
+        concurrent_booking with Django's default database settings
+        (concurrent_booking_baseline: a connection per request, deferred
+        transactions and, on SQLite, a rollback journal), then with the
+        configured profile (concurrent_booking_tuned).
+        """
+        baseline = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}
+        if connection.vendor == 'sqlite':
+            # The journal mode is stored in the database file
+            baseline['OPTIONS'] = {'init_command': 'PRAGMA journal_mode=DELETE'}
+        tuned = {key: connection.settings_dict[key] for key in baseline}
+        bookings = getattr(settings, 'RESERVATIONS_DATABASE', {})
+        for name, values, immediate in (
+            ('baseline', baseline, False), ('tuned', tuned, bookings.get('IMMEDIATE_BOOKINGS', False)),
+        ):
+            with self.database_settings(**values), \
+                    override_settings(RESERVATIONS_DATABASE={**bookings, 'IMMEDIATE_BOOKINGS': immediate}):
+                self.run_concurrent_booking(name=f'concurrent_booking_{name}')
+            self.results[f'concurrent_booking_{name}']['database'] = {
+                'CONN_MAX_AGE': values['CONN_MAX_AGE'], **values['OPTIONS'], 'immediate_bookings': immediate,
+            }
+
+    def run_wsgi_vs_asgi(self):
+        """
+        Capacity of a single worker under bursts of `threads` simultaneous
+        reads. The WSGI worker serves a burst one request at a time through
+        the sync DRF views; the ASGI worker interleaves the burst on one
+        event loop through the async views. Only waits on the cache overlap
+        there: the async ORM runs every query on one shared thread, so
+        database work is as serial as under WSGI. Latency counts from the
+        arrival of the burst, so it includes the time spent queued.
+        """
+        headers = {'Authorization': f'Token {self.tokens[self.users[0].id]}'}
+        endpoints = (
+            ('facilities', '/api/facilities/', '/api/async/facilities/', lambda i: {}),
+            ('slots', '/api/timeslots/', '/api/async/timeslots/', self.day_params),
+            ('reservations', '/api/reservations/', '/api/async/reservations/', lambda i: {}),
+        )
+        bursts = max(1, self.iterations // self.threads)
+
+        for name, sync_path, async_path, params in endpoints:
+            client = Client(headers=headers)
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            for burst in range(bursts):
+                arrival = time.perf_counter()
+                for i in range(self.threads):
+                    response = client.get(sync_path, params(burst * self.threads + i))
+                    latencies.append(time.perf_counter() - arrival)
+                    errors += response.status_code != 200
+            self.record_burst(f'{name}_wsgi', latencies, errors, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            latencies, errors = async_to_sync(self.async_bursts)(async_path, params, bursts, headers)
+            self.record_burst(f'{name}_asgi', latencies, errors, time.perf_counter() - started)
+
+    async def async_bursts(self, path, params, bursts, headers):
+        client = AsyncClient()
+        latencies, errors = [], 0
+
+        async def get(i, arrival):
+            nonlocal errors
+            response = await client.get(path, params(i), headers=headers)
+            latencies.append(time.perf_counter() - arrival)
+            errors += response.status_code != 200
+
+        for burst in range(bursts):
+            arrival = time.perf_counter()
+            await asyncio.gather(*(get(burst * self.threads + i, arrival) for i in range(self.threads)))
+        return latencies, errors
+
+    def record_burst(self, name, latencies, errors, elapsed):
+        result = summarize(latencies, [0], errors, elapsed)
+        result.pop('queries', None)
+        result['concurrency'] = self.threads
+        self.results[name] = result
+        self.log(f'{name}: {result["throughput_rps"]} req/s, {result["latency_ms"]["p99"]} ms p99')
+
+    SCENARIOS = (
+        'slot_listing', 'availability_matrix', 'facility_listing', 'reservation_listing',
+        'booking_and_cancellation', 'concurrent_booking', 'concurrent_booking_surge',
+        'database_profiles', 'auto_manage_slots', 'wsgi_vs_asgi',
+    )
+
+    def run(self, scenarios=SCENARIOS):
+        self.seed()
+        for name in scenarios:
+            getattr(self, f'run_{name}')()
+        return self.results
+
+
+def compare(previous, current):
+    """Lines describing p50/p99 and query count changes between two result sets"""
+    lines = []
+    for name, result in current.items():
+        before = previous.get(name)
+        if not before or 'latency_ms' not in result or 'latency_ms' not in before:
+            continue
+        parts = []
+        for key in ('p50', 'p99'):
+            old, new = before['latency_ms'][key], result['latency_ms'][key]
+            change = (new - old) / old * 100 if old else 0
+            parts.append(f'{key} {old:.2f} -> {new:.2f} ms ({change:+.0f}%)')
+        if 'queries' in result and 'queries' in before:
+            parts.append(f'queries {before["queries"]["mean"]} -> {result["queries"]["mean"]}')
+        lines.append(f'{name}: ' + ', '.join(parts))
+    return lines
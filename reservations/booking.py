@@ -0,0 +1,215 @@
+# reservations/booking.py
+"""
+Race-free reservation booking.
+
+A slot is booked by a single INSERT guarded by the partial unique constraint
+on active reservations, so two concurrent attempts can never both succeed on
+any backend. Where the backend supports row locks the slot row is locked
+first, which queues concurrent attempts instead of letting them all reach
+the insert. Batches check availability with one query and insert with one
+statement, under the same constraint.
+
+Intervals of interval-mode facilities may overlap without sharing a row, so
+they are booked under a lock on the facility row instead, after checking for
+overlapping active reservations. SQLite, which has no row locks, runs one
+write transaction at a time; booking transactions take its write lock as
+they begin (see booking_transaction).
+
+Users may queue for a booked slot. Joining the waitlist takes the same slot
+row lock as Reservation.cancel(), which hands the slot to the head of the
+queue, so nobody can join a slot that has just been freed.
+"""
+from contextlib import ExitStack, contextmanager
+from datetime import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+
+from .models import Reservation, SportFacility, TimeSlot, WaitlistEntry
+from .tasks import queue_booking_confirmations
+
+
+class SlotUnavailable(Exception):
+    """The slot already has an active reservation."""
+
+
+class SlotAvailable(Exception):
+    """The slot has no active reservation, so there is nothing to wait for."""
+
+
+class AlreadyBooked(Exception):
+    """The user holds the active reservation of the slot."""
+
+
+@contextmanager
+def booking_transaction():
+    """
+    transaction.atomic(), started with BEGIN IMMEDIATE on SQLite when
+    RESERVATIONS_DATABASE['IMMEDIATE_BOOKINGS'] is set. A deferred
+    transaction that reads before writing cannot wait for the write lock:
+    SQLite fails it with "database is locked" straight away. An immediate
+    one waits on the busy timeout.
+    """
+    with ExitStack() as stack:
+        immediate = (
+            connection.vendor == 'sqlite' and not connection.in_atomic_block
+            and getattr(settings, 'RESERVATIONS_DATABASE', {}).get('IMMEDIATE_BOOKINGS', False)
+        )
+        if immediate:
+            connection.ensure_connection()
+            previous, connection.transaction_mode = connection.transaction_mode, 'IMMEDIATE'
+            try:
+                stack.enter_context(transaction.atomic())
+            finally:
+                connection.transaction_mode = previous
+        else:
+            stack.enter_context(transaction.atomic())
+        yield
+
+
+def book_time_slot(user, time_slot):
+    """
+    Create an active reservation of time_slot for user in one atomic attempt.
+    Raises SlotUnavailable when another reservation holds the slot.
+    Interval-mode slots may be unsaved; they are stored when booked.
+    """
+    with booking_transaction():
+        if time_slot.facility.uses_intervals:
+            time_slot = claim_interval(time_slot)
+        elif connection.features.has_select_for_update:
+            list(TimeSlot.objects.select_for_update().filter(pk=time_slot.pk).values_list('pk'))
+        try:
+            with transaction.atomic():
+                reservation = Reservation.objects.create(user=user, time_slot=time_slot)
+        except IntegrityError:
+            raise SlotUnavailable(time_slot.pk) from None
+        queue_booking_confirmations([reservation])
+
+    time_slot.is_available = False
+    return reservation
+
+
+def claim_interval(time_slot):
+    """
+    Lock the facility of an interval-mode slot and return the stored row of
+    its interval, creating it unless a row has the same bounds. Rows are
+    never given new bounds, as cancelled reservations still point at them.
+    Raises SlotUnavailable when an active reservation overlaps the interval.
+    """
+    if connection.features.has_select_for_update:
+        list(SportFacility.objects.select_for_update().filter(pk=time_slot.facility_id).values_list('pk'))
+    overlapping = Reservation.objects.filter(
+        # An end_time of 00:00 is midnight, after any start
+        Q(time_slot__end_time__gt=time_slot.start_time) | Q(time_slot__end_time=time(0)),
+        is_cancelled=False, time_slot__facility=time_slot.facility_id, time_slot__date=time_slot.date,
+    )
+    if time_slot.end_time != time(0):
+        overlapping = overlapping.filter(time_slot__start_time__lt=time_slot.end_time)
+    if overlapping.exists():
+        raise SlotUnavailable(time_slot.pk)
+
+    stored, _ = TimeSlot.objects.get_or_create(
+        facility=time_slot.facility, date=time_slot.date,
+        start_time=time_slot.start_time, end_time=time_slot.end_time, is_interval=True,
+    )
+    return stored
+
+
+def slot_key(time_slot):
+    """Identifies a slot whether it is stored or not"""
+    return time_slot.facility_id, time_slot.date, time_slot.start_time
+
+
+def book_time_slots(user, time_slots, all_or_nothing=True):
+    """
+    Book many slots for user in one transaction.
+
+    Returns ({slot_key: reservation}, {slot_keys of the slots already
+    taken}). With all_or_nothing nothing is booked unless every slot is
+    free, and SlotUnavailable is raised with the keys of the taken ones.
+    Interval-mode slots are booked one by one with book_time_slot().
+    """
+    intervals = [slot for slot in time_slots if slot.facility.uses_intervals]
+    time_slots = [slot for slot in time_slots if not slot.facility.uses_intervals]
+    with booking_transaction():
+        booked, taken = book_stored_slots(user, time_slots, all_or_nothing)
+        for slot in intervals:
+            try:
+                booked[slot_key(slot)] = book_time_slot(user, slot)
+            except SlotUnavailable:
+                taken.add(slot_key(slot))
+        if all_or_nothing and taken:
+            raise SlotUnavailable(*sorted(taken))
+    return booked, taken
+
+
+def book_stored_slots(user, time_slots, all_or_nothing):
+    """book_time_slots() of stored grid slots: one check and one insert"""
+    if not time_slots:
+        return {}, set()
+    slot_ids = [slot.pk for slot in time_slots]
+    keys = {slot.pk: slot_key(slot) for slot in time_slots}
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            list(TimeSlot.objects.select_for_update().filter(pk__in=slot_ids).order_by('pk').values_list('pk'))
+        taken = set(Reservation.objects.filter(
+            time_slot_id__in=slot_ids, is_cancelled=False,
+        ).values_list('time_slot_id', flat=True))
+        if all_or_nothing and taken:
+            raise SlotUnavailable(*sorted(keys[slot_id] for slot_id in taken))
+
+        free = [slot for slot in time_slots if slot.pk not in taken]
+        try:
+            with transaction.atomic():
+                reservations = Reservation.objects.bulk_create(
+                    [Reservation(user=user, time_slot=slot) for slot in free]
+                )
+        except IntegrityError:
+            # A concurrent booking got in first: find out which, one insert each
+            reservations = []
+            for slot in free:
+                try:
+                    with transaction.atomic():
+                        reservations.append(Reservation.objects.create(user=user, time_slot=slot))
+                except IntegrityError:
+                    taken.add(slot.pk)
+            if all_or_nothing and taken:
+                raise SlotUnavailable(*sorted(keys[slot_id] for slot_id in taken))
+        else:
+            if reservations and reservations[0].pk is None:
+                # Backends that cannot return ids from a bulk insert
+                reservations = list(Reservation.objects.filter(
+                    user=user, time_slot__in=free, is_cancelled=False,
+                ).select_related('time_slot'))
+            # bulk_create() bypasses save(), which does this per reservation
+            for reservation in reservations:
+                reservation.invalidate_availability(slot_available=False)
+        queue_booking_confirmations(reservations)
+
+    for slot in time_slots:
+        if slot.pk not in taken:
+            slot.is_available = False
+    return (
+        {keys[reservation.time_slot_id]: reservation for reservation in reservations},
+        {keys[slot_id] for slot_id in taken},
+    )
+
+
+def join_waitlist(user, time_slot):
+    """
+    Queue user for the booked time_slot. Returns (entry, created); joining
+    twice keeps the original place. Raises SlotAvailable when the slot is
+    free and AlreadyBooked when user holds it.
+    """
+    with booking_transaction():
+        if connection.features.has_select_for_update:
+            list(TimeSlot.objects.select_for_update().filter(pk=time_slot.pk).values_list('pk'))
+        holder = Reservation.objects.filter(
+            time_slot=time_slot, is_cancelled=False,
+        ).values_list('user_id', flat=True).first()
+        if holder is None:
+            raise SlotAvailable(time_slot.pk)
+        if holder == user.pk:
+            raise AlreadyBooked(time_slot.pk)
+        return WaitlistEntry.objects.get_or_create(time_slot=time_slot, user=user)
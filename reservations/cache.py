@@ -0,0 +1,312 @@
+# reservations/cache.py
+"""
+Versioned cache of facility-day availability.
+
+What is cached for a facility-day is its stored slots with their
+availability; the grid itself is recomputed per request from the facility's
+hours, so slots that start in the meantime drop out on time.
+
+Entries are never deleted. Their keys embed a facility version and a
+facility-day version, and invalidation bumps the version once the writing
+transaction has committed. A reader that raced with a write can only store
+its result under the old version, which nobody asks for any more, so a
+booked slot is never served as free by a process that sees the bump.
+Versions start from a random value, so a version key lost to eviction
+cannot resurrect an old entry.
+
+That holds across workers only when the cache alias is shared (Redis when
+REDIS_URL is set). With the default per-process locmem alias, a bump reaches
+the writing process alone; the others serve their day rows for up to
+TIMEOUT seconds. Bookings still check the database, so a stale listing
+leads to a conflict, never to a double booking.
+"""
+import secrets
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+PREFIX = 'reservations:availability'
+
+
+def is_per_process(cache):
+    """Whether cache lives in this process only, so other workers never see its writes"""
+    return isinstance(cache, LocMemCache)
+
+
+def _setting(name, default):
+    return getattr(settings, 'RESERVATIONS_AVAILABILITY_CACHE', {}).get(name, default)
+
+
+class AvailabilityCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[_setting('ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        return _setting('TIMEOUT', 300)
+
+    @staticmethod
+    def facility_version_key(facility_id):
+        return f'{PREFIX}:version:{facility_id}'
+
+    @staticmethod
+    def day_version_key(facility_id, day):
+        return f'{PREFIX}:version:{facility_id}:{day.isoformat()}'
+
+    def _versions(self, keys):
+        versions = self.cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.cache.add(key, secrets.randbits(48), None)
+                versions[key] = self.cache.get(key)
+        return versions
+
+    async def _aversions(self, keys):
+        versions = await self.cache.aget_many(keys)
+        for key in keys:
+            if key not in versions:
+                await self.cache.aadd(key, secrets.randbits(48), None)
+                versions[key] = await self.cache.aget(key)
+        return versions
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get_facility(self, facility_id, load):
+        """
+        Cached field values of a facility; load(facility_id) returns a dict
+        of them, or None when it does not exist (which is not cached).
+        """
+        version_key = self.facility_version_key(facility_id)
+        version = self._versions([version_key])[version_key]
+        key = f'{PREFIX}:facility:{facility_id}:{version}'
+        fields = self.cache.get(key)
+        self._count(fields is not None, fields is None)
+        if fields is None:
+            fields = load(facility_id)
+            if fields is not None:
+                self.cache.set(key, fields, self.timeout)
+        return fields
+
+    async def aget_facility(self, facility_id, aload):
+        """get_facility() for async views; aload is a coroutine function"""
+        version_key = self.facility_version_key(facility_id)
+        version = (await self._aversions([version_key]))[version_key]
+        key = f'{PREFIX}:facility:{facility_id}:{version}'
+        fields = await self.cache.aget(key)
+        self._count(fields is not None, fields is None)
+        if fields is None:
+            fields = await aload(facility_id)
+            if fields is not None:
+                await self.cache.aset(key, fields, self.timeout)
+        return fields
+
+    def _day_version_keys(self, keys):
+        version_keys = set()
+        for facility_id, day in keys:
+            version_keys.add(self.facility_version_key(facility_id))
+            version_keys.add(self.day_version_key(facility_id, day))
+        return list(version_keys)
+
+    def _day_data_keys(self, keys, versions):
+        return {
+            (facility_id, day): '{}:day:{}:{}:{}:{}'.format(
+                PREFIX, facility_id, versions[self.facility_version_key(facility_id)],
+                day.isoformat(), versions[self.day_version_key(facility_id, day)],
+            )
+            for facility_id, day in keys
+        }
+
+    def _split(self, data_keys, cached):
+        """(rows found in the cache by key, keys that missed)"""
+        result = {
+            key: cached[data_key] for key, data_key in data_keys.items()
+            if data_key in cached
+        }
+        missing = [key for key in data_keys if key not in result]
+        self._count(len(result), len(missing))
+        return result, missing
+
+    def get_days(self, keys, load):
+        """
+        Cached rows of each (facility_id, date) in keys. load(missing) is
+        called once with the keys that missed and returns {key: rows}.
+        """
+        data_keys = self._day_data_keys(keys, self._versions(self._day_version_keys(keys)))
+        result, missing = self._split(data_keys, self.cache.get_many(list(data_keys.values())))
+        if missing:
+            loaded = load(missing)
+            self.cache.set_many(
+                {data_keys[key]: loaded.get(key, []) for key in missing}, self.timeout
+            )
+            result.update({key: loaded.get(key, []) for key in missing})
+        return result
+
+    def peek_days(self, keys):
+        """
+        The cached rows of those keys that are cached; nothing is loaded,
+        counted or written. A day without a version was never cached.
+        """
+        versions = self.cache.get_many(self._day_version_keys(keys))
+        data_keys = self._day_data_keys([
+            (facility_id, day) for facility_id, day in keys
+            if self.facility_version_key(facility_id) in versions and self.day_version_key(facility_id, day) in versions
+        ], versions)
+        cached = self.cache.get_many(list(data_keys.values()))
+        return {key: cached[data_key] for key, data_key in data_keys.items() if data_key in cached}
+
+    async def aget_days(self, keys, aload):
+        """get_days() for async views; aload is a coroutine function"""
+        versions = await self._aversions(self._day_version_keys(keys))
+        data_keys = self._day_data_keys(keys, versions)
+        result, missing = self._split(data_keys, await self.cache.aget_many(list(data_keys.values())))
+        if missing:
+            loaded = await aload(missing)
+            await self.cache.aset_many(
+                {data_keys[key]: loaded.get(key, []) for key in missing}, self.timeout
+            )
+            result.update({key: loaded.get(key, []) for key in missing})
+        return result
+
+    def _bump(self, key):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # No version yet: nothing was cached under this key.
+            pass
+
+    def invalidate_day(self, facility_id, day):
+        """Invalidate a facility-day once the current transaction commits"""
+        transaction.on_commit(lambda: self._bump(self.day_version_key(facility_id, day)))
+
+    def invalidate_facility(self, facility_id):
+        """Invalidate a facility and all its days once the transaction commits"""
+        transaction.on_commit(lambda: self._bump(self.facility_version_key(facility_id)))
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / lookups, 4) if lookups else None,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+availability_cache = AvailabilityCache()
+
+
+FACILITY_FIELDS = ('id', 'opening_time', 'closing_time', 'slot_duration', 'schedule_mode')
+
+
+def upcoming_closures(facility_id):
+    from django.utils import timezone
+    from .models import FacilityClosure
+
+    return FacilityClosure.objects.filter(
+        facility_id=facility_id, date__gte=timezone.localdate(),
+    ).values_list('date', 'start_time', 'end_time')
+
+
+def load_facility_fields(facility_id):
+    """The fields the grid needs, and upcoming closures in interval mode"""
+    from .models import SportFacility
+
+    fields = SportFacility.objects.filter(pk=facility_id).values(*FACILITY_FIELDS).first()
+    if fields is not None and fields['schedule_mode'] == SportFacility.INTERVALS:
+        fields['closures'] = list(upcoming_closures(facility_id))
+    return fields
+
+
+async def aload_facility_fields(facility_id):
+    from .models import SportFacility
+
+    fields = await SportFacility.objects.filter(pk=facility_id).values(*FACILITY_FIELDS).afirst()
+    if fields is not None and fields['schedule_mode'] == SportFacility.INTERVALS:
+        fields['closures'] = [row async for row in upcoming_closures(facility_id)]
+    return fields
+
+
+def day_rows_queryset(keys):
+    from .models import TimeSlot
+
+    return TimeSlot.objects.with_availability().filter(
+        facility_id__in={facility_id for facility_id, _ in keys},
+        date__in={day for _, day in keys},
+    ).order_by().values_list('facility_id', 'date', 'id', 'start_time', 'end_time', 'is_available')
+
+
+def load_day_rows(keys):
+    """Stored slots of each (facility_id, date) as (id, start, end, is_available)"""
+    result = {key: [] for key in keys}
+    for facility_id, day, *row in day_rows_queryset(keys):
+        if (facility_id, day) in result:
+            result[(facility_id, day)].append(tuple(row))
+    return result
+
+
+async def aload_day_rows(keys):
+    result = {key: [] for key in keys}
+    async for facility_id, day, *row in day_rows_queryset(keys):
+        if (facility_id, day) in result:
+            result[(facility_id, day)].append(tuple(row))
+    return result
+
+
+def facility_from_fields(fields):
+    from .models import SportFacility
+
+    if fields is None:
+        return None
+    fields = dict(fields)
+    closures = fields.pop('closures', None)
+    facility = SportFacility(**fields)
+    if closures is not None:
+        facility.cached_closures = closures
+    return facility
+
+
+def cached_facility(facility_id):
+    """An unsaved-looking SportFacility carrying the fields the grid needs, or None"""
+    return facility_from_fields(availability_cache.get_facility(facility_id, load_facility_fields))
+
+
+async def acached_facility(facility_id):
+    return facility_from_fields(await availability_cache.aget_facility(facility_id, aload_facility_fields))
+
+
+def day_slots(facility, day, rows):
+    from .models import TimeSlot
+
+    return [
+        TimeSlot(id=slot_id, facility=facility, date=day, start_time=start_time,
+                 end_time=end_time, is_available=is_available)
+        for slot_id, start_time, end_time, is_available in rows
+    ]
+
+
+def cached_day_slots(facility, day):
+    """The stored slots of a facility-day, annotated with availability"""
+    rows = availability_cache.get_days([(facility.id, day)], load_day_rows)[(facility.id, day)]
+    return day_slots(facility, day, rows)
+
+
+async def acached_day_slots(facility, day):
+    rows = (await availability_cache.aget_days([(facility.id, day)], aload_day_rows))[(facility.id, day)]
+    return day_slots(facility, day, rows)
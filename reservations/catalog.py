@@ -0,0 +1,48 @@
+# reservations/catalog.py
+"""
+The facility catalog: a compact listing of every facility that changes only
+when a facility does.
+
+Its version comes from one aggregate query over the facilities table: the
+count, the highest id and the latest updated_at. Any save, creation or
+deletion changes it, with no shared counter row for writers to contend on.
+It is the ETag and Last-Modified of /api/facilities/catalog/, so a client
+revalidating with a conditional GET costs that query and nothing else. Full
+responses are cached per version, so they are serialized once per change.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+PREFIX = 'reservations:catalog'
+TIMEOUT = 3600
+
+
+def catalog_version():
+    """(etag, last_modified) of the catalog; last_modified is None when it is empty"""
+    from .models import SportFacility
+
+    stats = SportFacility.objects.aggregate(count=Count('id'), last_id=Max('id'), modified=Max('updated_at'))
+    modified = stats['modified']
+    version = f"{stats['count']}:{stats['last_id']}:{modified.isoformat() if modified else ''}"
+    return f'"{hashlib.sha1(version.encode()).hexdigest()[:16]}"', modified
+
+
+def catalog_data(request, etag):
+    """The serialized catalog of version etag, for the host of request"""
+    from .models import SportFacility
+    from .serializers import FacilityCatalogSerializer
+
+    # Thumbnail URLs are absolute, so they depend on the host
+    version = etag.strip('"')
+    key = f'{PREFIX}:{version}:{request.get_host()}'
+    data = cache.get(key)
+    if data is None:
+        facilities = SportFacility.objects.only(
+            'id', 'name', 'facility_type', 'description', 'thumbnail', 'schedule_mode',
+            'opening_time', 'closing_time', 'slot_duration',
+        ).order_by('id')
+        data = FacilityCatalogSerializer(facilities, many=True, context={'request': request}).data
+        cache.set(key, data, TIMEOUT)
+    return data
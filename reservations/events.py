@@ -0,0 +1,190 @@
+# reservations/events.py
+"""
+Push of availability changes to subscribed clients.
+
+Booking or freeing a slot publishes a small event on the channel of its
+facility-day once the transaction commits. A broadcaster fans events out to
+the subscriptions of this process, which the server-sent events endpoint
+(async_views.time_slot_events) streams to clients. RedisBroadcaster relays
+events through Redis pub/sub so every node sees every booking.
+
+Events carry the slot's new state rather than a difference, so receiving
+one twice, or one the snapshot already reflects, is harmless.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Sent instead of the events a slow subscriber missed; the client refetches.
+RESYNC = {'type': 'resync'}
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_EVENTS', {}).get(name, default)
+
+
+def slot_channel(facility_id, day):
+    return f'{facility_id}:{day.isoformat()}'
+
+
+class Subscription:
+    """
+    Queue of the events of one channel for a consumer on an event loop.
+    Used as an async context manager, which registers it for its duration.
+    """
+
+    def __init__(self, broadcaster, channel, queue_size):
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+
+    async def __aenter__(self):
+        self.broadcaster.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broadcaster.remove(self)
+
+    def put(self, event):
+        """Deliver an event; safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The consumer's event loop is gone
+            self.broadcaster.remove(self)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout=None):
+        """The next event; raises TimeoutError after timeout seconds"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class LocalBroadcaster:
+    """Fan-out to the subscriptions of this process"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel, self.queue_size)
+
+    def add(self, subscription):
+        with self._lock:
+            self._subscriptions[subscription.channel].add(subscription)
+
+    def remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscriptions.get(channel, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, channel, event):
+        self.deliver(channel, event)
+
+    def deliver(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class RedisBroadcaster(LocalBroadcaster):
+    """
+    Publishes through Redis pub/sub; a listener thread, started with the
+    first subscription, delivers the events of all nodes locally.
+    """
+
+    def __init__(self, url, prefix='reservations:events:', **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroadcaster requires the redis package.') from None
+        super().__init__(**options)
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._listener = None
+
+    def publish(self, channel, event):
+        self.client.publish(self.prefix + channel, json.dumps(event))
+
+    def add(self, subscription):
+        super().add(subscription)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self.listen, name='reservations-events', daemon=True)
+                self._listener.start()
+
+    def listen(self):
+        reconnecting = False
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                if reconnecting:
+                    # Events published meanwhile are lost; have everyone refetch
+                    self.deliver_all(RESYNC)
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    self.deliver(channel, json.loads(message['data']))
+            except self.redis.RedisError:
+                logger.warning('Lost the Redis event subscription, reconnecting', exc_info=True)
+                reconnecting = True
+                time.sleep(1)
+
+    def deliver_all(self, event):
+        with self._lock:
+            subscriptions = [s for channel in self._subscriptions.values() for s in channel]
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+@lru_cache(maxsize=None)
+def get_broadcaster():
+    backend = import_string(setting('BACKEND', 'reservations.events.LocalBroadcaster'))
+    return backend(**setting('OPTIONS', {}))
+
+
+def publish_slot_change(time_slot, is_available):
+    """Publish the new availability of time_slot once the transaction commits"""
+    event = {
+        'type': 'slot',
+        'id': time_slot.id,
+        'facility': time_slot.facility_id,
+        'date': time_slot.date.isoformat(),
+        'start_time': time_slot.start_time.isoformat(),
+        'end_time': time_slot.end_time.isoformat(),
+        'is_available': is_available,
+    }
+    channel = slot_channel(time_slot.facility_id, time_slot.date)
+    # robust: a broadcaster outage is logged, it must not fail the booking
+    transaction.on_commit(lambda: get_broadcaster().publish(channel, event), robust=True)
@@ -0,0 +1,97 @@
+# reservations/filters.py
+"""
+Query parameter filters shared by the list endpoints.
+
+Every filter maps onto a composite index declared on the models, so that a
+filtered, keyset-paginated page is a single index range scan.
+"""
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+TRUE_VALUES = {'1', 'true', 'yes'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+
+def param_int(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+
+
+def param_int_list(params, name):
+    """Comma separated integers, e.g. ?facility_ids=1,2,3"""
+    value = params.get(name)
+    if value in (None, ''):
+        return []
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValidationError({name: 'A comma separated list of integers is required.'})
+
+
+def param_date(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Date has wrong format. Use YYYY-MM-DD.'})
+    return parsed
+
+
+def param_bool(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValidationError({name: 'Must be true or false.'})
+
+
+def filter_time_slots(queryset, params):
+    """
+    facility_id, date, date_after, date_before and available.
+    The queryset must carry the availability annotation.
+    """
+    facility_id = param_int(params, 'facility_id')
+    if facility_id is not None:
+        queryset = queryset.filter(facility_id=facility_id)
+    date = param_date(params, 'date')
+    if date is not None:
+        queryset = queryset.filter(date=date)
+    date_after = param_date(params, 'date_after')
+    if date_after is not None:
+        queryset = queryset.filter(date__gte=date_after)
+    date_before = param_date(params, 'date_before')
+    if date_before is not None:
+        queryset = queryset.filter(date__lte=date_before)
+    available = param_bool(params, 'available')
+    if available is not None:
+        queryset = queryset.filter(is_available=available)
+    return queryset
+
+
+def filter_reservations(queryset, params):
+    """facility_id, date_after, date_before (slot dates) and active"""
+    facility_id = param_int(params, 'facility_id')
+    if facility_id is not None:
+        queryset = queryset.filter(time_slot__facility_id=facility_id)
+    date_after = param_date(params, 'date_after')
+    if date_after is not None:
+        queryset = queryset.filter(time_slot__date__gte=date_after)
+    date_before = param_date(params, 'date_before')
+    if date_before is not None:
+        queryset = queryset.filter(time_slot__date__lte=date_before)
+    active = param_bool(params, 'active')
+    if active is not None:
+        queryset = queryset.filter(is_cancelled=not active)
+    return queryset
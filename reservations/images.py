@@ -0,0 +1,35 @@
+# reservations/images.py
+"""
+Facility image thumbnails, rendered once when an image is uploaded so that
+listings never ship the full-size file.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+THUMBNAIL_SIZE = (480, 320)
+
+
+def render_thumbnail(image, size=THUMBNAIL_SIZE):
+    """A JPEG ContentFile of image (a FieldFile) scaled down to fit within size"""
+    from PIL import Image, ImageOps
+
+    image.open('rb')
+    try:
+        with Image.open(image.file) as picture:
+            picture = ImageOps.exif_transpose(picture)
+            picture.thumbnail(size)
+            if picture.mode not in ('RGB', 'L'):
+                picture = picture.convert('RGB')
+            buffer = BytesIO()
+            picture.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+    finally:
+        # The upload itself is written to storage after this
+        image.seek(0)
+    return ContentFile(buffer.getvalue())
+
+
+def thumbnail_name(image_name):
+    """facilities/court.png -> court.jpg, saved under the thumbnail's upload_to"""
+    return os.path.splitext(os.path.basename(image_name))[0] + '.jpg'
@@ -0,0 +1,258 @@
+# reservations/intake.py
+"""
+Surge mode: queued booking intake.
+
+When RESERVATIONS_SURGE['ENABLED'] is set, booking attempts do not race for
+the slot rows. They join one FIFO queue served by a single writer thread per
+process, first come first served. Every slot has a bounded share of that
+queue. Once a slot is taken, attempts still queued for it, and new ones, are
+turned away without touching the database. The client waits for its
+attempt's outcome, so it still gets a 201 or 409 straight away. Per-user
+limits are a DRF throttle, BookingRateThrottle.
+
+Across processes, the unique constraint on active reservations remains the
+final arbiter. The queue only bounds contention to one writer per process.
+"""
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils.dateparse import parse_date, parse_time
+from rest_framework.throttling import UserRateThrottle
+
+from .booking import SlotUnavailable
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_SURGE', {}).get(name, default)
+
+
+class IntakeFull(Exception):
+    """Too many attempts are already queued for the slot."""
+
+
+class IntakeTimeout(Exception):
+    """The attempt was not picked up in time; it was withdrawn unprocessed."""
+
+
+class Attempt:
+    def __init__(self, key, book):
+        self.key = key
+        self.book = book
+        self.enqueued = time.monotonic()
+        self.state = 'queued'  # -> 'running' -> 'done', or 'withdrawn'
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.wait = None
+
+
+class BookingIntake:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = defaultdict(int)
+        self._taken = {}  # key -> monotonic expiry
+        self._worker = None
+        self._waits = deque(maxlen=1000)
+        self.counters = defaultdict(int)
+        self.wait_total = 0.0
+
+    def submit(self, key, book, timeout=None):
+        """
+        Queue book() for the slot identified by key and return its result.
+        Raises SlotUnavailable without queueing when the slot is known to be
+        taken, IntakeFull when its share of the queue is used up and
+        IntakeTimeout when the attempt is not picked up within timeout.
+        """
+        timeout = setting('TIMEOUT', 10) if timeout is None else timeout
+        attempt = Attempt(key, book)
+        with self._lock:
+            if self._is_taken(key):
+                self.counters['rejected'] += 1
+                raise SlotUnavailable(key)
+            if self._pending[key] >= setting('QUEUE_SIZE', 20):
+                self.counters['overflow'] += 1
+                raise IntakeFull(key)
+            self._pending[key] += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='booking-intake', daemon=True)
+                self._worker.start()
+        self._queue.put(attempt)
+
+        if not attempt.done.wait(timeout):
+            with self._lock:
+                if attempt.state == 'queued':
+                    attempt.state = 'withdrawn'
+                    self.counters['timeouts'] += 1
+                    raise IntakeTimeout(key)
+            # Already being booked: the outcome is moments away
+            attempt.done.wait()
+        if attempt.error is not None:
+            raise attempt.error
+        return attempt.result, attempt.wait
+
+    def shutdown(self):
+        """Stop the writer thread once the queued attempts are served, and close its connection"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def forget(self, *keys):
+        """The slots are free again, e.g. after a cancellation"""
+        with self._lock:
+            for key in keys:
+                self._taken.pop(key, None)
+
+    def _is_taken(self, key):
+        expiry = self._taken.get(key)
+        if expiry is not None and expiry < time.monotonic():
+            del self._taken[key]
+            return False
+        return expiry is not None
+
+    def _mark_taken(self, *keys):
+        expiry = time.monotonic() + setting('TAKEN_TTL', 30)
+        with self._lock:
+            for key in keys:
+                self._taken[key] = expiry
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _run(self):
+        while True:
+            attempt = self._queue.get()
+            if attempt is None:
+                connection.close()
+                return
+            with self._lock:
+                withdrawn = attempt.state == 'withdrawn'
+                taken = self._is_taken(attempt.key)
+                attempt.state = 'running'
+            attempt.wait = time.monotonic() - attempt.enqueued
+            try:
+                if not withdrawn:
+                    self._process(attempt, taken)
+            finally:
+                with self._lock:
+                    self._pending[attempt.key] -= 1
+                    if not self._pending[attempt.key]:
+                        del self._pending[attempt.key]
+                    if not withdrawn:
+                        self._waits.append(attempt.wait)
+                        self.wait_total += attempt.wait
+                        self.counters['processed'] += 1
+                attempt.state = 'done'
+                attempt.done.set()
+                close_old_connections()
+
+    def _process(self, attempt, taken):
+        if taken:
+            self._count('rejected')
+            attempt.error = SlotUnavailable(attempt.key)
+            return
+        try:
+            attempt.result = attempt.book()
+            time_slot = getattr(attempt.result, 'time_slot', None)
+            self._mark_taken(attempt.key, *(slot_keys(time_slot) if time_slot else ()))
+            self._count('accepted')
+        except SlotUnavailable as exc:
+            self._mark_taken(attempt.key)
+            self._count('conflicts')
+            attempt.error = exc
+        except Exception as exc:
+            # Handed to the waiting request; the writer carries on
+            self._count('errors')
+            attempt.error = exc
+
+    def stats(self):
+        with self._lock:
+            depths = list(self._pending.values())
+            waits = sorted(self._waits)
+            counters = dict(self.counters)
+            wait_total = self.wait_total
+
+        def quantile(q):
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 3) if waits else None
+
+        return {
+            'depth': sum(depths),
+            'max_slot_depth': max(depths, default=0),
+            'queued_slots': len(depths),
+            'wait_ms': {
+                'p50': quantile(0.5), 'p99': quantile(0.99),
+                'max': round(waits[-1] * 1000, 3) if waits else None,
+            },
+            'wait_seconds_total': round(wait_total, 6),
+            **{name: counters.get(name, 0) for name in (
+                'processed', 'accepted', 'conflicts', 'rejected', 'overflow', 'timeouts', 'errors',
+            )},
+        }
+
+
+_intake = None
+_intake_lock = threading.Lock()
+
+
+def get_intake():
+    """The process's BookingIntake in surge mode, else None"""
+    global _intake
+    if not setting('ENABLED', False):
+        return None
+    with _intake_lock:
+        if _intake is None:
+            _intake = BookingIntake()
+        return _intake
+
+
+def reset_intake():
+    """Shut the process's BookingIntake down; the next get_intake() starts afresh"""
+    global _intake
+    with _intake_lock:
+        intake, _intake = _intake, None
+    if intake is not None:
+        intake.shutdown()
+
+
+def intake_key(data):
+    """Queue key of the slot a booking request targets"""
+    if data.get('time_slot'):
+        return ('slot', str(data['time_slot']))
+    return ('grid', str(data.get('facility')), _iso(parse_date, data.get('date')),
+            _iso(parse_time, data.get('start_time')))
+
+
+def _iso(parse, value):
+    try:
+        parsed = parse(str(value or ''))
+    except ValueError:
+        parsed = None
+    return parsed.isoformat() if parsed else str(value)
+
+
+def slot_keys(time_slot):
+    """Both queue keys a slot can be booked under"""
+    return (
+        ('slot', str(time_slot.id)),
+        ('grid', str(time_slot.facility_id), time_slot.date.isoformat(), time_slot.start_time.isoformat()),
+    )
+
+
+class BookingRateThrottle(UserRateThrottle):
+    """Per-user limit on booking attempts, applied in surge mode only"""
+    scope = 'booking'
+
+    def get_rate(self):
+        return setting('RATE', '10/min')
+
+    def allow_request(self, request, view):
+        if request.method != 'POST' or get_intake() is None:
+            return True
+        return super().allow_request(request, view)
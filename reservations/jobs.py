@@ -0,0 +1,180 @@
+# reservations/jobs.py
+"""
+A job queue in the database, so maintenance and notifications run off the
+request path without an outside broker.
+
+Tasks are functions registered with @task (see tasks.py) and queued with
+enqueue(name, **payload). The payload must be JSON. Queuing inserts a Job
+row in the caller's transaction, so a job queued by a booking that rolls
+back never runs. The run_jobs command claims due jobs with a single
+UPDATE, so two workers never run the same job. Failed jobs are retried
+with exponential backoff, up to max_attempts. Jobs of a worker that died
+are queued again after RESERVATIONS_JOBS['LOCK_TIMEOUT'], or fail if that
+was their last attempt.
+
+RESERVATIONS_JOBS['PERIODIC'] maps task names to intervals in seconds;
+workers keep one pending job of each queued, timed from the last run.
+"""
+import logging
+import os
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+logger = logging.getLogger('reservations.jobs')
+
+tasks = {}
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_JOBS', {}).get(name, default)
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Register func as a task, under its own name unless name is given"""
+    def register(func):
+        func.task_name = name or func.__name__
+        func.max_attempts = max_attempts
+        tasks[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    import_module('reservations.tasks')
+    try:
+        return tasks[name]
+    except KeyError:
+        raise LookupError(f'No task named {name!r}.') from None
+
+
+def enqueue(name, run_at=None, delay=None, key='', **payload):
+    """
+    Queue the task name to run with payload as keyword arguments, at
+    run_at, after delay seconds or as soon as possible. With a key, nothing
+    is queued while a job of the same key is pending; None is returned.
+    """
+    from .models import Job
+
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    max_attempts = get_task(name).max_attempts or setting('MAX_ATTEMPTS', 5)
+    job = Job(name=name, payload=payload, run_at=run_at, max_attempts=max_attempts, key=key)
+    if not key:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def enqueue_many(name, payloads, run_at=None):
+    """enqueue() of a task for each payload dict, in one INSERT"""
+    from .models import Job
+
+    run_at = run_at or timezone.now()
+    max_attempts = get_task(name).max_attempts or setting('MAX_ATTEMPTS', 5)
+    return Job.objects.bulk_create([
+        Job(name=name, payload=payload, run_at=run_at, max_attempts=max_attempts) for payload in payloads
+    ])
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_jobs(worker, limit):
+    """Mark up to limit due jobs as running for worker and return them"""
+    from .models import Job
+
+    now = timezone.now()
+    claim = f'{worker}:{uuid.uuid4().hex[:8]}'
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    # One statement: a job already claimed by another worker no longer matches
+    claimed = Job.objects.filter(pk__in=Subquery(due.values('pk')[:limit]), status=Job.QUEUED).update(
+        status=Job.RUNNING, locked_by=claim, locked_at=now, attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return []
+    return list(Job.objects.filter(locked_by=claim, status=Job.RUNNING).order_by('run_at', 'id'))
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome: done, retried later or failed"""
+    from .models import Job
+
+    try:
+        get_task(job.name)(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.exception('Job %s failed after %d attempt(s)', job, job.attempts)
+        else:
+            job.status = Job.QUEUED
+            retry_in = setting('RETRY_DELAY', 30) * 2 ** (job.attempts - 1)
+            job.run_at = timezone.now() + timedelta(seconds=retry_in)
+            logger.warning('Job %s failed, retrying in %ds', job, retry_in, exc_info=True)
+    else:
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'run_at', 'last_error', 'finished_at'])
+    return job.status
+
+
+def requeue_stale_jobs():
+    """
+    Queue again the running jobs whose worker has not finished them in
+    LOCK_TIMEOUT. Those that used all their attempts fail instead, so a job
+    that takes its worker down is not claimed forever. Returns how many
+    were queued again.
+    """
+    from .models import Job
+
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=setting('LOCK_TIMEOUT', 600)),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, last_error='Worker lost while running the job.',
+    )
+    if failed:
+        logger.error('%d job(s) failed: their worker was lost on the last attempt', failed)
+    return stale.update(status=Job.QUEUED, run_at=now)
+
+
+def schedule_periodic_jobs():
+    """Queue each PERIODIC task that has no pending job, an interval after its last run"""
+    from .models import Job
+
+    now = timezone.now()
+    for name, interval in setting('PERIODIC', {}).items():
+        key = f'periodic:{name}'
+        if Job.objects.filter(key=key, status__in=(Job.QUEUED, Job.RUNNING)).exists():
+            continue
+        last_run = Job.objects.filter(name=name, status__in=(Job.DONE, Job.FAILED)).order_by(
+            '-finished_at',
+        ).values_list('finished_at', flat=True).first()
+        run_at = now if last_run is None else max(now, last_run + timedelta(seconds=interval))
+        enqueue(name, run_at=run_at, key=key)
+
+
+def run_due_jobs(worker, limit=None):
+    """One worker pass: schedule, claim and run due jobs. Returns how many ran."""
+    requeue_stale_jobs()
+    schedule_periodic_jobs()
+    jobs = claim_jobs(worker, limit or setting('BATCH_SIZE', 10))
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
@@ -0,0 +1,56 @@
+import gzip
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reservations.archive import archive_history
+from reservations.slots import purge_time_slots
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_ARCHIVE', {}).get(name, default)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move slots older than the retention period, with their reservations, '
+        'to the archive tables (or a gzipped JSON lines file) and purge the '
+        'unreserved ones, keeping the hot tables sized to the booking horizon'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=setting('RETENTION_DAYS', 90),
+                            help='Keep slots of this many past days (default: RESERVATIONS_ARCHIVE)')
+        parser.add_argument('--batch-size', type=int, default=setting('BATCH_SIZE', 1000),
+                            help='Slots moved per transaction (default: RESERVATIONS_ARCHIVE)')
+        parser.add_argument('--export', metavar='PATH',
+                            help='Append to this .jsonl.gz file instead of the archive tables')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be done without writing')
+
+    def handle(self, *args, **options):
+        retention, batch_size = options['retention_days'], options['batch_size']
+        export, dry_run = options['export'], options['dry_run']
+        if retention < 0 or batch_size < 1:
+            raise CommandError('--retention-days cannot be negative and --batch-size must be positive.')
+
+        started = time.perf_counter()
+        cutoff = timezone.localdate() - timedelta(days=retention)
+        exporting = export and not dry_run
+        with gzip.open(export, 'at', encoding='utf-8') if exporting else nullcontext() as stream:
+            slots, reservations = archive_history(cutoff, batch_size, dry_run, export=stream)
+        purged = purge_time_slots(cutoff, batch_size, dry_run)
+
+        prefix = '[dry run] ' if dry_run else ''
+        target = export or 'the archive tables'
+        self.stdout.write(
+            f'{prefix}Moved {slots} slot(s) and {reservations} reservation(s) before {cutoff} to {target}, '
+            f'purged {purged} unreserved slot(s)'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Done in {time.perf_counter() - started:.2f}s'
+        ))
@@ -1,39 +1,95 @@
-from django.core.management.base import BaseCommand
-from reservations.models import TimeSlot, SportFacility
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 from django.utils import timezone
-from datetime import timedelta, datetime, date as dt_date
+
+from reservations.models import SportFacility
+from reservations.slots import extend_horizon, purge_time_slots
+
 
 class Command(BaseCommand):
-    help = 'Auto add time slots for all facilities for the next 7 days'
-
-    def handle(self, *args, **kwargs):
-        today = timezone.now().date()
-        for facility in SportFacility.objects.all():
-            for day in range(7):  # next 7 days
-                slot_date = today + timedelta(days=day)
-                current_time = datetime.combine(slot_date, facility.opening_time)
-                end_time = datetime.combine(slot_date, facility.closing_time)
-                slot_delta = timedelta(minutes=facility.slot_duration)
-
-                while current_time + slot_delta <= end_time:
-                    start = current_time.time()
-                    end = (current_time + slot_delta).time()
-
-                    slot, created = TimeSlot.objects.get_or_create(
-                        facility=facility,
-                        date=slot_date,
-                        start_time=start,
-                        end_time=end,
-                        defaults={'is_available': True}
+    help = (
+        'Keep every facility materialized up to a rolling horizon, generating '
+        'only the days past what is already there, and optionally purge old '
+        'unreserved slots'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Horizon length in days, today included (default: 7)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per INSERT/DELETE statement (default: 1000)')
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help='Delete unreserved slots older than this many days')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Facilities processed in parallel, PostgreSQL only (default: 1)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be done without writing')
+
+    def handle(self, *args, **options):
+        days, batch_size = options['days'], options['batch_size']
+        retention, workers = options['retention_days'], options['workers']
+        dry_run = options['dry_run']
+        if days < 1 or batch_size < 1 or workers < 1:
+            raise CommandError('--days, --batch-size and --workers must be positive.')
+        if retention is not None and retention < 0:
+            raise CommandError('--retention-days cannot be negative.')
+        if workers > 1 and connection.vendor != 'postgresql':
+            self.stderr.write(self.style.WARNING(
+                f'{connection.vendor} serializes writers; ignoring --workers={workers}.'
+            ))
+            workers = 1
+
+        started = time.perf_counter()
+        today = timezone.localdate()
+        until = today + timedelta(days=days - 1)
+        # Interval-mode facilities have no grid to keep materialized
+        facilities = list(SportFacility.objects.filter(schedule_mode=SportFacility.GRID).only(
+            'id', 'name', 'opening_time', 'closing_time', 'slot_duration', 'schedule_mode', 'slots_horizon'
+        ).order_by('id'))
+
+        def extend(facility):
+            try:
+                return facility, extend_horizon(facility, until, batch_size, dry_run)
+            finally:
+                if workers > 1:
+                    connection.close()
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(extend, facilities))
+        else:
+            results = [extend(facility) for facility in facilities]
+
+        extended = total_days = total_slots = 0
+        for facility, (generated_days, generated_slots) in results:
+            if generated_days:
+                extended += 1
+                total_days += generated_days
+                total_slots += generated_slots
+                if options['verbosity'] >= 2:
+                    self.stdout.write(
+                        f'{facility.name}: {generated_days} day(s), {generated_slots} slot(s)'
                     )
+        horizon_done = time.perf_counter()
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(
+            f'{prefix}Horizon {until}: {len(facilities)} facilities, {extended} extended, '
+            f'{total_days} day(s), {total_slots} slot(s) in {horizon_done - started:.2f}s'
+        )
 
-                    # Update availability based on reservation status
-                    slot.is_available = not slot.reservations.exists()
-                    slot.save()
+        if retention is not None:
+            cutoff = today - timedelta(days=retention)
+            purged = purge_time_slots(cutoff, batch_size, dry_run)
+            self.stdout.write(
+                f'{prefix}Purged {purged} unreserved slot(s) before {cutoff} '
+                f'in {time.perf_counter() - horizon_done:.2f}s'
+            )
 
-                    if created:
-                        self.stdout.write(
-                            self.style.SUCCESS(f"Created slot {start}-{end} for {facility.name} on {slot_date}")
-                        )
-                    
-                    current_time += slot_delta
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Done in {time.perf_counter() - started:.2f}s'
+        ))
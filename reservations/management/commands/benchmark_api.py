@@ -0,0 +1,111 @@
+import json
+import logging
+import platform
+import tempfile
+import uuid
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from reservations.benchmarks import Benchmark, compare
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the reservation API against a throwaway copy of the configured '
+        'database (SQLite or PostgreSQL) and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--facilities', type=int, default=10)
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Requests per sequential scenario (default: 200)')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads in the concurrent booking scenario, and requests '
+                                 'per burst in wsgi_vs_asgi (default: 8)')
+        parser.add_argument('--scenarios', default=','.join(Benchmark.SCENARIOS),
+                            help='Comma separated subset of: ' + ', '.join(Benchmark.SCENARIOS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Previous results JSON file to compare against')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(Benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as handle:
+                previous = json.load(handle)
+
+        # Without --output stdout carries the JSON report alone, for piping
+        messages = self.stdout if options['output'] else self.stderr
+        benchmark = Benchmark(
+            facilities=options['facilities'], days=options['days'], users=options['users'],
+            iterations=options['iterations'], threads=options['threads'], seed=options['seed'],
+            log=messages.write if options['verbosity'] >= 1 else None,
+        )
+
+        # Same cache backend, separate namespace, so ids reused by the
+        # throwaway database cannot collide with real cache entries.
+        caches = {
+            alias: {**config, 'KEY_PREFIX': f'benchmark-{uuid.uuid4().hex}'}
+            for alias, config in settings.CACHES.items()
+        }
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        directory = None
+        if connection.vendor == 'sqlite' and not old_test_name:
+            # A file rather than Django's in-memory test database, so that
+            # journaling and locking behave as in production
+            directory = tempfile.TemporaryDirectory()
+            test_settings['NAME'] = f'{directory.name}/benchmark.sqlite3'
+        # Conflicts, lock errors and slow requests are expected and counted in the results
+        loggers = [logging.getLogger(name) for name in ('django.request', 'reservations.performance')]
+        for logger in loggers:
+            logger.disabled = True
+        setup_test_environment()
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            with override_settings(CACHES=caches):
+                results = benchmark.run(scenarios)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            if directory is not None:
+                directory.cleanup()
+            teardown_test_environment()
+            for logger in loggers:
+                logger.disabled = False
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'parameters': {
+                    key: options[key]
+                    for key in ('facilities', 'days', 'users', 'iterations', 'threads', 'seed')
+                },
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+        else:
+            self.stdout.write(json.dumps(report, indent=2, default=str))
+
+        if previous is not None:
+            for line in compare(previous.get('results', {}), results):
+                messages.write(line)
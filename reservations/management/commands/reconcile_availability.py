@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reservations.reconcile import reconcile_availability
+
+
+class Command(BaseCommand):
+    help = (
+        'Find upcoming slots whose cached availability, waitlist or place on '
+        'the grid drifted from their reservations and facility, and fix them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Only check this many days, today included (default: all upcoming)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Slots streamed and checked at a time (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be fixed without writing')
+
+    def handle(self, *args, **options):
+        days, chunk_size, dry_run = options['days'], options['chunk_size'], options['dry_run']
+        if (days is not None and days < 1) or chunk_size < 1:
+            raise CommandError('--days and --chunk-size must be positive.')
+
+        today = timezone.localdate()
+        end_date = today + timedelta(days=days - 1) if days is not None else None
+        counts = reconcile_availability(today, end_date, chunk_size, dry_run)
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(
+            f"{prefix}Checked {counts['slots']} slot(s): {counts['stale_days']} stale cached day(s), "
+            f"{counts['stranded_waitlists']} waitlist(s) on free slots ({counts['promoted']} promoted), "
+            f"{counts['off_grid']} off-grid slot(s) ({counts['off_grid_deleted']} deleted)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Done in {counts['seconds']:.2f}s"))
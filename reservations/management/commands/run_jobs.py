@@ -0,0 +1,51 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from reservations.jobs import run_due_jobs, setting, worker_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued jobs (slot horizons, archival, confirmation emails) and '
+        'the periodic ones of RESERVATIONS_JOBS, polling the job table. '
+        'Any number of workers may run side by side.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are due, then exit')
+        parser.add_argument('--poll-interval', type=float, default=setting('POLL_INTERVAL', 1.0),
+                            help='Seconds to sleep when no job is due (default: RESERVATIONS_JOBS)')
+        parser.add_argument('--batch-size', type=int, default=setting('BATCH_SIZE', 10),
+                            help='Jobs claimed at a time (default: RESERVATIONS_JOBS)')
+
+    def handle(self, *args, **options):
+        poll_interval, batch_size = options['poll_interval'], options['batch_size']
+        if poll_interval <= 0 or batch_size < 1:
+            raise CommandError('--poll-interval and --batch-size must be positive.')
+
+        worker = worker_name()
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True  # Finish the current batch, then exit
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+
+        total = 0
+        while True:
+            close_old_connections()
+            ran = run_due_jobs(worker, batch_size)
+            total += ran
+            if options['verbosity'] >= 2 and ran:
+                self.stdout.write(f'{worker}: ran {ran} job(s)')
+            if stopping or (options['once'] and not ran):
+                break
+            if not ran:
+                time.sleep(poll_interval)
+        self.stdout.write(self.style.SUCCESS(f'{worker}: ran {total} job(s)'))
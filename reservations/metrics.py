@@ -0,0 +1,242 @@
+# reservations/metrics.py
+"""
+In-process request metrics.
+
+PerformanceMiddleware times every request and the SQL it runs;
+PerformanceMixin adds serialization and rendering time for DRF views. Both
+feed the registry below, which renders the Prometheus text format served at
+/api/metrics/. Counters and histograms are cumulative since process start;
+latency quantiles are computed over a rolling window.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def setting(name, default):
+    return getattr(settings, 'RESERVATIONS_PERFORMANCE', {}).get(name, default)
+
+
+class RequestTimings:
+    """What one request spent where; attached to the request as request.timings"""
+
+    def __init__(self, keep_statements=5):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.queue = None  # seconds a booking waited in the surge-mode intake
+        self.keep_statements = keep_statements
+        self.slowest = []  # min-heap of (seconds, sql)
+
+    def record_query(self, sql, seconds):
+        self.queries += 1
+        self.db += seconds
+        entry = (seconds, sql)
+        if len(self.slowest) < self.keep_statements:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def serializing(self):
+        return _SerializeTimer(self)
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+
+# Timings of the request being served. A context variable rather than a
+# per-request execute_wrapper, because the async ORM runs queries on another
+# thread's connection; asgiref copies the context over to that thread.
+current_timings = ContextVar('reservations_request_timings', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    begin = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.record_query(sql, time.perf_counter() - begin)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver that adds record_query to each connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class _SerializeTimer:
+    """Times a block, minus the SQL it runs, as serialization"""
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        self.db_before = self.timings.db
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.begin
+        self.timings.serialize += elapsed - (self.timings.db - self.db_before)
+
+
+class Endpoint:
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.queries = 0
+        self.slow = 0
+        self.errors = 0
+        self.window = deque(maxlen=setting('WINDOW_SIZE', 1000))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(Endpoint)
+
+    def observe(self, method, endpoint, status, timings, total, slow):
+        with self._lock:
+            data = self._endpoints[(method, endpoint)]
+            data.count += 1
+            index = bisect.bisect_left(BUCKETS, total)
+            for i in range(index, len(BUCKETS)):
+                data.buckets[i] += 1
+            data.total += total
+            data.db += timings.db
+            data.serialize += timings.serialize
+            data.queries += timings.queries
+            data.slow += slow
+            data.errors += status >= 500
+            data.window.append((time.monotonic(), total))
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self):
+        """{(method, endpoint): dict of totals and window quantiles}"""
+        horizon = time.monotonic() - setting('WINDOW_SECONDS', 300)
+        with self._lock:
+            items = list(self._endpoints.items())
+            result = {}
+            for key, data in items:
+                recent = sorted(total for at, total in data.window if at >= horizon)
+                result[key] = {
+                    'count': data.count,
+                    'buckets': list(data.buckets),
+                    'total': data.total,
+                    'db': data.db,
+                    'serialize': data.serialize,
+                    'queries': data.queries,
+                    'slow': data.slow,
+                    'errors': data.errors,
+                    'quantiles': {
+                        q: recent[min(len(recent) - 1, int(q * len(recent)))]
+                        for q in QUANTILES
+                    } if recent else {},
+                }
+        return result
+
+    def render_prometheus(self, extra=()):
+        """Prometheus text exposition format (version 0.0.4)"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+
+        def labels(method, endpoint, **more):
+            pairs = {'method': method, 'endpoint': endpoint, **more}
+            return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs.items())
+
+        histogram = []
+        for (method, endpoint), data in sorted(snapshot.items()):
+            for bound, count in zip(BUCKETS, data['buckets']):
+                histogram.append(
+                    f'reservations_request_duration_seconds_bucket{{{labels(method, endpoint, le=bound)}}} {count}'
+                )
+            histogram.append(
+                f'reservations_request_duration_seconds_bucket{{{labels(method, endpoint, le="+Inf")}}} {data["count"]}'
+            )
+            histogram.append(f'reservations_request_duration_seconds_sum{{{labels(method, endpoint)}}} {data["total"]:.6f}')
+            histogram.append(f'reservations_request_duration_seconds_count{{{labels(method, endpoint)}}} {data["count"]}')
+        family('reservations_request_duration_seconds', 'histogram',
+               'Total request time since process start.', histogram)
+
+        window = [
+            f'reservations_request_duration_window_seconds{{{labels(method, endpoint, quantile=q)}}} {value:.6f}'
+            for (method, endpoint), data in sorted(snapshot.items())
+            for q, value in data['quantiles'].items()
+        ]
+        family('reservations_request_duration_window_seconds', 'summary',
+               'Request time quantiles over the rolling window.', window)
+
+        counters = (
+            ('reservations_request_db_seconds_total', 'db', 'Time spent in SQL.', '{:.6f}'),
+            ('reservations_request_serialize_seconds_total', 'serialize',
+             'Time spent serializing and rendering, SQL excluded.', '{:.6f}'),
+            ('reservations_request_queries_total', 'queries', 'SQL statements executed.', '{}'),
+            ('reservations_request_slow_total', 'slow', 'Requests over the slow threshold.', '{}'),
+            ('reservations_request_errors_total', 'errors', 'Responses with a 5xx status.', '{}'),
+        )
+        for name, key, help_text, fmt in counters:
+            family(name, 'counter', help_text, [
+                f'{name}{{{labels(method, endpoint)}}} {fmt.format(data[key])}'
+                for (method, endpoint), data in sorted(snapshot.items())
+            ])
+
+        for name, kind, help_text, value in extra:
+            family(name, kind, help_text, [f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class PerformanceMixin:
+    """
+    DRF view mixin that books serializer and renderer time on the request's
+    timings, for the Server-Timing header and the metrics registry.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        timings = getattr(self.request, 'timings', None)
+        if timings is not None:
+            to_representation = serializer.to_representation
+
+            def timed_to_representation(instance):
+                with timings.serializing():
+                    return to_representation(instance)
+
+            serializer.to_representation = timed_to_representation
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timings = getattr(request, 'timings', None)
+        if timings is not None and not getattr(response, 'is_rendered', True):
+            with timings.serializing():
+                response.render()
+        return response
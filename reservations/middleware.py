@@ -0,0 +1,110 @@
+# reservations/middleware.py
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+
+from .metrics import RequestTimings, current_timings, registry, setting
+
+logger = logging.getLogger('reservations.performance')
+
+
+class PerformanceMiddleware:
+    """
+    Times each request and the SQL it runs (see metrics.record_query). Adds a Server-Timing header,
+    feeds the metrics registry and logs the slowest statements of requests
+    over RESERVATIONS_PERFORMANCE['SLOW_REQUEST_MS'].
+
+    Runs natively under both WSGI and ASGI, so async views are not pushed
+    back onto a thread by this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = request.timings = RequestTimings(setting('SLOW_STATEMENTS', 5))
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = request.timings = RequestTimings(setting('SLOW_STATEMENTS', 5))
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        entries = [
+            f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+            f'serialize;dur={timings.serialize * 1000:.1f}',
+        ]
+        if timings.queue is not None:
+            entries.append(f'queue;dur={timings.queue * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(entries + [f'total;dur={total * 1000:.1f}'])
+
+        match = request.resolver_match
+        endpoint = (match.view_name or match.route) if match is not None else 'unmatched'
+        slow = total * 1000 >= setting('SLOW_REQUEST_MS', 500)
+        registry.observe(request.method, endpoint, response.status_code, timings, total, slow)
+        if slow:
+            logger.warning(
+                'Slow request %s %s: %.1f ms total, %.1f ms in %d queries, %.1f ms serializing\n%s',
+                request.method, request.get_full_path(), total * 1000, timings.db * 1000,
+                timings.queries, timings.serialize * 1000,
+                '\n'.join(f'  {seconds * 1000:.1f} ms: {sql}' for seconds, sql in timings.slowest_statements()),
+            )
+        return response
+
+
+def slim_api_path(path):
+    """
+    Whether path is served by the slim stack: under RESERVATIONS_SLIM_API['PREFIX']
+    but outside its EXCEPT prefixes (login and registration need sessions).
+    """
+    config = getattr(settings, 'RESERVATIONS_SLIM_API', {})
+    prefix = config.get('PREFIX')
+    return bool(prefix) and path.startswith(prefix) and not path.startswith(tuple(config.get('EXCEPT', ())))
+
+
+class SiteOnlyMixin:
+    """
+    Skips the middleware on slim API paths. The API authenticates with
+    tokens, so it has no use for sessions, request.user or messages, and
+    anonymous calls carrying a session cookie no longer load the session.
+    """
+
+    def __call__(self, request):
+        if slim_api_path(request.path_info):
+            # Under ASGI this is the coroutine the caller awaits
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SiteSessionMiddleware(SiteOnlyMixin, SessionMiddleware):
+    pass
+
+
+class SiteAuthenticationMiddleware(SiteOnlyMixin, AuthenticationMiddleware):
+    pass
+
+
+class SiteMessageMiddleware(SiteOnlyMixin, MessageMiddleware):
+    pass
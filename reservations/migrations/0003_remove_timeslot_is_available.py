@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0002_alter_timeslot_options_reservation_is_cancelled_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='timeslot',
+            name='is_available',
+        ),
+    ]
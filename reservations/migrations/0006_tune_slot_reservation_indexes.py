@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_reservation_reservation_user_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Composite indexes first, so the FK indexes they supersede are only
+        # dropped once a replacement exists.
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['time_slot', 'is_cancelled'], name='reservation_slot_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('is_cancelled', False)), fields=['user', 'created_at', 'id'], name='reservation_user_active_idx'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='time_slot',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='reservations.timeslot'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='facility',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='time_slots', to='reservations.sportfacility'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_tune_slot_reservation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sportfacility',
+            name='slots_horizon',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_sportfacility_slots_horizon'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sportfacility',
+            name='schedule_mode',
+            field=models.CharField(choices=[('grid', 'Slot grid'), ('intervals', 'Intervals')], default='grid', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='FacilityClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField(blank=True, null=True)),
+                ('end_time', models.TimeField(blank=True, null=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('facility', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='closures', to='reservations.sportfacility')),
+            ],
+            options={
+                'ordering': ['date', 'start_time'],
+                'indexes': [models.Index(fields=['facility', 'date'], name='closure_facility_date_idx')],
+            },
+        ),
+    ]
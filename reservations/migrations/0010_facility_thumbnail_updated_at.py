@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+# A frozen copy of reservations.images as of this migration, so that later
+# changes to that module cannot break a fresh migrate
+THUMBNAIL_SIZE = (480, 320)
+
+
+def render_thumbnail(image):
+    from PIL import Image, ImageOps
+
+    image.open('rb')
+    try:
+        with Image.open(image.file) as picture:
+            picture = ImageOps.exif_transpose(picture)
+            picture.thumbnail(THUMBNAIL_SIZE)
+            if picture.mode not in ('RGB', 'L'):
+                picture = picture.convert('RGB')
+            buffer = BytesIO()
+            picture.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+    finally:
+        image.close()
+    return ContentFile(buffer.getvalue())
+
+
+def render_existing_thumbnails(apps, schema_editor):
+    SportFacility = apps.get_model('reservations', 'SportFacility')
+    for facility in SportFacility.objects.exclude(image='').exclude(image=None):
+        try:
+            content = render_thumbnail(facility.image)
+        except OSError:
+            continue  # Missing or unreadable file; it gets one when re-uploaded
+        name = os.path.splitext(os.path.basename(facility.image.name))[0] + '.jpg'
+        facility.thumbnail.save(name, content, save=False)
+        facility.save(update_fields=['thumbnail'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_archive_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sportfacility',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='facilities/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='sportfacility',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(render_existing_thumbnails, migrations.RunPython.noop),
+    ]
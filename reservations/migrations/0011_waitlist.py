@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0010_facility_thumbnail_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('time_slot', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='reservations.timeslot')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['time_slot', 'id'],
+                'indexes': [models.Index(fields=['time_slot', 'id'], name='waitlist_slot_queue_idx'), models.Index(fields=['user', 'created_at'], name='waitlist_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('time_slot', 'user'), name='unique_waitlist_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0012_job_queue'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='timeslot',
+            unique_together={('facility', 'date', 'start_time', 'end_time')},
+        ),
+    ]
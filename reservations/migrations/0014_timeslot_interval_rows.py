@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+def mark_interval_rows(apps, schema_editor):
+    # Rows of interval-mode facilities were stored by interval bookings
+    TimeSlot = apps.get_model('reservations', 'TimeSlot')
+    TimeSlot.objects.filter(facility__schedule_mode='intervals').update(is_interval=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0013_timeslot_unique_bounds'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='timeslot',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='is_interval',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_interval_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['facility', 'date', 'start_time'], name='timeslot_facility_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_interval', False)), fields=('facility', 'date', 'start_time'), name='unique_grid_slot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_interval', True)), fields=('facility', 'date', 'start_time', 'end_time'), name='unique_interval_slot'),
+        ),
+    ]
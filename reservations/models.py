@@ -1,82 +1,194 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import datetime, timedelta, time, date
+from datetime import datetime, time
+from .cache import availability_cache
+from .events import publish_slot_change
+from .images import render_thumbnail, thumbnail_name
+from .tasks import queue_booking_confirmations
+
+class SportFacilityQuerySet(models.QuerySet):
+    def with_booked_count(self, for_date, after=None):
+        """Annotate booked_slots: active reservations on for_date, from after on"""
+        booked = Reservation.objects.filter(
+            time_slot__facility=models.OuterRef('pk'), time_slot__date=for_date,
+            is_cancelled=False,
+        )
+        if after is not None:
+            booked = booked.filter(time_slot__start_time__gte=after)
+        # A correlated subquery rather than a GROUP BY keeps LIMIT effective
+        booked = booked.order_by().values('time_slot__facility').annotate(count=models.Count('pk'))
+        return self.annotate(booked_slots=Coalesce(
+            models.Subquery(booked.values('count')), 0,
+        ))
 
 class SportFacility(models.Model):
+    # Grid facilities have fixed slots of slot_duration from opening_time.
+    # Interval facilities store only booked intervals, of any length; see schedule.py.
+    GRID = 'grid'
+    INTERVALS = 'intervals'
+    SCHEDULE_MODES = [(GRID, 'Slot grid'), (INTERVALS, 'Intervals')]
+
     name = models.CharField(max_length=100)
     description = models.TextField()
     facility_type = models.CharField(max_length=50)
     image = models.ImageField(upload_to='facilities/', null=True, blank=True)
+    # Rendered from image on upload; listings show this instead
+    thumbnail = models.ImageField(upload_to='facilities/thumbnails/', null=True, blank=True, editable=False)
     opening_time = models.TimeField(default=time(8, 0))  # 8:00 AM
     closing_time = models.TimeField(default=time(22, 0)) # 10:00 PM
     slot_duration = models.PositiveIntegerField(default=60)  # in minutes
+    schedule_mode = models.CharField(max_length=10, choices=SCHEDULE_MODES, default=GRID)
+    # Last date whose whole grid has been materialized by auto_manage_slots
+    slots_horizon = models.DateField(null=True, blank=True, editable=False)
+    # Part of the catalog's ETag and its Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SportFacilityQuerySet.as_manager()
+
+    _loaded_image = None
 
     def __str__(self):
         return self.name
 
-    def generate_time_slots(self, for_date=None):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._loaded_image = values[field_names.index('image')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is None or 'image' in update_fields) and self.image_changed():
+            self.thumbnail = None
+            if self.image:
+                self.thumbnail.save(thumbnail_name(self.image.name), render_thumbnail(self.image), save=False)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'thumbnail'}
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+        availability_cache.invalidate_facility(self.pk)
+
+    def delete(self, *args, **kwargs):
+        availability_cache.invalidate_facility(self.pk)
+        return super().delete(*args, **kwargs)
+
+    def image_changed(self):
+        """Whether image differs from what was loaded from the database"""
+        return 'image' not in self.get_deferred_fields() and self.image.name != self._loaded_image
+
+    @property
+    def uses_intervals(self):
+        return self.schedule_mode == self.INTERVALS
+
+    def generate_time_slots(self, for_date=None, end_date=None):
         """
-        Generate time slots for the given date. If not provided, defaults to today.
+        Generate time slots from for_date to end_date (inclusive). for_date
+        defaults to today and end_date to for_date.
         Avoids creating duplicates and updates availability.
         """
-        if for_date is None:
-            for_date = date.today()
+        from .slots import generate_time_slots
+        return generate_time_slots(self, for_date, end_date)
 
-        # Avoid generating for past dates
-        if for_date < date.today():
-            return []
-
-        now = timezone.now()
-        start_time = self.opening_time
+class FacilityClosure(models.Model):
+    """
+    A holiday or maintenance closure of an interval-mode facility, for the
+    whole day unless start_time and end_time are given.
+    """
+    # Indexed as the leading column of the index below
+    facility = models.ForeignKey(SportFacility, on_delete=models.CASCADE, related_name='closures', db_index=False)
+    date = models.DateField()
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    reason = models.CharField(max_length=200, blank=True)
 
-        if for_date == now.date():
-            # Round up current time to the next slot boundary
-            start_time = now.time()
-            minutes = (self.slot_duration - (now.minute % self.slot_duration)) % self.slot_duration
-            start_time_dt = datetime.combine(for_date, start_time) + timedelta(minutes=minutes)
-            start_time = max(start_time_dt.time(), self.opening_time)
+    class Meta:
+        ordering = ['date', 'start_time']
+        indexes = [
+            models.Index(fields=['facility', 'date'], name='closure_facility_date_idx'),
+        ]
 
-        slots = []
-        current_time = start_time
+    def __str__(self):
+        hours = f" {self.start_time}-{self.end_time}" if self.start_time else ""
+        return f"{self.facility.name} closed {self.date}{hours}"
 
-        while (datetime.combine(for_date, current_time) + 
-               timedelta(minutes=self.slot_duration)).time() <= self.closing_time:
+    def clean(self):
+        if (self.start_time is None) != (self.end_time is None):
+            raise ValidationError('Give both start_time and end_time, or neither for the whole day.')
+        if self.start_time is not None and self.start_time >= self.end_time:
+            raise ValidationError({'end_time': 'Must be after start_time.'})
 
-            end_time = (datetime.combine(for_date, current_time) +
-                        timedelta(minutes=self.slot_duration)).time()
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Upcoming closures are cached with the facility
+        availability_cache.invalidate_facility(self.facility_id)
 
-            slot, created = TimeSlot.objects.get_or_create(
-                facility=self,
-                date=for_date,
-                start_time=current_time,
-                end_time=end_time,
-                defaults={'is_available': True}
-            )
+    def delete(self, *args, **kwargs):
+        availability_cache.invalidate_facility(self.facility_id)
+        return super().delete(*args, **kwargs)
 
-            # Update availability based on current reservations
-            slot.is_available = not slot.reservations.filter(is_cancelled=False).exists()
-            slot.save()
+class TimeSlotQuerySet(models.QuerySet):
+    def with_availability(self):
+        """Annotate is_available from the slot's active reservations"""
+        active = Reservation.objects.filter(time_slot=models.OuterRef('pk'), is_cancelled=False)
+        return self.annotate(is_available=~models.Exists(active))
 
-            slots.append(slot)
-            current_time = end_time
+    def available(self):
+        return self.with_availability().filter(is_available=True)
 
-        return slots
+    def booked(self):
+        return self.with_availability().filter(is_available=False)
 
 class TimeSlot(models.Model):
-    facility = models.ForeignKey(SportFacility, on_delete=models.CASCADE, related_name='time_slots')
+    # Indexed by the leading column of timeslot_facility_day_idx
+    facility = models.ForeignKey(SportFacility, on_delete=models.CASCADE, related_name='time_slots', db_index=False)
     start_time = models.TimeField()
     end_time = models.TimeField()
     date = models.DateField()
-    is_available = models.BooleanField(default=True)
+    # Stored by an interval-mode booking. Such rows are never resized, as
+    # cancelled reservations point at them, so a start may have several.
+    is_interval = models.BooleanField(default=False)
+
+    objects = TimeSlotQuerySet.as_manager()
 
     class Meta:
         ordering = ['date', 'start_time']
-        unique_together = ['facility', 'date', 'start_time']
+        constraints = [
+            # Grid code relies on one row per start
+            models.UniqueConstraint(
+                fields=['facility', 'date', 'start_time'],
+                condition=models.Q(is_interval=False),
+                name='unique_grid_slot',
+            ),
+            models.UniqueConstraint(
+                fields=['facility', 'date', 'start_time', 'end_time'],
+                condition=models.Q(is_interval=True),
+                name='unique_interval_slot',
+            ),
+        ]
+        indexes = [
+            # The slots of a facility-day, whatever their kind; the unique
+            # constraints are partial, so they cannot serve every lookup
+            models.Index(fields=['facility', 'date', 'start_time'], name='timeslot_facility_day_idx'),
+            # Keyset pagination across facilities; per facility the
+            # index above serves instead.
+            models.Index(fields=['date', 'start_time', 'id'], name='timeslot_date_start_idx'),
+        ]
 
     def __str__(self):
         return f"{self.facility.name} - {self.date} {self.start_time}-{self.end_time}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        availability_cache.invalidate_day(self.facility_id, self.date)
+
+    def delete(self, *args, **kwargs):
+        availability_cache.invalidate_day(self.facility_id, self.date)
+        return super().delete(*args, **kwargs)
+
     @property
     def is_past(self):
         """Check if this time slot is in the past"""
@@ -85,27 +197,221 @@ class TimeSlot(models.Model):
         )
         return slot_datetime < timezone.now()
 
-    def update_availability(self):
-        """Update availability based on reservation status"""
-        self.is_available = not self.reservations.filter(is_cancelled=False).exists()
-        self.save()
+    @property
+    def is_available(self):
+        """
+        True when the slot has no active reservation. Set by
+        TimeSlot.objects.with_availability(); queried on first access otherwise.
+        """
+        if not hasattr(self, '_is_available'):
+            self._is_available = not self.reservations.filter(is_cancelled=False).exists()
+        return self._is_available
+
+    @is_available.setter
+    def is_available(self, value):
+        self._is_available = value
 
 class Reservation(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations')
-    time_slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name='reservations')
+    # Both are indexed as leading columns of the composite indexes below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations', db_index=False)
+    time_slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name='reservations', db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     is_cancelled = models.BooleanField(default=False)
 
     class Meta:
-        unique_together = ['time_slot']  # One reservation per slot
+        indexes = [
+            # Keyset pagination of a user's reservations, and of all of them
+            models.Index(fields=['user', 'created_at', 'id'], name='reservation_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='reservation_created_idx'),
+            # Reservation history of a slot; active ones use the constraint below
+            models.Index(fields=['time_slot', 'is_cancelled'], name='reservation_slot_status_idx'),
+            # A user's active reservations, on backends with partial indexes
+            models.Index(
+                fields=['user', 'created_at', 'id'],
+                condition=models.Q(is_cancelled=False),
+                name='reservation_user_active_idx',
+            ),
+        ]
+        constraints = [
+            # One active reservation per slot; cancelled ones may pile up
+            models.UniqueConstraint(
+                fields=['time_slot'],
+                condition=models.Q(is_cancelled=False),
+                name='unique_active_reservation_per_slot',
+            ),
+        ]
 
     def __str__(self):
         status = "CANCELLED" if self.is_cancelled else "ACTIVE"
         return f"{self.user.username} - {self.time_slot} ({status})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_availability(slot_available=self.is_cancelled)
+
+    def delete(self, *args, **kwargs):
+        self.invalidate_availability(slot_available=True)
+        return super().delete(*args, **kwargs)
+
+    def invalidate_availability(self, slot_available):
+        """Drop the cached availability of the slot's day and push the change"""
+        availability_cache.invalidate_day(self.time_slot.facility_id, self.time_slot.date)
+        publish_slot_change(self.time_slot, slot_available)
+
     def cancel(self):
-        """Cancel this reservation and update the slot availability"""
-        if not self.is_cancelled:
-            self.is_cancelled = True
-            self.save()
-            self.time_slot.update_availability()
+        """
+        Cancel this reservation. In the same transaction the slot goes to the
+        first user on its waitlist, whose reservation is returned; with
+        nobody waiting the slot is available again and None is returned.
+        """
+        if self.is_cancelled:
+            return None
+        with transaction.atomic():
+            if connection.features.has_select_for_update:
+                # Serializes with booking.join_waitlist() on the same row
+                list(TimeSlot.objects.select_for_update().filter(pk=self.time_slot_id).values_list('pk'))
+            cancelled = Reservation.objects.filter(pk=self.pk, is_cancelled=False).update(is_cancelled=True)
+            promoted = WaitlistEntry.objects.promote(self.time_slot) if cancelled else None
+        self.is_cancelled = True
+        if promoted is None:
+            self.invalidate_availability(slot_available=True)
+        return promoted
+
+
+class WaitlistQuerySet(models.QuerySet):
+    def with_position(self):
+        """Annotate position: 1 for the head of the slot's queue"""
+        ahead = WaitlistEntry.objects.filter(
+            time_slot=models.OuterRef('time_slot'), id__lt=models.OuterRef('pk'),
+        ).order_by().values('time_slot').annotate(count=models.Count('pk'))
+        return self.annotate(position=Coalesce(models.Subquery(ahead.values('count')), 0) + 1)
+
+    def promote(self, time_slot):
+        """
+        Book time_slot for the first active user waiting on it and drop
+        their entry, in the caller's transaction. The head is one seek on
+        the (time_slot, id) index however long the queue. Returns the new
+        reservation, or None when nobody is waiting.
+        """
+        queue = self.filter(time_slot=time_slot).select_related('user').order_by('id')
+        while (entry := queue.first()) is not None:
+            entry.delete()
+            if entry.user.is_active:
+                reservation = Reservation.objects.create(user=entry.user, time_slot=time_slot)
+                queue_booking_confirmations([reservation], from_waitlist=True)
+                return reservation
+        return None
+
+
+class WaitlistEntry(models.Model):
+    """
+    A user waiting for a booked slot. Entries are served in id order:
+    cancelling the slot's reservation books it for the first of them.
+    """
+    # Indexed as the leading column of the constraint and index below
+    time_slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name='waitlist', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries', db_index=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = WaitlistQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['time_slot', 'id']
+        indexes = [
+            # The queue of a slot, head first
+            models.Index(fields=['time_slot', 'id'], name='waitlist_slot_queue_idx'),
+            models.Index(fields=['user', 'created_at'], name='waitlist_user_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['time_slot', 'user'], name='unique_waitlist_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.time_slot}"
+
+
+class ArchivedTimeSlot(models.Model):
+    """
+    A past slot that had reservations, moved out of TimeSlot by
+    archive.archive_history() with its original id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    facility = models.ForeignKey(SportFacility, on_delete=models.CASCADE, related_name='archived_time_slots', db_index=False)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    date = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['date', 'start_time']
+        indexes = [
+            # Reports filter by date first; also a natural range partition key
+            models.Index(fields=['date', 'facility'], name='archived_slot_date_idx'),
+            models.Index(fields=['facility', 'date'], name='archived_slot_facility_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.facility.name} - {self.date} {self.start_time}-{self.end_time} (archived)"
+
+class ArchivedReservation(models.Model):
+    """A reservation of an archived slot, cancelled or not, with its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_reservations', db_index=False)
+    time_slot = models.ForeignKey(ArchivedTimeSlot, on_delete=models.CASCADE, related_name='reservations')
+    created_at = models.DateTimeField()
+    is_cancelled = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_reservation_user_idx'),
+        ]
+
+    def __str__(self):
+        status = "CANCELLED" if self.is_cancelled else "ACTIVE"
+        return f"{self.user.username} - {self.time_slot} ({status})"
+
+
+class Job(models.Model):
+    """
+    A task of jobs.py queued for the run_jobs worker. The row is the
+    queue: enqueued in the caller's transaction, it only becomes visible
+    to workers if that transaction commits.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # At most one pending job per non-empty key, e.g. for periodic jobs
+    key = models.CharField(max_length=200, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            # What a worker claims next
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='job_due_idx'),
+            models.Index(fields=['name', 'status', 'finished_at'], name='job_name_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'],
+                condition=models.Q(status__in=['queued', 'running']) & ~models.Q(key=''),
+                name='unique_pending_job_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
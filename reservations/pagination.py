@@ -0,0 +1,126 @@
+# reservations/pagination.py
+"""
+Keyset (cursor) pagination.
+
+DRF's CursorPagination only keys on the first ordering field and falls back
+to OFFSET for ties, which degrades when thousands of slots share a date. The
+cursor here carries the full ordering key of the last row, so every page is
+a single range scan over the matching composite index.
+"""
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ordering = ()
+    page_size = 100
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views, over the async ORM"""
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """The rows of the requested page plus one, to tell whether there is a next page"""
+        self.request = request
+        self.limit = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(queryset.model, request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[:self.limit + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [
+            self.field(type(last), name).value_to_string(last)
+            for name in self.ordering
+        ]
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, model, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.field(model, name).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, position):
+        """Rows strictly after position, in lexicographic order of the key"""
+        conditions = []
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            column = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            conditions.append(equal & Q(**{f'{column}__{lookup}': value}))
+            equal &= Q(**{column: value})
+        condition = reduce(operator.or_, conditions)
+
+        # Bound the leading column too, so the scan starts at the cursor.
+        name, value = self.ordering[0], position[0]
+        lookup = 'lte' if name.startswith('-') else 'gte'
+        return Q(**{f'{name.lstrip("-")}__{lookup}': value}) & condition
+
+    @staticmethod
+    def field(model, name):
+        return model._meta.get_field(name.lstrip('-'))
+
+
+class TimeSlotPagination(KeysetPagination):
+    ordering = ('date', 'start_time', 'id')
+
+
+class ReservationPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 50
+
+
+class FacilityPagination(KeysetPagination):
+    ordering = ('id',)
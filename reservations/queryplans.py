@@ -0,0 +1,57 @@
+# reservations/queryplans.py
+"""
+EXPLAIN helpers used to check that the hot endpoints stay on indexes.
+
+Plans are asked for with sequential scans discouraged where the backend has
+such a knob, so a reported table scan means no usable index exists rather
+than that the planner preferred a scan of a small table.
+"""
+import json
+from contextlib import contextmanager
+
+from django.db import connection as default_connection, transaction
+
+
+@contextmanager
+def record_selects(connection=default_connection):
+    """Collect (sql, params) of every SELECT run inside the block"""
+    statements = []
+
+    def wrapper(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield statements
+
+
+def table_scans(sql, params=(), connection=default_connection):
+    """Return the tables a statement reads with a full table scan"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            details = [row[-1] for row in cursor.fetchall()]
+        # "SCAN t" is a table scan; "SCAN t USING [COVERING] INDEX i" walks an index.
+        return [
+            detail.split()[1] for detail in details
+            if detail.startswith('SCAN ') and ' USING ' not in detail
+            and not detail.startswith('SCAN CONSTANT')
+        ]
+
+    if connection.vendor == 'postgresql':
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans, nodes = [], [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') == 'Seq Scan':
+                scans.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return scans
+
+    return []
@@ -0,0 +1,149 @@
+# reservations/reconcile.py
+"""
+Availability reconciliation.
+
+Availability is not stored: a slot is free when no active reservation
+references it. What can drift is the state kept next to it:
+
+- cached days of the availability cache that missed an invalidation,
+  for instance after a queryset update or a raw SQL fix;
+- waitlists of free slots, left when a reservation was deleted or
+  cancelled without Reservation.cancel(), so nobody was promoted;
+- stored grid slots that are no longer on the grid after the facility's
+  hours or slot_duration changed. They are listed, and can be booked,
+  next to the new grid slots that overlap them.
+
+reconcile_availability() streams the upcoming slots in chunks. It checks
+each chunk with one query and fixes it in bulk: stale days are
+invalidated, the heads of stranded waitlists get their slot, and off-grid
+slots that were never reserved or waited for are deleted. Other off-grid
+slots are kept as they hold bookings or booking history, and are only
+counted. Memory use is one chunk, plus the grid fields of the facilities
+seen and the keys of the stale days found.
+"""
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .cache import FACILITY_FIELDS, availability_cache
+from .slots import slot_grid
+
+SLOT_FIELDS = ('id', 'facility_id', 'date', 'start_time', 'end_time')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def reconcile_availability(start_date=None, end_date=None, chunk_size=1000, dry_run=False):
+    """
+    Check and fix the slots dated from start_date (default today) to
+    end_date. Returns a Counter of slots, stale_days, stranded_waitlists,
+    promoted, off_grid and off_grid_deleted, with the seconds taken.
+    """
+    from .models import TimeSlot
+
+    started = time.perf_counter()
+    counts = Counter()
+    slots = TimeSlot.objects.filter(date__gte=start_date or timezone.localdate())
+    if end_date is not None:
+        slots = slots.filter(date__lte=end_date)
+    # The order of the unique index, so that a facility-day rarely spans two chunks.
+    # Fixes only delete rows the scan has already passed
+    rows = slots.order_by('facility_id', 'date', 'start_time').values_list(*SLOT_FIELDS)
+    facilities, stale_days = {}, set()
+    for chunk in chunked(rows.iterator(chunk_size=chunk_size), chunk_size):
+        reconcile_chunk(chunk, facilities, stale_days, counts, dry_run)
+    counts['stale_days'] = len(stale_days)
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    return counts
+
+
+def reconcile_chunk(chunk, facilities, stale_days, counts, dry_run):
+    from .models import SportFacility, TimeSlot, WaitlistEntry
+
+    counts['slots'] += len(chunk)
+    missing = {facility_id for _, facility_id, *_ in chunk} - facilities.keys()
+    if missing:
+        for fields in SportFacility.objects.filter(pk__in=missing).values(*FACILITY_FIELDS):
+            facilities[fields['id']] = SportFacility(**fields)
+
+    # The one query per chunk: availability and waitlist of every slot in it
+    state = {
+        slot_id: (is_available, waiting)
+        for slot_id, is_available, waiting in TimeSlot.objects.filter(
+            pk__in=[row[0] for row in chunk],
+        ).with_availability().annotate(
+            waiting=Exists(WaitlistEntry.objects.filter(time_slot=OuterRef('pk'))),
+        ).values_list('id', 'is_available', 'waiting')
+    }
+
+    days = defaultdict(dict)
+    stranded, off_grid = [], []
+    grids = {}
+    for slot_id, facility_id, day, start_time, end_time in chunk:
+        if slot_id not in state:
+            continue  # Deleted since the scan read it
+        is_available, waiting = state[slot_id]
+        days[(facility_id, day)][slot_id] = is_available
+        if is_available and waiting:
+            stranded.append(slot_id)
+        facility = facilities[facility_id]
+        if facility.uses_intervals:
+            continue
+        if (facility_id, day) not in grids:
+            grids[(facility_id, day)] = set(slot_grid(facility, day))
+        if (start_time, end_time) not in grids[(facility_id, day)]:
+            off_grid.append(slot_id)
+
+    # A day spanning two chunks is compared chunk by chunk, and counted once
+    stale = [
+        key for key, rows in availability_cache.peek_days(list(days)).items()
+        if {row[0]: row[3] for row in rows if row[0] in days[key]} != days[key] and key not in stale_days
+    ]
+    stale_days.update(stale)
+    counts['stranded_waitlists'] += len(stranded)
+    counts['off_grid'] += len(off_grid)
+    if dry_run:
+        return
+
+    for facility_id, day in stale:
+        availability_cache.invalidate_day(facility_id, day)
+    for slot_id in stranded:
+        counts['promoted'] += promote_waitlist(slot_id)
+    if off_grid:
+        counts['off_grid_deleted'] += delete_unused_slots(off_grid)
+
+
+def promote_waitlist(slot_id):
+    """Give a free slot to the head of its waitlist; 1 if someone got it"""
+    from .booking import booking_transaction
+    from .models import Reservation, TimeSlot, WaitlistEntry
+
+    with booking_transaction():
+        queryset = TimeSlot.objects.filter(pk=slot_id)
+        if connection.features.has_select_for_update:
+            queryset = queryset.select_for_update()
+        time_slot = queryset.first()
+        if time_slot is None or Reservation.objects.filter(time_slot=time_slot, is_cancelled=False).exists():
+            return 0
+        return int(WaitlistEntry.objects.promote(time_slot) is not None)
+
+
+def delete_unused_slots(slot_ids):
+    """Delete those of slot_ids that were never reserved or waited for"""
+    from .models import TimeSlot
+
+    with transaction.atomic():
+        unused = TimeSlot.objects.filter(pk__in=slot_ids, reservations__isnull=True, waitlist__isnull=True)
+        days = set(unused.values_list('facility_id', 'date'))
+        deleted = TimeSlot.objects.filter(pk__in=unused.values('pk')).delete()[0]
+        for facility_id, day in days:
+            availability_cache.invalidate_day(facility_id, day)
+    return deleted
@@ -0,0 +1,160 @@
+# reservations/schedule.py
+"""
+Interval schedules.
+
+A facility in interval mode has no slot grid and no TimeSlot row per slot.
+What can be booked on a day is its opening hours, minus its closures, minus
+the intervals of its active reservations, computed on the fly. Bookings may
+be of any length on STEP-minute boundaries. Only a booked interval gets a
+stored TimeSlot row, which its reservation points at like any other.
+
+For /api/timeslots/ the free time is cut into slot_duration pieces, so
+clients written for grid facilities keep working.
+
+Intervals are (start, end) pairs of minutes since midnight, end excluded.
+An end or closing time of 00:00 is midnight at the end of the day.
+"""
+from datetime import time
+
+from django.utils import timezone
+
+STEP = 15  # minutes; interval bookings start and end on these boundaries
+DAY = 24 * 60
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def to_end_minutes(value):
+    """to_minutes() of the end of an interval, where 00:00 is the next midnight"""
+    return to_minutes(value) or DAY
+
+
+def to_time(minutes):
+    return time(minutes // 60 % 24, minutes % 60)
+
+
+def subtract(intervals, cuts):
+    """The parts of sorted, disjoint intervals not covered by any of cuts"""
+    cuts = sorted(cuts)
+    result = []
+    for start, end in intervals:
+        for cut_start, cut_end in cuts:
+            if cut_end <= start or cut_start >= end:
+                continue
+            if cut_start > start:
+                result.append((start, cut_start))
+            start = max(start, cut_end)
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def closure_interval(facility, start_time, end_time):
+    if start_time is None:
+        return to_minutes(facility.opening_time), to_end_minutes(facility.closing_time)
+    return to_minutes(start_time), to_end_minutes(end_time)
+
+
+def open_intervals(facility, day, closures=(), now=None):
+    """
+    Bookable hours of a facility-day: opening to closing time minus the
+    closures, given as (start_time, end_time) pairs (None for the whole
+    day). With now, past days are closed and today starts at the next STEP.
+    """
+    opening, closing = to_minutes(facility.opening_time), to_end_minutes(facility.closing_time)
+    if now is not None:
+        if day < now.date():
+            return []
+        if day == now.date():
+            elapsed = to_minutes(now) + bool(now.second or now.microsecond)
+            opening = max(opening, -(-elapsed // STEP) * STEP)
+    hours = [(opening, closing)] if opening < closing else []
+    return subtract(hours, [closure_interval(facility, *closure) for closure in closures])
+
+
+def free_intervals(facility, day, busy, closures=(), now=None):
+    """open_intervals() minus the busy (start_time, end_time) pairs"""
+    return subtract(
+        open_intervals(facility, day, closures, now),
+        [(to_minutes(start), to_end_minutes(end)) for start, end in busy],
+    )
+
+
+def fits_schedule(facility, day, start_time, end_time, closures=(), now=None):
+    """Whether [start_time, end_time) is on STEP boundaries within the open hours"""
+    if any(value.second or value.microsecond for value in (start_time, end_time)):
+        return False
+    start, end = to_minutes(start_time), to_end_minutes(end_time)
+    if start >= end or start % STEP or end % STEP:
+        return False
+    return any(
+        open_start <= start and end <= open_end
+        for open_start, open_end in open_intervals(facility, day, closures, now)
+    )
+
+
+def closures_by_day(facility_ids, days):
+    """{(facility_id, date): [(start_time, end_time)]} of the closures, in one query"""
+    from .models import FacilityClosure
+
+    result = {}
+    rows = FacilityClosure.objects.filter(
+        facility_id__in=set(facility_ids), date__in=set(days),
+    ).values_list('facility_id', 'date', 'start_time', 'end_time')
+    for facility_id, day, start_time, end_time in rows:
+        result.setdefault((facility_id, day), []).append((start_time, end_time))
+    return result
+
+
+def facility_closures(facility, day):
+    """Closures of a facility-day, from the cached facility when it has them"""
+    cached = getattr(facility, 'cached_closures', None)
+    if cached is not None:
+        return [(start_time, end_time) for date, start_time, end_time in cached if date == day]
+    return closures_by_day([facility.id], [day]).get((facility.id, day), [])
+
+
+def interval_time_slots(facility, day, stored=(), closures=(), now=None):
+    """
+    The booked intervals of an interval-mode facility-day, with its free
+    time cut into unsaved, available slots of slot_duration. A free stored
+    row with the same bounds as a piece stands in for it.
+    """
+    from .models import TimeSlot
+
+    booked = [slot for slot in stored if not slot.is_available]
+    reusable = {(slot.start_time, slot.end_time): slot for slot in stored if slot.is_available}
+    slots = list(booked)
+    length = facility.slot_duration
+    busy = [(slot.start_time, slot.end_time) for slot in booked]
+    for start, end in free_intervals(facility, day, busy, closures, now) if length else ():
+        while start + length <= end:
+            bounds = (to_time(start), to_time(start + length))
+            slots.append(reusable.get(bounds) or TimeSlot(
+                facility=facility, date=day, start_time=bounds[0], end_time=bounds[1], is_available=True,
+            ))
+            start += length
+    return sorted(slots, key=lambda slot: slot.start_time)
+
+
+def interval_time_slot(facility, day, start_time, end_time=None, closures=None, now=None):
+    """
+    An unsaved slot for booking [start_time, end_time) of an interval-mode
+    facility, end_time defaulting to slot_duration later, or None when the
+    interval is not within its upcoming open hours. Overlapping bookings
+    are checked when booking.
+    """
+    from .models import TimeSlot
+
+    if end_time is None:
+        end = to_minutes(start_time) + facility.slot_duration
+        if end > DAY:
+            return None
+        end_time = to_time(end)
+    if closures is None:
+        closures = facility_closures(facility, day)
+    if not fits_schedule(facility, day, start_time, end_time, closures, now or timezone.localtime()):
+        return None
+    return TimeSlot(facility=facility, date=day, start_time=start_time, end_time=end_time)
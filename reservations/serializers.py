@@ -1,7 +1,10 @@
 # reservations/serializers.py
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import SportFacility, TimeSlot, Reservation
+from django.utils import timezone
+from django.utils.text import Truncator
+from .models import SportFacility, TimeSlot, Reservation, WaitlistEntry
+from .slots import slot_grid
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,19 +13,53 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 class TimeSlotSerializer(serializers.ModelSerializer):
+    is_available = serializers.BooleanField(read_only=True)
+
     class Meta:
         model = TimeSlot
         fields = ['id', 'facility', 'start_time', 'end_time', 'date', 'is_available']
         read_only_fields = ['id']
 
 class SportFacilitySerializer(serializers.ModelSerializer):
-    time_slots = TimeSlotSerializer(many=True, read_only=True)
-    
+    availability = serializers.SerializerMethodField()
+
     class Meta:
         model = SportFacility
-        fields = ['id', 'name', 'description', 'facility_type', 'image', 'time_slots']
+        fields = ['id', 'name', 'description', 'facility_type', 'image', 'thumbnail', 'schedule_mode', 'availability']
         read_only_fields = ['id']
 
+    def get_availability(self, obj):
+        """Summary of today's upcoming slots instead of the full slot history"""
+        now = timezone.localtime()
+        total = len(slot_grid(obj, now.date(), now))
+        booked = getattr(obj, 'booked_slots', None)
+        if booked is None:
+            booked = Reservation.objects.filter(
+                time_slot__facility=obj, time_slot__date=now.date(),
+                time_slot__start_time__gte=now.time(), is_cancelled=False,
+            ).count()
+        return {
+            'date': now.date(),
+            'total_slots': total,
+            'available_slots': max(total - booked, 0),
+        }
+
+class FacilityCatalogSerializer(serializers.ModelSerializer):
+    """Lean listing: a summary instead of the description, the thumbnail instead of the image"""
+    summary = serializers.SerializerMethodField()
+
+    summary_length = 140
+
+    class Meta:
+        model = SportFacility
+        fields = [
+            'id', 'name', 'facility_type', 'summary', 'thumbnail', 'schedule_mode',
+            'opening_time', 'closing_time', 'slot_duration',
+        ]
+
+    def get_summary(self, obj):
+        return Truncator(obj.description).chars(self.summary_length)
+
 class ReservationSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True, default=serializers.CurrentUserDefault())
     time_slot_details = TimeSlotSerializer(source='time_slot', read_only=True)
@@ -36,4 +73,52 @@ class ReservationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # Set the user to the current user making the request
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    """A place in a slot's waitlist; position 1 gets the slot on the next cancellation"""
+    position = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = WaitlistEntry
+        fields = ['id', 'time_slot', 'position', 'created_at']
+        read_only_fields = fields
+
+
+class RecurrenceSerializer(serializers.Serializer):
+    """The slot starting at start_time on every weekday (0 is Monday) of a date range"""
+    facility = serializers.PrimaryKeyRelatedField(queryset=SportFacility.objects.all())
+    weekday = serializers.IntegerField(min_value=0, max_value=6)
+    start_time = serializers.TimeField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    max_days = 366
+
+    def validate(self, attrs):
+        days = (attrs['end_date'] - attrs['start_date']).days
+        if days < 0 or days >= self.max_days:
+            raise serializers.ValidationError(
+                {'end_date': f'Must be within {self.max_days} days on or after start_date.'}
+            )
+        return attrs
+
+
+class BulkReservationSerializer(serializers.Serializer):
+    """Either a list of time_slots ids or a recurrence, and how to book them"""
+    MODES = ('all_or_nothing', 'best_effort')
+    max_slots = 100
+
+    time_slots = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+        allow_empty=False, max_length=max_slots,
+    )
+    recurrence = RecurrenceSerializer(required=False)
+    mode = serializers.ChoiceField(choices=MODES, default='all_or_nothing')
+
+    def validate(self, attrs):
+        if ('time_slots' in attrs) == ('recurrence' in attrs):
+            raise serializers.ValidationError('Give either time_slots or recurrence.')
+        return attrs
+
@@ -0,0 +1,337 @@
+# reservations/slots.py
+"""
+Slot grid computation and bulk materialization.
+
+The grid of a facility is derived purely from its opening_time, closing_time
+and slot_duration, so it can be computed in memory and compared against the
+stored rows with a fixed number of queries, whatever the size of the range.
+Facilities in interval mode have no grid to materialize; see schedule.py.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+
+def date_range(start_date, end_date):
+    """Yield every date from start_date to end_date, both inclusive."""
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+def slot_grid(facility, for_date, now=None):
+    """
+    Return the (start_time, end_time) pairs of the facility's grid for a date.
+
+    Slots are aligned to opening_time. When ``now`` falls on ``for_date``,
+    slots that have already started are left out.
+    """
+    if not facility.slot_duration:
+        return []
+
+    step = timedelta(minutes=facility.slot_duration)
+    current = datetime.combine(for_date, facility.opening_time)
+    closing = datetime.combine(for_date, facility.closing_time)
+    if facility.closing_time == time(0):
+        closing += timedelta(days=1)  # Closes at midnight
+    if now is not None and now.date() == for_date:
+        earliest = now.replace(tzinfo=None)
+        while current < earliest:
+            current += step
+
+    grid = []
+    while current + step <= closing:
+        grid.append((current.time(), (current + step).time()))
+        current += step
+    return grid
+
+
+def generate_time_slots(facility, start_date=None, end_date=None):
+    """
+    Materialize the facility's slots for every date in [start_date, end_date].
+
+    Existing slots are fetched with one query, annotated with their
+    availability, and missing rows are written with a single bulk insert.
+    Past dates are skipped. Returns the grid slots ordered by date and
+    start time, none for interval-mode facilities.
+    """
+    from .cache import availability_cache
+    from .models import TimeSlot
+
+    now = timezone.localtime()
+    today = now.date()
+    start_date = max(start_date or today, today)
+    end_date = end_date or start_date
+    if end_date < start_date or facility.uses_intervals:
+        return []
+
+    expected = {}
+    for day in date_range(start_date, end_date):
+        for start_time, end_time in slot_grid(facility, day, now):
+            expected[(day, start_time)] = end_time
+    if not expected:
+        return []
+
+    with transaction.atomic():
+        stored = TimeSlot.objects.with_availability().filter(
+            facility=facility, date__range=(start_date, end_date)
+        )
+        existing = one_per_start(stored, key=lambda slot: (slot.date, slot.start_time))
+
+        missing = [
+            TimeSlot(facility=facility, date=day, start_time=start_time, end_time=end_time)
+            for (day, start_time), end_time in expected.items()
+            if (day, start_time) not in existing
+        ]
+        if missing:
+            TimeSlot.objects.bulk_create(missing, ignore_conflicts=True)
+            for day in {slot.date for slot in missing}:
+                availability_cache.invalidate_day(facility.id, day)
+            # Primary keys are not returned for ignore_conflicts inserts.
+            existing = one_per_start(stored.all(), key=lambda slot: (slot.date, slot.start_time))
+
+    return [existing[key] for key in sorted(expected) if key in existing]
+
+
+def one_per_start(slots, key=lambda slot: slot.start_time):
+    """
+    Index slots by key. Grid rows are unique per start, but rows left by
+    interval bookings may share it; a booked one wins over free ones.
+    """
+    result = {}
+    for slot in slots:
+        if key(slot) not in result or not slot.is_available:
+            result[key(slot)] = slot
+    return result
+
+
+def virtual_time_slots(facility, for_date, stored=()):
+    """
+    Merge the stored slots of a facility-day with unsaved slots synthesized
+    from its grid. Nothing is written; synthesized slots have no primary key
+    and are available by definition. Past dates only return stored slots.
+    Interval-mode facilities list their bookings and free time instead.
+    """
+    from .models import TimeSlot
+    from .schedule import facility_closures, interval_time_slots
+
+    now = timezone.localtime()
+    if facility.uses_intervals:
+        if for_date < now.date():
+            return sorted(stored, key=lambda slot: slot.start_time)
+        return interval_time_slots(facility, for_date, stored, facility_closures(facility, for_date), now)
+    slots = one_per_start(stored)
+    if for_date >= now.date():
+        for start_time, end_time in slot_grid(facility, for_date, now):
+            if start_time not in slots:
+                slots[start_time] = TimeSlot(
+                    facility=facility, date=for_date, start_time=start_time,
+                    end_time=end_time, is_available=True,
+                )
+    return [slots[start_time] for start_time in sorted(slots)]
+
+
+def materialize_time_slot(facility, for_date, start_time):
+    """
+    Return the stored slot starting at start_time, creating it if it is an
+    upcoming slot of the facility's grid. Returns None otherwise.
+    """
+    from .models import TimeSlot
+
+    slot = TimeSlot.objects.with_availability().filter(
+        facility=facility, date=for_date, start_time=start_time
+    ).first()
+    if slot is not None:
+        slot.facility = facility
+        return slot
+
+    grid = dict(slot_grid(facility, for_date, timezone.localtime()))
+    if for_date < timezone.localdate() or start_time not in grid:
+        return None
+    slot, created = TimeSlot.objects.get_or_create(
+        facility=facility, date=for_date, start_time=start_time,
+        defaults={'end_time': grid[start_time]},
+    )
+    if created:
+        slot.is_available = True
+    return slot
+
+
+def weekly_dates(start_date, end_date, weekday):
+    """Every date in [start_date, end_date] falling on weekday (0 is Monday)"""
+    day = start_date + timedelta(days=(weekday - start_date.weekday()) % 7)
+    while day <= end_date:
+        yield day
+        day += timedelta(days=7)
+
+
+def materialize_recurring_slots(facility, weekday, start_time, start_date, end_date):
+    """
+    The stored slots starting at start_time on every weekday in [start_date,
+    end_date], creating the missing ones with a single bulk insert. Returns
+    (slots, skipped) where skipped lists the dates with no upcoming grid slot
+    at start_time. Interval-mode facilities get unsaved slots of
+    slot_duration, stored when booked.
+    """
+    from .cache import availability_cache
+    from .models import TimeSlot
+    from .schedule import closures_by_day, interval_time_slot
+
+    now = timezone.localtime()
+    if facility.uses_intervals:
+        days = list(weekly_dates(start_date, end_date, weekday))
+        closures = closures_by_day([facility.id], days)
+        slots, skipped = [], []
+        for day in days:
+            slot = interval_time_slot(facility, day, start_time, closures=closures.get((facility.id, day), ()), now=now)
+            if slot is None:
+                skipped.append(day)
+            else:
+                slots.append(slot)
+        return slots, skipped
+
+    expected, skipped = {}, []
+    for day in weekly_dates(start_date, end_date, weekday):
+        grid = dict(slot_grid(facility, day, now)) if day >= now.date() else {}
+        if start_time in grid:
+            expected[day] = grid[start_time]
+        else:
+            skipped.append(day)
+    if not expected:
+        return [], skipped
+
+    with transaction.atomic():
+        # Through the related manager, each slot gets facility set without a query
+        stored = facility.time_slots.filter(date__in=list(expected), start_time=start_time).order_by('date')
+        existing = {slot.date for slot in stored}
+        missing = [
+            TimeSlot(facility=facility, date=day, start_time=start_time, end_time=end_time)
+            for day, end_time in expected.items() if day not in existing
+        ]
+        if missing:
+            TimeSlot.objects.bulk_create(missing, ignore_conflicts=True)
+            for slot in missing:
+                availability_cache.invalidate_day(facility.id, slot.date)
+            stored = stored.all()
+    return list(stored), skipped
+
+
+def availability_matrix(facilities, start_date, end_date):
+    """
+    Availability of every facility-day in [start_date, end_date] as a string
+    of '1' (bookable) and '0' (booked or already started) per grid slot,
+    aligned to opening_time and slot_duration. Facility-days missing from
+    the availability cache are read with a single query. For interval-mode
+    facilities a slot is bookable when it is free of bookings and closures.
+    Returns {facility_id: {date: bitmap}}.
+    """
+    from .cache import availability_cache, load_day_rows
+    from .schedule import closures_by_day, free_intervals, to_end_minutes, to_minutes
+
+    facilities = list(facilities)
+    dates = list(date_range(start_date, end_date))
+    days = availability_cache.get_days(
+        [(facility.id, day) for facility in facilities for day in dates],
+        load_day_rows,
+    )
+    busy = {
+        key: [(start_time, end_time) for _, start_time, end_time, is_available in rows if not is_available]
+        for key, rows in days.items()
+    }
+    booked = {
+        (facility_id, day, start_time)
+        for (facility_id, day), intervals in busy.items() for start_time, _ in intervals
+    }
+    interval_ids = [facility.id for facility in facilities if facility.uses_intervals]
+    closures = closures_by_day(interval_ids, dates) if interval_ids else {}
+
+    now = timezone.localtime()
+    started = now.replace(tzinfo=None)
+    matrix = {}
+    for facility in facilities:
+        days = matrix[facility.id] = {}
+        for day in dates:
+            if facility.uses_intervals:
+                free = free_intervals(
+                    facility, day, busy[(facility.id, day)], closures.get((facility.id, day), ()), now,
+                )
+                days[day] = ''.join(
+                    '1' if any(
+                        start <= to_minutes(start_time) and to_end_minutes(end_time) <= end for start, end in free
+                    ) else '0'
+                    for start_time, end_time in slot_grid(facility, day)
+                )
+                continue
+            days[day] = ''.join(
+                '0' if (facility.id, day, start_time) in booked
+                or datetime.combine(day, start_time) < started else '1'
+                for start_time, _ in slot_grid(facility, day)
+            )
+    return matrix
+
+
+def run_length_encode(bitmap):
+    """'1110011' -> [[1, 3], [0, 2], [1, 2]]"""
+    runs = []
+    for bit in bitmap:
+        value = int(bit)
+        if runs and runs[-1][0] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+    return runs
+
+
+def extend_horizon(facility, until, batch_size=1000, dry_run=False):
+    """
+    Materialize the facility's grid for the days after its slots_horizon
+    (or from today) up to until, then move the horizon to until. Only
+    inserts, in batches; rows already created by bookings are skipped.
+    Returns (days, slots) generated; nothing for interval-mode facilities.
+    """
+    from .cache import availability_cache
+    from .models import SportFacility, TimeSlot
+
+    now = timezone.localtime()
+    today = now.date()
+    start_date = today
+    if facility.slots_horizon is not None:
+        start_date = max(start_date, facility.slots_horizon + timedelta(days=1))
+    if start_date > until or facility.uses_intervals:
+        return 0, 0
+
+    days = list(date_range(start_date, until))
+    rows = [
+        TimeSlot(facility_id=facility.id, date=day, start_time=start_time, end_time=end_time)
+        for day in days
+        for start_time, end_time in slot_grid(facility, day, now)
+    ]
+    if not dry_run:
+        with transaction.atomic():
+            TimeSlot.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+            SportFacility.objects.filter(pk=facility.pk).update(slots_horizon=until)
+            for day in days:
+                availability_cache.invalidate_day(facility.id, day)
+    return len(days), len(rows)
+
+
+def purge_time_slots(before, batch_size=1000, dry_run=False):
+    """
+    Delete slots dated before `before` that were never reserved, one batch
+    per statement. Reserved slots are kept as booking history.
+    Returns the number of slots (to be) deleted.
+    """
+    from .models import TimeSlot
+
+    stale = TimeSlot.objects.filter(date__lt=before, reservations__isnull=True)
+    if dry_run:
+        return stale.count()
+
+    deleted = 0
+    while True:
+        batch = list(stale.order_by('date', 'start_time', 'id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += TimeSlot.objects.filter(pk__in=batch).delete()[0]
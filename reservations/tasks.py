@@ -0,0 +1,97 @@
+# reservations/tasks.py
+"""Tasks run by the job queue (jobs.py), queued by requests or periodically"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from .jobs import enqueue_many, setting, task
+
+logger = logging.getLogger('reservations.jobs')
+
+
+@task
+def extend_horizons(days=7, batch_size=1000):
+    """What auto_manage_slots does by default: keep grids materialized days ahead"""
+    from .models import SportFacility
+    from .slots import extend_horizon
+
+    until = timezone.localdate() + timedelta(days=days - 1)
+    facilities = SportFacility.objects.filter(schedule_mode=SportFacility.GRID).only(
+        'id', 'opening_time', 'closing_time', 'slot_duration', 'schedule_mode', 'slots_horizon',
+    ).order_by('id')
+    for facility in facilities:
+        extend_horizon(facility, until, batch_size)
+
+
+@task(name='archive_history')
+def archive_old_history(retention_days=None, batch_size=None):
+    """The archive_history command with its RESERVATIONS_ARCHIVE defaults"""
+    from .archive import archive_history
+    from .slots import purge_time_slots
+
+    config = getattr(settings, 'RESERVATIONS_ARCHIVE', {})
+    retention_days = config.get('RETENTION_DAYS', 90) if retention_days is None else retention_days
+    batch_size = batch_size or config.get('BATCH_SIZE', 1000)
+    cutoff = timezone.localdate() - timedelta(days=retention_days)
+    archive_history(cutoff, batch_size)
+    purge_time_slots(cutoff, batch_size)
+
+
+@task
+def reconcile_availability(days=None, chunk_size=1000):
+    """The reconcile_availability command, logging what it found"""
+    from .reconcile import reconcile_availability as reconcile
+
+    today = timezone.localdate()
+    end_date = today + timedelta(days=days - 1) if days is not None else None
+    counts = reconcile(today, end_date, chunk_size)
+    if counts['stale_days'] or counts['stranded_waitlists'] or counts['off_grid']:
+        logger.warning('Availability drift fixed: %s', dict(counts))
+
+
+@task
+def purge_jobs(days=None):
+    """Delete jobs that finished more than KEEP_DAYS ago, failed ones included"""
+    from .models import Job
+
+    days = setting('KEEP_DAYS', 7) if days is None else days
+    Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED), finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+
+
+@task
+def send_booking_confirmation(reservation_id, from_waitlist=False):
+    """Email the user of a reservation that is still active"""
+    from .models import Reservation
+
+    reservation = Reservation.objects.select_related('user', 'time_slot__facility').filter(
+        pk=reservation_id, is_cancelled=False,
+    ).first()
+    if reservation is None or not reservation.user.email:
+        return
+    slot = reservation.time_slot
+    when = f'{slot.date:%A %d %B %Y}, {slot.start_time:%H:%M}-{slot.end_time:%H:%M}'
+    if from_waitlist:
+        subject = f'A place opened up: {slot.facility.name} is yours'
+        intro = 'A reservation was cancelled and you were first on the waitlist, so you are now booked:'
+    else:
+        subject = f'Booking confirmed: {slot.facility.name}'
+        intro = 'Your booking is confirmed:'
+    send_mail(
+        subject,
+        f'Hi {reservation.user.get_username()},\n\n{intro}\n\n{slot.facility.name}\n{when}\n',
+        None,
+        [reservation.user.email],
+    )
+
+
+def queue_booking_confirmations(reservations, from_waitlist=False):
+    """Queue send_booking_confirmation for the reservations of users with an email address"""
+    enqueue_many('send_booking_confirmation', [
+        {'reservation_id': reservation.pk, 'from_waitlist': from_waitlist}
+        for reservation in reservations if reservation.user.email
+    ])
@@ -1,3 +1,1579 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import tempfile
+import threading
+import time as clock
+import unittest
+from datetime import time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from . import intake as intake_module
+from . import jobs
+from .benchmarks import Benchmark, compare
+from .booking import SlotUnavailable, book_time_slot, join_waitlist
+from .intake import BookingIntake, IntakeFull, IntakeTimeout
+from .cache import availability_cache, cached_day_slots
+from .events import RESYNC, LocalBroadcaster, get_broadcaster, slot_channel
+from .metrics import registry
+from .archive import reservation_history
+from . import authentication
+from .authentication import local_tokens
+from .models import (
+    ArchivedReservation, ArchivedTimeSlot, FacilityClosure, SportFacility, TimeSlot, Reservation,
+    Job, WaitlistEntry,
+)
+from .queryplans import record_selects, table_scans
+from .serializers import FacilityCatalogSerializer
+from .schedule import subtract
+from .slots import materialize_time_slot, virtual_time_slots
+
+
+
+def clear_caches():
+    for alias in caches:
+        caches[alias].clear()
+
+
+def setUpModule():
+    # First requests can pass SLOW_REQUEST_MS (password hashing, imports);
+    # tests that expect the warning capture it with assertLogs
+    performance = logging.getLogger('reservations.performance')
+    level = performance.level
+    performance.setLevel(logging.ERROR)
+    unittest.addModuleCleanup(performance.setLevel, level)
+
+class SlotGenerationTests(TestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(22, 0), slot_duration=15,
+        )
+        self.user = User.objects.create_user('player', password='secret')
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_generates_full_grid(self):
+        slots = self.facility.generate_time_slots(self.tomorrow)
+        self.assertEqual(len(slots), 56)
+        self.assertEqual(slots[0].start_time, time(8, 0))
+        self.assertEqual(slots[-1].end_time, time(22, 0))
+        self.assertTrue(all(slot.pk for slot in slots))
+
+    def test_cold_day_uses_a_handful_of_queries(self):
+        with self.assertNumQueries(5):
+            self.facility.generate_time_slots(self.tomorrow)
+
+    def test_date_range_is_idempotent(self):
+        end = self.tomorrow + timedelta(days=6)
+        self.facility.generate_time_slots(self.tomorrow, end)
+        self.assertEqual(TimeSlot.objects.count(), 7 * 56)
+        with self.assertNumQueries(3):
+            slots = self.facility.generate_time_slots(self.tomorrow, end)
+        self.assertEqual(len(slots), 7 * 56)
+        self.assertEqual(TimeSlot.objects.count(), 7 * 56)
+
+    def test_past_dates_are_skipped(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(self.facility.generate_time_slots(yesterday, yesterday), [])
+        self.assertFalse(TimeSlot.objects.exists())
+
+    def test_availability_is_derived_from_reservations(self):
+        slot = self.facility.generate_time_slots(self.tomorrow)[0]
+        reservation = Reservation.objects.create(user=self.user, time_slot=slot)
+        slots = self.facility.generate_time_slots(self.tomorrow)
+        self.assertFalse(slots[0].is_available)
+        self.assertTrue(slots[1].is_available)
+        self.assertEqual(TimeSlot.objects.booked().get(), slot)
+
+        reservation.cancel()
+        slots = self.facility.generate_time_slots(self.tomorrow)
+        self.assertTrue(slots[0].is_available)
+        self.assertFalse(TimeSlot.objects.booked().exists())
+
+    def test_grid_keeps_one_row_per_start(self):
+        booked = self.facility.generate_time_slots(self.tomorrow)[0]
+        book_time_slot(self.user, booked)
+        self.facility.slot_duration = 60
+        self.facility.save()
+        # A slot_duration change must not slip a free row in next to the booked one
+        TimeSlot.objects.bulk_create([
+            TimeSlot(facility=self.facility, date=self.tomorrow, start_time=time(8, 0), end_time=time(9, 0)),
+        ], ignore_conflicts=True)
+        slots = self.facility.generate_time_slots(self.tomorrow)
+        self.assertEqual(TimeSlot.objects.filter(start_time=time(8, 0)).get(), booked)
+        self.assertEqual((slots[0].pk, slots[0].is_available), (booked.pk, False))
+
+        # Interval bookings store a row per length, which a grid listing shows as the booked one
+        TimeSlot.objects.bulk_create([
+            TimeSlot(facility=self.facility, date=self.tomorrow, start_time=time(8, 0), end_time=end_time,
+                     is_interval=True)
+            for end_time in (time(8, 30), time(8, 45))
+        ])
+        listed = virtual_time_slots(self.facility, self.tomorrow, TimeSlot.objects.with_availability().filter(
+            facility=self.facility, date=self.tomorrow,
+        ))
+        self.assertEqual((listed[0].pk, listed[0].is_available), (booked.pk, False))
+
+class TimeSlotReadPathTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(22, 0), slot_duration=15,
+        )
+        self.user = User.objects.create_user('player', password='secret')
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def list_slots(self):
+        return self.client.get('/api/timeslots/', {
+            'facility_id': self.facility.id, 'date': self.tomorrow.isoformat(),
+        })
+
+    def test_listing_never_writes(self):
+        with self.assertNumQueries(2):
+            response = self.list_slots()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 56)
+        self.assertIsNone(response.data[0]['id'])
+        self.assertTrue(all(slot['is_available'] for slot in response.data))
+        self.assertFalse(TimeSlot.objects.exists())
+
+    def test_booking_materializes_virtual_slot(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/reservations/', {
+            'facility': self.facility.id, 'date': self.tomorrow.isoformat(),
+            'start_time': '09:00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(TimeSlot.objects.count(), 1)
+
+        slots = self.list_slots().data
+        self.assertEqual(len(slots), 56)
+        booked = [slot for slot in slots if not slot['is_available']]
+        self.assertEqual(len(booked), 1)
+        self.assertEqual(booked[0]['start_time'], '09:00:00')
+        self.assertEqual(booked[0]['id'], response.data['time_slot'])
+
+    def test_booking_off_grid_slot_is_rejected(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/reservations/', {
+            'facility': self.facility.id, 'date': self.tomorrow.isoformat(),
+            'start_time': '09:05',
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(TimeSlot.objects.exists())
+
+
+class BookingTests(APITestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.slot = self.facility.generate_time_slots(self.tomorrow)[0]
+        self.user = User.objects.create_user('player', password='secret')
+        self.other = User.objects.create_user('rival', password='secret')
+
+    def test_losing_the_race_returns_conflict(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/reservations/', {'time_slot': self.slot.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['time_slot_details']['is_available'])
+
+        self.client.force_authenticate(self.other)
+        response = self.client.post('/api/reservations/', {'time_slot': self.slot.id}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_cancelled_slot_can_be_rebooked(self):
+        book_time_slot(self.user, self.slot).cancel()
+        reservation = book_time_slot(self.other, self.slot)
+        self.assertEqual(reservation.user, self.other)
+        with self.assertRaises(SlotUnavailable):
+            book_time_slot(self.user, self.slot)
+        self.assertEqual(Reservation.objects.filter(is_cancelled=False).count(), 1)
+
+    def test_reservations_cannot_be_edited(self):
+        reservation = book_time_slot(self.user, self.slot)
+        taken = self.facility.time_slots.exclude(pk=self.slot.pk).first()
+        book_time_slot(self.other, taken)
+        self.client.force_authenticate(self.user)
+        url = f'/api/reservations/{reservation.id}/'
+        for method in (self.client.put, self.client.patch):
+            response = method(url, {'time_slot': taken.id}, format='json')
+            self.assertEqual(response.status_code, 405)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.time_slot, self.slot)
+
+    def test_database_lock_timeout_is_retryable(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch('reservations.views.book_time_slot', side_effect=OperationalError('database is locked')):
+            response = self.client.post('/api/reservations/', {'time_slot': self.slot.id}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        with mock.patch('reservations.views.book_time_slots', side_effect=OperationalError('database is locked')):
+            response = self.client.post('/api/reservations/bulk/', {'time_slots': [self.slot.id]}, format='json')
+        self.assertEqual(response.status_code, 503)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    THREADS = 16
+
+    def test_one_slot_hammered_from_many_threads(self):
+        facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        slot = facility.generate_time_slots(timezone.localdate() + timedelta(days=1))[0]
+        users = [User.objects.create_user(f'player{i}') for i in range(self.THREADS)]
+        outcomes = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def attempt(user):
+            barrier.wait()
+            try:
+                book_time_slot(user, TimeSlot.objects.get(pk=slot.pk))
+                outcomes.append('booked')
+            except SlotUnavailable:
+                outcomes.append('conflict')
+            except OperationalError:
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Writers wait for the lock: exactly one books, all the others see a conflict
+        self.assertEqual(sorted(outcomes), ['booked'] + ['conflict'] * (self.THREADS - 1))
+        self.assertEqual(Reservation.objects.filter(time_slot=slot, is_cancelled=False).count(), 1)
+
+
+class QueryCountTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('player', password='secret')
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def add_facilities(self, count):
+        for i in range(count):
+            facility = SportFacility.objects.create(
+                name=f'Court {i}', description='Indoor court', facility_type='badminton',
+            )
+            for slot in facility.generate_time_slots(self.tomorrow)[:3]:
+                book_time_slot(self.user, slot)
+
+    def test_facility_list(self):
+        self.add_facilities(2)
+        with self.assertNumQueries(1):
+            self.client.get('/api/facilities/')
+        self.add_facilities(5)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/facilities/')
+        results = response.data['results']
+        self.assertEqual(len(results), 7)
+        self.assertNotIn('time_slots', results[0])
+        self.assertEqual(
+            set(results[0]['availability']),
+            {'date', 'total_slots', 'available_slots'},
+        )
+
+    def test_reservation_list(self):
+        self.add_facilities(1)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            self.client.get('/api/reservations/')
+        self.add_facilities(4)
+        Reservation.objects.filter(pk=Reservation.objects.first().pk).update(is_cancelled=True)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/reservations/')
+        results = response.data['results']
+        self.assertEqual(len(results), 15)
+        self.assertEqual(results[-1]['facility_name'], 'Court 0')
+
+        self.client.force_authenticate(self.staff)
+        with self.assertNumQueries(2):
+            self.client.get('/api/reservations/')
+
+    def test_timeslot_list(self):
+        self.add_facilities(1)
+        facility = SportFacility.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/timeslots/', {
+                'facility_id': facility.id, 'date': self.tomorrow.isoformat(),
+            })
+        self.assertEqual(sum(not slot['is_available'] for slot in response.data), 3)
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('player', password='secret')
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.facilities = [
+            SportFacility.objects.create(
+                name=f'Court {i}', description='Indoor court', facility_type='badminton',
+            )
+            for i in range(3)
+        ]
+        for facility in self.facilities:
+            facility.generate_time_slots(self.tomorrow, self.tomorrow + timedelta(days=1))
+
+    def walk(self, url, params):
+        seen, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(response.data['results'])
+            pages += 1
+            if not response.data['next']:
+                return seen, pages
+            response = self.client.get(response.data['next'])
+
+    def test_timeslot_cursor_walks_every_slot_once(self):
+        seen, pages = self.walk('/api/timeslots/', {'page_size': 10})
+        self.assertEqual(len(seen), 3 * 2 * 14)
+        self.assertEqual(pages, 9)
+        keys = [(slot['date'], slot['start_time'], slot['id']) for slot in seen]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_timeslot_filters(self):
+        facility = self.facilities[1]
+        slot = TimeSlot.objects.filter(facility=facility, date=self.tomorrow).first()
+        book_time_slot(self.user, slot)
+
+        seen, _ = self.walk('/api/timeslots/', {
+            'facility_id': facility.id, 'date_after': self.tomorrow.isoformat(),
+            'date_before': self.tomorrow.isoformat(), 'page_size': 5,
+        })
+        self.assertEqual(len(seen), 14)
+        seen, _ = self.walk('/api/timeslots/', {'available': 'false'})
+        self.assertEqual([item['id'] for item in seen], [slot.id])
+
+        response = self.client.get('/api/timeslots/', {'date_after': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reservation_cursor_newest_first(self):
+        self.client.force_authenticate(self.user)
+        slots = TimeSlot.objects.filter(facility=self.facilities[0])[:7]
+        booked = [book_time_slot(self.user, slot).id for slot in slots]
+        Reservation.objects.filter(pk=booked[0]).update(is_cancelled=True)
+
+        seen, pages = self.walk('/api/reservations/', {'page_size': 3})
+        self.assertEqual([item['id'] for item in seen], booked[::-1])
+        self.assertEqual(pages, 3)
+        seen, _ = self.walk('/api/reservations/', {'active': 'true'})
+        self.assertEqual(len(seen), 6)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/timeslots/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanTests(APITestCase):
+    # The facility catalog is read in id order with a LIMIT; every other
+    # table must be reached through an index.
+    ALLOWED_SCANS = {'reservations_sportfacility'}
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('player', password='secret')
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.slots = self.facility.generate_time_slots(self.tomorrow)
+        self.reservation = book_time_slot(self.user, self.slots[0])
+
+    def assertNoTableScans(self, method, url, params=None, user=None):
+        self.client.force_authenticate(user)
+        with record_selects() as statements:
+            response = getattr(self.client, method)(url, params, format='json')
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(statements)
+        for sql, sql_params in statements:
+            scans = set(table_scans(sql, sql_params)) - self.ALLOWED_SCANS
+            self.assertFalse(scans, f'{method.upper()} {url} scans {scans}: {sql}')
+
+    def test_listings_use_indexes(self):
+        day = self.tomorrow.isoformat()
+        self.assertNoTableScans('get', '/api/facilities/')
+        self.assertNoTableScans('get', '/api/timeslots/', {'facility_id': self.facility.id, 'date': day})
+        self.assertNoTableScans('get', '/api/timeslots/', {'date_after': day, 'available': 'true'})
+        self.assertNoTableScans('get', '/api/reservations/', {'active': 'true'}, user=self.user)
+        self.assertNoTableScans('get', '/api/reservations/', user=self.staff)
+
+    def test_booking_and_cancellation_use_indexes(self):
+        self.assertNoTableScans('post', '/api/reservations/', {'time_slot': self.slots[1].id}, user=self.user)
+        self.assertNoTableScans('delete', f'/api/reservations/{self.reservation.id}/', user=self.user)
+
+
+class AvailabilityMatrixTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('player', password='secret')
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.courts = [
+            SportFacility.objects.create(
+                name=f'Court {i}', description='Indoor court', facility_type='badminton',
+                opening_time=time(8, 0), closing_time=time(12, 0), slot_duration=30,
+            )
+            for i in range(3)
+        ]
+        slot = materialize_time_slot(self.courts[1], self.tomorrow, time(9, 0))
+        book_time_slot(self.user, slot)
+
+    def get_matrix(self, **params):
+        params.setdefault('start', self.tomorrow.isoformat())
+        params.setdefault('end', (self.tomorrow + timedelta(days=6)).isoformat())
+        return self.client.get('/api/availability/', params)
+
+    def test_week_for_many_facilities_in_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.get_matrix()
+        self.assertEqual(response.status_code, 200)
+        facilities = response.data['facilities']
+        self.assertEqual([item['id'] for item in facilities], [court.id for court in self.courts])
+        days = facilities[1]['days']
+        self.assertEqual(len(days), 7)
+        self.assertEqual(days[self.tomorrow.isoformat()], '11011111')
+        self.assertEqual(facilities[0]['days'][self.tomorrow.isoformat()], '11111111')
+        self.assertFalse(TimeSlot.objects.exclude(reservations__isnull=False).exists())
+
+    def test_run_length_encoding_and_facility_filter(self):
+        response = self.get_matrix(encoding='rle', facility_ids=str(self.courts[1].id))
+        facilities = response.data['facilities']
+        self.assertEqual(len(facilities), 1)
+        self.assertEqual(facilities[0]['days'][self.tomorrow.isoformat()], [[1, 2], [0, 1], [1, 5]])
+
+    def test_invalid_ranges_are_rejected(self):
+        self.assertEqual(self.get_matrix(end=self.tomorrow.replace(year=self.tomorrow.year + 1)).status_code, 400)
+        self.assertEqual(self.get_matrix(encoding='png').status_code, 400)
+        self.assertEqual(self.get_matrix(facility_ids='1,x').status_code, 400)
+
+
+class AvailabilityCacheTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        availability_cache.reset_stats()
+        self.user = User.objects.create_user('player', password='secret')
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.slots = self.facility.generate_time_slots(self.tomorrow)
+
+    def list_slots(self):
+        response = self.client.get('/api/timeslots/', {
+            'facility_id': self.facility.id, 'date': self.tomorrow.isoformat(),
+        })
+        return {slot['start_time']: slot['is_available'] for slot in response.data}
+
+    def test_warm_reads_skip_the_database(self):
+        self.list_slots()
+        with self.assertNumQueries(0):
+            slots = self.list_slots()
+        self.assertTrue(all(slots.values()))
+        self.assertEqual(availability_cache.stats(), {'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
+
+    def test_booking_and_cancellation_invalidate(self):
+        self.list_slots()
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = book_time_slot(self.user, self.slots[0])
+        self.assertFalse(self.list_slots()['08:00:00'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.cancel()
+        self.assertTrue(self.list_slots()['08:00:00'])
+
+    def test_invalidation_waits_for_commit(self):
+        self.list_slots()
+        with self.captureOnCommitCallbacks() as callbacks:
+            book_time_slot(self.user, self.slots[0])
+            # Still uncommitted: readers keep the old, consistent answer
+            self.assertTrue(self.list_slots()['08:00:00'])
+        for callback in callbacks:
+            callback()
+        self.assertFalse(self.list_slots()['08:00:00'])
+
+    def test_facility_hours_change_invalidates(self):
+        TimeSlot.objects.all().delete()
+        clear_caches()
+        self.list_slots()
+        self.facility.closing_time = time(10, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.facility.save()
+        self.assertEqual(len(self.list_slots()), 2)
+
+    def test_stats_are_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/availability/cache-stats/').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/availability/cache-stats/')
+        self.assertEqual(set(response.data), {'hits', 'misses', 'hit_ratio'})
+
+
+class AutoManageSlotsTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.user = User.objects.create_user('player', password='secret')
+        self.facilities = [
+            SportFacility.objects.create(
+                name=f'Court {i}', description='Indoor court', facility_type='badminton',
+                opening_time=time(0, 0), closing_time=time(23, 0), slot_duration=60,
+            )
+            for i in range(2)
+        ]
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('auto_manage_slots', *args, stdout=out)
+        return out.getvalue()
+
+    def future_slots(self):
+        return TimeSlot.objects.filter(date__gt=self.today).count()
+
+    def test_extends_only_past_the_horizon(self):
+        self.run_command('--days', '3')
+        self.assertEqual(self.future_slots(), 2 * 2 * 23)
+        self.assertEqual(
+            set(SportFacility.objects.values_list('slots_horizon', flat=True)),
+            {self.today + timedelta(days=2)},
+        )
+
+        with self.assertNumQueries(1):
+            output = self.run_command('--days', '3')
+        self.assertIn('0 extended', output)
+
+        output = self.run_command('--days', '4', '--batch-size', '5')
+        self.assertIn('2 extended, 2 day(s), 46 slot(s)', output)
+        self.assertEqual(self.future_slots(), 2 * 3 * 23)
+
+    def test_slots_booked_ahead_are_kept(self):
+        slot = materialize_time_slot(self.facilities[0], self.today + timedelta(days=1), time(9, 0))
+        reservation = book_time_slot(self.user, slot)
+        self.run_command('--days', '2')
+        self.assertEqual(self.future_slots(), 2 * 23)
+        self.assertEqual(Reservation.objects.get().time_slot_id, reservation.time_slot_id)
+
+    def test_dry_run_writes_nothing(self):
+        output = self.run_command('--days', '3', '--dry-run', '--retention-days', '0')
+        self.assertIn('[dry run]', output)
+        self.assertFalse(TimeSlot.objects.exists())
+        self.assertFalse(SportFacility.objects.filter(slots_horizon__isnull=False).exists())
+
+    def test_purges_unreserved_history(self):
+        old = self.today - timedelta(days=40)
+        for hour in range(3):
+            TimeSlot.objects.create(
+                facility=self.facilities[0], date=old, start_time=time(hour), end_time=time(hour + 1),
+            )
+        kept = TimeSlot.objects.filter(date=old).first()
+        Reservation.objects.create(user=self.user, time_slot=kept)
+
+        output = self.run_command('--days', '1', '--retention-days', '30', '--batch-size', '1')
+        self.assertIn('Purged 2 unreserved slot(s)', output)
+        self.assertEqual(list(TimeSlot.objects.filter(date=old)), [kept])
+
+
+class BenchmarkSmokeTests(TestCase):
+    def test_sequential_scenarios_report_samples(self):
+        clear_caches()
+        scenarios = [
+            name for name in Benchmark.SCENARIOS
+            if not name.startswith('concurrent_booking') and name != 'database_profiles'
+        ]
+        results = Benchmark(facilities=2, days=2, users=3, iterations=4).run(scenarios)
+        for name in ('slot_listing', 'availability_matrix', 'facility_listing',
+                     'reservation_listing', 'booking', 'cancellation'):
+            self.assertEqual(results[name]['errors'], 0, name)
+            self.assertEqual(set(results[name]['latency_ms']), {'mean', 'p50', 'p95', 'p99', 'max'})
+        self.assertEqual(results['auto_manage_slots_noop']['queries'], 1)
+        for name in ('facilities', 'slots', 'reservations'):
+            for server in ('wsgi', 'asgi'):
+                self.assertEqual(results[f'{name}_{server}']['errors'], 0, f'{name}_{server}')
+        self.assertEqual(len(compare(results, results)), 13)
+
+
+class BenchmarkDefaultRunTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(intake_module.reset_intake)
+
+    def test_every_scenario_runs_in_the_default_order(self):
+        # The surge intake's writer thread must not keep the database locked for later scenarios
+        results = Benchmark(facilities=2, days=2, users=3, iterations=4, threads=4).run()
+        for name in ('concurrent_booking', 'concurrent_booking_surge',
+                     'concurrent_booking_baseline', 'concurrent_booking_tuned'):
+            self.assertEqual(results[name]['errors'], 0, name)
+        self.assertIsNone(intake_module._intake)
+
+
+class PerformanceInstrumentationTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        registry.reset()
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(10, 0), slot_duration=60,
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def list_slots(self):
+        return self.client.get('/api/timeslots/', {
+            'facility_id': self.facility.id, 'date': self.tomorrow.isoformat(),
+        })
+
+    def test_server_timing_header(self):
+        response = self.list_slots()
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    def test_metrics_are_staff_only(self):
+        self.list_slots()
+        self.client.force_authenticate(User.objects.create_user('player', password='secret'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(User.objects.create_user('admin', password='secret', is_staff=True))
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE reservations_request_duration_seconds histogram', body)
+        self.assertIn(
+            'reservations_request_duration_seconds_count{method="GET",endpoint="timeslot-list"} 1', body
+        )
+        self.assertIn('reservations_availability_cache_misses_total', body)
+
+    @override_settings(RESERVATIONS_PERFORMANCE={'SLOW_REQUEST_MS': 0})
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('reservations.performance', 'WARNING') as logs:
+            self.list_slots()
+        self.assertIn('Slow request GET /api/timeslots/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class AsyncReadTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.facilities = [
+            SportFacility.objects.create(
+                name=f'Court {i}', description='Indoor court', facility_type='badminton',
+                opening_time=time(8, 0), closing_time=time(12, 0), slot_duration=60,
+            )
+            for i in range(3)
+        ]
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.user = User.objects.create_user('player', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        book_time_slot(self.user, materialize_time_slot(self.facilities[0], self.tomorrow, time(9, 0)))
+        book_time_slot(self.other, materialize_time_slot(self.facilities[1], self.tomorrow, time(9, 0)))
+
+    async def test_slots_match_the_sync_endpoint(self):
+        params = {'facility_id': self.facilities[0].id, 'date': self.tomorrow.isoformat()}
+        response = await self.async_client.get('/api/async/timeslots/', params)
+        self.assertEqual(response.status_code, 200)
+        expected = await self.async_client.get('/api/timeslots/', params)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual([slot['is_available'] for slot in response.json()], [True, False, True, True])
+
+    async def test_multi_facility_slots_and_instrumentation(self):
+        ids = ','.join(str(facility.id) for facility in self.facilities)
+        response = await self.async_client.get(
+            '/api/async/timeslots/', {'facility_ids': ids, 'date': self.tomorrow.isoformat(), 'available': 'false'}
+        )
+        self.assertEqual(
+            [(slot['facility'], slot['start_time']) for slot in response.json()],
+            [(self.facilities[0].id, '09:00:00'), (self.facilities[1].id, '09:00:00')],
+        )
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+        # With the facilities cached, an uncached day of all of them takes one query
+        response = await self.async_client.get(
+            '/api/async/timeslots/', {'facility_ids': ids, 'date': (self.tomorrow + timedelta(days=1)).isoformat()}
+        )
+        self.assertEqual(len(response.json()), 12)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    async def test_slots_require_facility_and_date(self):
+        response = await self.async_client.get('/api/async/timeslots/', {'date': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.json())
+        response = await self.async_client.post('/api/async/timeslots/')
+        self.assertEqual(response.status_code, 405)
+
+    async def test_facility_list_matches_the_sync_endpoint(self):
+        response = await self.async_client.get('/api/async/facilities/', {'page_size': 2})
+        expected = await self.async_client.get('/api/facilities/', {'page_size': 2})
+        self.assertEqual(response.json()['results'], expected.json()['results'])
+        self.assertIn('/api/async/facilities/', response.json()['next'])
+
+    async def test_reservations_are_the_users_own(self):
+        response = await self.async_client.get('/api/async/reservations/')
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get(
+            '/api/async/reservations/', headers={'Authorization': f'Token {self.token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([row['user'] for row in results], [self.user.id])
+        self.assertEqual(results[0]['facility_name'], 'Court 0')
+        self.assertFalse(results[0]['time_slot_details']['is_available'])
+
+
+class AvailabilityPushTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(10, 0), slot_duration=60,
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.user = User.objects.create_user('player', password='secret')
+        self.channel = slot_channel(self.facility.id, self.tomorrow)
+
+    async def test_broadcaster_fans_out_across_threads(self):
+        broadcaster = LocalBroadcaster(queue_size=2)
+        async with broadcaster.subscribe('a') as first, broadcaster.subscribe('a') as second:
+            async with broadcaster.subscribe('b') as other:
+                await asyncio.to_thread(broadcaster.publish, 'a', {'n': 1})
+                self.assertEqual(await first.get(timeout=1), {'n': 1})
+                self.assertEqual(await second.get(timeout=1), {'n': 1})
+                with self.assertRaises(asyncio.TimeoutError):
+                    await other.get(timeout=0.05)
+
+            for n in range(3):
+                broadcaster.publish('a', {'n': n})
+            await asyncio.sleep(0)
+            self.assertEqual(await first.get(timeout=1), RESYNC)
+        self.assertEqual(broadcaster.subscriber_count(), 0)
+
+    def test_booking_and_cancelling_publish_after_commit(self):
+        published = []
+        slot = materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        with mock.patch.object(get_broadcaster(), 'publish', side_effect=lambda *args: published.append(args)):
+            with self.captureOnCommitCallbacks(execute=True):
+                reservation = book_time_slot(self.user, slot)
+                self.assertEqual(published, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                reservation.cancel()
+        self.assertEqual([channel for channel, _ in published], [self.channel] * 2)
+        self.assertEqual([event['is_available'] for _, event in published], [False, True])
+        self.assertEqual(published[0][1]['start_time'], '09:00:00')
+
+    async def test_event_stream_sends_snapshot_then_changes(self):
+        response = await self.async_client.get(
+            '/api/async/timeslots/events/',
+            {'facility_id': self.facility.id, 'date': self.tomorrow.isoformat()},
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        snapshot = (await anext(chunks)).decode()
+        self.assertTrue(snapshot.startswith('event: snapshot\n'))
+        self.assertEqual(len(json.loads(snapshot.split('data: ', 1)[1])), 2)
+
+        get_broadcaster().publish(self.channel, {'type': 'slot', 'start_time': '09:00:00', 'is_available': False})
+        event = (await anext(chunks)).decode()
+        self.assertTrue(event.startswith('event: slot\n'))
+        self.assertIn('"is_available": false', event)
+        # The ASGI handler cancels the stream when the client goes away
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(get_broadcaster().subscriber_count(self.channel), 0)
+
+    def test_event_stream_needs_asgi(self):
+        response = self.client.get(
+            '/api/async/timeslots/events/',
+            {'facility_id': self.facility.id, 'date': self.tomorrow.isoformat()},
+        )
+        self.assertEqual(response.status_code, 501)
+
+
+class BookingIntakeTests(TestCase):
+    def blocked_booking(self):
+        """A book() that holds the writer until released, and the release Event"""
+        started, release = threading.Event(), threading.Event()
+
+        def book():
+            started.set()
+            release.wait(5)
+            return 'first'
+        return book, started, release
+
+    def test_queue_is_bounded_per_slot_and_losers_skip_the_database(self):
+        intake = BookingIntake()
+        book, started, release = self.blocked_booking()
+        results = []
+        with override_settings(RESERVATIONS_SURGE={'QUEUE_SIZE': 2}):
+            first = threading.Thread(target=lambda: results.append(intake.submit('a', book)))
+            first.start()
+            started.wait(5)
+
+            losers = []
+
+            def lose():
+                losers.append('reached book()')
+                raise SlotUnavailable('a')
+            second = threading.Thread(target=lambda: self.assertRaises(SlotUnavailable, intake.submit, 'a', lose))
+            second.start()
+            clock.sleep(0.05)
+            self.assertEqual(intake.stats()['depth'], 2)
+            with self.assertRaises(IntakeFull):
+                intake.submit('a', lose)
+            release.set()
+            first.join()
+            second.join()
+
+        self.assertEqual(results[0][0], 'first')
+        self.assertEqual(losers, [])
+        stats = intake.stats()
+        self.assertEqual((stats['depth'], stats['overflow'], stats['rejected']), (0, 1, 1))
+        self.assertEqual(stats['processed'], 2)
+        self.assertIsNotNone(stats['wait_ms']['p99'])
+
+    def test_attempts_not_picked_up_in_time_are_withdrawn(self):
+        intake = BookingIntake()
+        book, started, release = self.blocked_booking()
+        calls = []
+        first = threading.Thread(target=intake.submit, args=('a', book))
+        first.start()
+        started.wait(5)
+        with self.assertRaises(IntakeTimeout):
+            intake.submit('b', lambda: calls.append('b'), timeout=0.05)
+        release.set()
+        first.join()
+        intake.submit('c', lambda: calls.append('c'))
+        self.assertEqual(calls, ['c'])
+        self.assertEqual(intake.stats()['timeouts'], 1)
+
+
+@override_settings(RESERVATIONS_SURGE={'ENABLED': True, 'RATE': '100/min'})
+class SurgeModeTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        intake_module.reset_intake()
+        self.addCleanup(intake_module.reset_intake)
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(10, 0), slot_duration=60,
+        )
+        self.slot = {
+            'facility': self.facility.id,
+            'date': (timezone.localdate() + timedelta(days=1)).isoformat(),
+            'start_time': '09:00',
+        }
+        self.users = [User.objects.create_user(f'player{i}', password='secret') for i in range(8)]
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_racing_users_get_one_booking_and_fast_rejections(self):
+        statuses, lock = [], threading.Lock()
+        barrier = threading.Barrier(len(self.users))
+
+        def attempt(user):
+            client = self.client_for(user)
+            barrier.wait()
+            try:
+                response = client.post('/api/reservations/', self.slot, format='json')
+                with lock:
+                    statuses.append(response.status_code)
+                    if response.status_code == 201:
+                        self.assertIn('queue;dur=', response['Server-Timing'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] + [409] * (len(self.users) - 1))
+        self.assertEqual(Reservation.objects.filter(is_cancelled=False).count(), 1)
+        stats = self.client_for(User.objects.create_user('admin', password='x', is_staff=True)).get(
+            '/api/reservations/intake-stats/'
+        ).data
+        self.assertEqual(stats['accepted'], 1)
+        self.assertEqual(stats['conflicts'], 0)
+        self.assertEqual(stats['rejected'], len(self.users) - 1)
+
+    def test_cancelling_lets_the_slot_be_booked_again(self):
+        client = self.client_for(self.users[0])
+        reservation = client.post('/api/reservations/', self.slot, format='json').data
+        self.assertEqual(client.post('/api/reservations/', self.slot, format='json').status_code, 409)
+        client.delete(f'/api/reservations/{reservation["id"]}/')
+        self.assertEqual(client.post('/api/reservations/', self.slot, format='json').status_code, 201)
+
+    @override_settings(RESERVATIONS_SURGE={'ENABLED': True, 'RATE': '2/min'})
+    def test_booking_attempts_are_rate_limited_per_user(self):
+        client = self.client_for(self.users[0])
+        statuses = [
+            client.post('/api/reservations/', {**self.slot, 'start_time': start}, format='json').status_code
+            for start in ('08:00', '09:00', '08:00')
+        ]
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(self.client_for(self.users[1]).get('/api/reservations/').status_code, 200)
+
+
+class BulkReservationTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(20, 0), slot_duration=60,
+        )
+        self.start = timezone.localdate() + timedelta(days=1)
+        self.slots = self.facility.generate_time_slots(self.start, self.start + timedelta(days=1))
+        self.user = User.objects.create_user('club', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, **data):
+        return self.client.post('/api/reservations/bulk/', data, format='json')
+
+    def test_all_or_nothing_books_every_slot_with_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            response = self.bulk(time_slots=[slot.id for slot in self.slots[:2]])
+        self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            response = self.bulk(time_slots=[slot.id for slot in self.slots[2:12]])
+        self.assertEqual(response.data['booked'], 10)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual({row['status'] for row in response.data['results']}, {'booked'})
+        self.assertEqual(Reservation.objects.filter(user=self.user, is_cancelled=False).count(), 12)
+
+    def test_all_or_nothing_books_nothing_when_a_slot_is_taken(self):
+        book_time_slot(self.other, self.slots[1])
+        response = self.bulk(time_slots=[slot.id for slot in self.slots[:3]])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([row['status'] for row in response.data['results']], ['skipped', 'taken', 'skipped'])
+        self.assertFalse(Reservation.objects.filter(user=self.user).exists())
+
+    def test_best_effort_books_what_is_free(self):
+        book_time_slot(self.other, self.slots[1])
+        response = self.bulk(time_slots=[self.slots[0].id, self.slots[1].id, 999999], mode='best_effort')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row['time_slot'], row['status']) for row in response.data['results']],
+            [(self.slots[0].id, 'booked'), (self.slots[1].id, 'taken'), (999999, 'not_found')],
+        )
+
+    def test_weekly_recurrence_materializes_and_books(self):
+        start = timezone.localdate() + timedelta(days=1)
+        rule = {
+            'facility': self.facility.id, 'weekday': start.weekday(), 'start_time': '18:00',
+            'start_date': start.isoformat(), 'end_date': (start + timedelta(days=27)).isoformat(),
+        }
+        self.client.get('/api/timeslots/', {'facility_id': self.facility.id, 'date': start.isoformat()})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk(recurrence=rule)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['booked'], 4)
+        self.assertEqual(
+            [row['date'] for row in response.data['results']],
+            [start + timedelta(days=7 * week) for week in range(4)],
+        )
+        listed = self.client.get('/api/timeslots/', {'facility_id': self.facility.id, 'date': start.isoformat()})
+        self.assertFalse(next(slot for slot in listed.data if slot['start_time'] == '18:00:00')['is_available'])
+
+        response = self.bulk(recurrence={**rule, 'start_time': '18:30'}, mode='best_effort')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual({row['status'] for row in response.data['results']}, {'not_scheduled'})
+
+    def test_weekly_recurrence_queries_do_not_grow_with_the_weeks(self):
+        start = timezone.localdate() + timedelta(days=1)
+
+        def rule(start_time, weeks):
+            return {
+                'facility': self.facility.id, 'weekday': start.weekday(), 'start_time': start_time,
+                'start_date': start.isoformat(), 'end_date': (start + timedelta(weeks=weeks, days=-1)).isoformat(),
+            }
+
+        with CaptureQueriesContext(connection) as short:
+            self.assertEqual(self.bulk(recurrence=rule('17:00', 2)).data['booked'], 2)
+        with self.assertNumQueries(len(short)):
+            self.assertEqual(self.bulk(recurrence=rule('18:00', 12)).data['booked'], 12)
+
+    def test_requires_exactly_one_selection(self):
+        self.assertEqual(self.bulk().status_code, 400)
+        rule = {'facility': self.facility.id, 'weekday': 1, 'start_time': '18:00',
+                'start_date': '2030-01-01', 'end_date': '2029-01-01'}
+        self.assertEqual(self.bulk(time_slots=[self.slots[0].id], recurrence=rule).status_code, 400)
+        self.assertIn('end_date', self.bulk(recurrence=rule).data['recurrence'])
+
+
+class IntervalScheduleTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.facility = SportFacility.objects.create(
+            name='Hall', description='Multi-purpose hall', facility_type='futsal',
+            opening_time=time(8, 0), closing_time=time(12, 0), slot_duration=60,
+            schedule_mode=SportFacility.INTERVALS,
+        )
+        self.day = timezone.localdate() + timedelta(days=1)
+        FacilityClosure.objects.create(
+            facility=self.facility, date=self.day, start_time=time(10, 0), end_time=time(11, 0),
+            reason='Floor maintenance',
+        )
+        self.user = User.objects.create_user('team', password='secret')
+        self.client.force_authenticate(self.user)
+
+    def listing(self):
+        response = self.client.get('/api/timeslots/', {'facility_id': self.facility.id, 'date': self.day.isoformat()})
+        return [(slot['start_time'], slot['end_time'], slot['is_available']) for slot in response.data]
+
+    def book(self, start_time, end_time=None):
+        data = {'facility': self.facility.id, 'date': self.day.isoformat(), 'start_time': start_time}
+        if end_time:
+            data['end_time'] = end_time
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/reservations/', data, format='json')
+
+    def test_subtract(self):
+        self.assertEqual(subtract([(0, 100)], [(10, 20), (50, 60), (90, 120)]), [(0, 10), (20, 50), (60, 90)])
+        self.assertEqual(subtract([(0, 10), (20, 30)], [(5, 25)]), [(0, 5), (25, 30)])
+
+    def test_free_time_is_listed_without_storing_slots(self):
+        self.assertEqual(self.listing(), [
+            ('08:00:00', '09:00:00', True), ('09:00:00', '10:00:00', True), ('11:00:00', '12:00:00', True),
+        ])
+        self.assertEqual(self.facility.generate_time_slots(self.day), [])
+        self.assertFalse(TimeSlot.objects.exists())
+
+    def test_variable_length_booking_stores_only_the_booked_interval(self):
+        response = self.book('08:30', '10:00')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['time_slot_details']['end_time'], '10:00:00')
+        self.assertEqual(TimeSlot.objects.count(), 1)
+        self.assertEqual(self.listing(), [('08:30:00', '10:00:00', False), ('11:00:00', '12:00:00', True)])
+
+        self.assertEqual(self.book('09:00').status_code, 409)   # overlaps the booking
+        self.assertEqual(self.book('10:00').status_code, 404)   # closed
+        self.assertEqual(self.book('11:10').status_code, 404)   # off the 15 minute steps
+        self.assertEqual(self.book('11:30').status_code, 404)   # runs past closing time
+
+        schedule = self.client.get(f'/api/facilities/{self.facility.id}/schedule/', {'date': self.day.isoformat()})
+        self.assertEqual(
+            [(row['start_time'], row['end_time']) for row in schedule.json()['free']],
+            [('08:00:00', '08:30:00'), ('11:00:00', '12:00:00')],
+        )
+        matrix = self.client.get('/api/availability/', {
+            'start': self.day.isoformat(), 'end': self.day.isoformat(), 'facility_ids': self.facility.id,
+        })
+        self.assertEqual(matrix.data['facilities'][0]['days'][self.day.isoformat()], '0001')
+
+    def test_cancelled_interval_can_be_rebooked_with_other_bounds(self):
+        reservation = Reservation.objects.get(pk=self.book('08:00', '09:30').data['id'])
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.cancel()
+        response = self.book('08:00', '08:45')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['time_slot_details']['end_time'], '08:45:00')
+        # The cancelled reservation keeps the bounds it was made for
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.time_slot.end_time, time(9, 30))
+        self.assertEqual(self.book('08:45', '10:00').status_code, 201)
+        self.assertEqual(self.book('08:00', '09:30').status_code, 409)
+
+    def test_intervals_may_end_at_midnight(self):
+        self.facility.opening_time, self.facility.closing_time = time(20, 0), time(0, 0)
+        self.facility.save()
+        self.assertEqual(self.listing(), [
+            ('20:00:00', '21:00:00', True), ('21:00:00', '22:00:00', True),
+            ('22:00:00', '23:00:00', True), ('23:00:00', '00:00:00', True),
+        ])
+        response = self.book('23:00')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['time_slot_details']['end_time'], '00:00:00')
+        self.assertEqual(self.book('23:30').status_code, 404)   # runs past midnight
+        self.assertEqual(self.book('22:00', '23:30').status_code, 409)
+        self.assertEqual(self.book('22:00', '23:00').status_code, 201)
+        self.assertEqual(self.listing()[-2:], [('22:00:00', '23:00:00', False), ('23:00:00', '00:00:00', False)])
+
+    def test_recurring_booking(self):
+        closed = self.day + timedelta(days=7)
+        FacilityClosure.objects.create(facility=self.facility, date=closed, reason='Holiday')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/reservations/bulk/', {
+                'recurrence': {
+                    'facility': self.facility.id, 'weekday': self.day.weekday(), 'start_time': '09:00',
+                    'start_date': self.day.isoformat(), 'end_date': (self.day + timedelta(days=20)).isoformat(),
+                },
+                'mode': 'best_effort',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['booked'], 2)
+        self.assertEqual(
+            [(row['date'], row['status']) for row in response.data['results']],
+            [(self.day, 'booked'), (self.day + timedelta(days=14), 'booked'), (closed, 'not_scheduled')],
+        )
+        self.assertEqual(self.book('08:30').status_code, 409)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.user = User.objects.create_user('alice', password='secret')
+        today = timezone.localdate()
+        old = today - timedelta(days=100)
+        self.booked = TimeSlot.objects.create(
+            facility=self.facility, date=old, start_time=time(9, 0), end_time=time(10, 0),
+        )
+        TimeSlot.objects.create(facility=self.facility, date=old, start_time=time(10, 0), end_time=time(11, 0))
+        self.cancelled = Reservation.objects.create(user=self.user, time_slot=self.booked, is_cancelled=True)
+        self.active = Reservation.objects.create(user=self.user, time_slot=self.booked)
+        upcoming = TimeSlot.objects.create(
+            facility=self.facility, date=today + timedelta(days=1), start_time=time(9, 0), end_time=time(10, 0),
+        )
+        self.upcoming = Reservation.objects.create(user=self.user, time_slot=upcoming)
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_history', '--retention-days=90', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        self.assertIn('Moved 1 slot(s) and 2 reservation(s)', self.archive('--dry-run'))
+        self.assertEqual(TimeSlot.objects.count(), 3)
+        self.assertFalse(ArchivedTimeSlot.objects.exists())
+
+    def test_moves_history_to_the_archive_tables(self):
+        output = self.archive('--batch-size=1')
+        self.assertIn('Moved 1 slot(s) and 2 reservation(s)', output)
+        self.assertIn('purged 1 unreserved slot(s)', output)
+        self.assertEqual(list(TimeSlot.objects.values_list('date', flat=True)), [timezone.localdate() + timedelta(days=1)])
+        self.assertEqual(list(Reservation.objects.values_list('id', flat=True)), [self.upcoming.id])
+        self.assertEqual(ArchivedTimeSlot.objects.get().id, self.booked.id)
+        self.assertEqual(
+            set(ArchivedReservation.objects.values_list('id', 'is_cancelled')),
+            {(self.cancelled.id, True), (self.active.id, False)},
+        )
+
+        history = reservation_history(user=self.user).order_by('date', 'id')
+        self.assertEqual(
+            [(row['id'], row['date'], row['is_cancelled']) for row in history],
+            [(self.cancelled.id, self.booked.date, True), (self.active.id, self.booked.date, False),
+             (self.upcoming.id, self.upcoming.time_slot.date, False)],
+        )
+        self.assertEqual(reservation_history(end_date=timezone.localdate()).count(), 2)
+
+    def test_export_to_gzipped_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/history.jsonl.gz'
+            self.archive(f'--export={path}')
+            with gzip.open(path, 'rt') as exported:
+                rows = [json.loads(line) for line in exported]
+        self.assertEqual(
+            [(row['model'], row['id']) for row in rows],
+            [('time_slot', self.booked.id), ('reservation', self.cancelled.id), ('reservation', self.active.id)],
+        )
+        self.assertFalse(ArchivedTimeSlot.objects.exists())
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+class BookingTransactionTests(TransactionTestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.slot = self.facility.generate_time_slots(timezone.localdate() + timedelta(days=1))[0]
+        self.user = User.objects.create_user('alice', password='secret')
+
+    def begin_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            book_time_slot(self.user, self.slot)
+        return next(query['sql'] for query in queries if query['sql'].startswith('BEGIN'))
+
+    def test_bookings_take_the_sqlite_write_lock_up_front(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertEqual(self.begin_statement(), 'BEGIN IMMEDIATE')
+        self.assertIsNone(connection.transaction_mode)  # other transactions stay deferred
+
+    @override_settings(RESERVATIONS_DATABASE={'IMMEDIATE_BOOKINGS': False})
+    def test_immediate_bookings_can_be_turned_off(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertEqual(self.begin_statement(), 'BEGIN')
+
+
+class FacilityCatalogTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        self.court = SportFacility.objects.create(
+            name='Court 1', description='A long description. ' * 20, facility_type='badminton',
+        )
+        SportFacility.objects.create(name='Pool', description='Outdoor pool', facility_type='swimming')
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/facilities/catalog/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertEqual([facility['name'] for facility in response.data], ['Court 1', 'Pool'])
+        self.assertNotIn('description', response.data[0])
+        self.assertLessEqual(len(response.data[0]['summary']), FacilityCatalogSerializer.summary_length)
+
+        with mock.patch.object(FacilityCatalogSerializer, 'to_representation') as serialize:
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/facilities/catalog/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get('/api/facilities/catalog/').status_code, 200)
+            serialize.assert_not_called()
+
+        self.court.name = 'Court A'
+        self.court.save()
+        response = self.client.get('/api/facilities/catalog/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['name'], 'Court A')
+        changed = response['ETag']
+        self.assertNotEqual(changed, etag)
+
+        self.court.delete()
+        self.assertEqual(self.client.get('/api/facilities/catalog/', HTTP_IF_NONE_MATCH=changed).status_code, 200)
+
+    def test_thumbnail_rendered_on_upload(self):
+        picture = BytesIO()
+        Image.new('RGB', (1200, 900), 'green').save(picture, 'PNG')
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            self.court.image = SimpleUploadedFile('court.png', picture.getvalue(), content_type='image/png')
+            self.court.save()
+            self.assertEqual(self.court.thumbnail.name, 'facilities/thumbnails/court.jpg')
+            with Image.open(self.court.thumbnail.path) as thumbnail:
+                self.assertEqual(thumbnail.size, (427, 320))
+
+            court = SportFacility.objects.get(pk=self.court.pk)
+            with mock.patch('reservations.models.render_thumbnail') as render:
+                court.save()
+            render.assert_not_called()
+            self.assertTrue(
+                self.client.get('/api/facilities/catalog/').data[0]['thumbnail'].endswith('/facilities/thumbnails/court.jpg')
+            )
+
+
+class TokenAuthCacheTests(APITestCase):
+    def setUp(self):
+        clear_caches()
+        local_tokens.clear()
+        self.user = User.objects.create_user('player', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token_skips_the_lookup(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/api/reservations/').status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/reservations/').status_code, 200)
+        local_tokens.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/reservations/').status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+
+    def test_logout_and_rotation_revoke_the_token(self):
+        self.client.get('/api/reservations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.client.get('/api/reservations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            token.delete()
+            rotated = Token.objects.create(user=self.user)
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {rotated.key}')
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+
+    def test_locmem_entries_live_no_longer_than_the_local_ttl(self):
+        # Other processes have their own locmem, which logging out cannot clear
+        shared = authentication.shared_cache()
+        with mock.patch.object(shared, 'set', wraps=shared.set) as cache_set:
+            self.client.get('/api/reservations/')
+        self.assertEqual(cache_set.call_args.args[2], 10)
+        dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        with override_settings(CACHES={**settings.CACHES, 'default': dummy}):
+            self.assertEqual(authentication.shared_timeout(), 300)
+
+    def test_api_is_token_only_and_the_admin_keeps_sessions(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.credentials()
+        self.assertTrue(self.client.login(username='admin', password='secret'))
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+        self.assertEqual(self.client.get('/admin/').status_code, 200)
+
+        self.client.logout()
+        response = self.client.post('/api/auth/login/', {'username': 'admin', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('sessionid', response.cookies)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['key']}")
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/user/').data['username'], admin.username)
+
+
+class WaitlistTests(APITestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.slot = materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        self.holder, self.first, self.second = (
+            User.objects.create_user(name, password='secret') for name in ('holder', 'first', 'second')
+        )
+        self.reservation = book_time_slot(self.holder, self.slot)
+        self.url = f'/api/timeslots/{self.slot.id}/waitlist/'
+
+    def join(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(self.url)
+
+    def test_joining_the_queue(self):
+        self.assertEqual(self.join(self.first).status_code, 201)
+        response = self.join(self.second)
+        self.assertEqual((response.status_code, response.data['position']), (201, 2))
+        response = self.join(self.first)
+        self.assertEqual((response.status_code, response.data['position']), (200, 1))
+        self.assertEqual(self.join(self.holder).status_code, 409)
+
+        free = materialize_time_slot(self.facility, self.tomorrow, time(10, 0))
+        self.client.force_authenticate(self.first)
+        self.assertEqual(self.client.post(f'/api/timeslots/{free.id}/waitlist/').status_code, 409)
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['length'], response.data['entry']['position']), (2, 1))
+
+    def test_cancelling_promotes_the_head_of_the_queue(self):
+        self.join(self.first)
+        self.join(self.second)
+        self.client.force_authenticate(self.holder)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/reservations/{self.reservation.id}/').status_code, 204)
+
+        promoted = Reservation.objects.get(time_slot=self.slot, is_cancelled=False)
+        self.assertEqual(promoted.user, self.first)
+        self.client.force_authenticate(self.second)
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['length'], response.data['entry']['position']), (1, 1))
+        slots = self.client.get('/api/timeslots/', {'facility_id': self.facility.id, 'date': self.tomorrow}).data
+        self.assertFalse(next(slot for slot in slots if slot['id'] == self.slot.id)['is_available'])
+
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertEqual(self.client.delete(self.url).status_code, 404)
+        self.assertIsNone(promoted.cancel())
+        self.assertTrue(TimeSlot.objects.with_availability().get(pk=self.slot.pk).is_available)
+
+    def test_promotion_skips_inactive_users_and_costs_the_same_for_any_queue(self):
+        join_waitlist(self.first, self.slot)
+        self.first.is_active = False
+        self.first.save()
+        join_waitlist(self.second, self.slot)
+        with CaptureQueriesContext(connection) as short_queue:
+            promoted = self.reservation.cancel()
+        self.assertEqual(promoted.user, self.second)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+        for i in range(50):
+            join_waitlist(User.objects.create_user(f'waiting{i}'), self.slot)
+        with CaptureQueriesContext(connection) as long_queue:
+            promoted = promoted.cancel()
+        self.assertEqual(promoted.user.username, 'waiting0')
+        self.assertLessEqual(len(long_queue), len(short_queue))
+
+
+@override_settings(RESERVATIONS_JOBS={'PERIODIC': {}})
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(12, 0), slot_duration=60,
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.user = User.objects.create_user('player', email='player@example.com', password='secret')
+
+    def test_booking_confirmations_are_sent_by_the_worker(self):
+        slot = materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        reservation = book_time_slot(self.user, slot)
+        other = materialize_time_slot(self.facility, self.tomorrow, time(10, 0))
+        book_time_slot(User.objects.create_user('no-email'), other)
+        self.assertEqual(list(Job.objects.values_list('name', 'payload')), [
+            ('send_booking_confirmation', {'reservation_id': reservation.id, 'from_waitlist': False}),
+        ])
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(jobs.run_due_jobs('test'), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['player@example.com']])
+
+        waiting = User.objects.create_user('waiting', email='waiting@example.com')
+        join_waitlist(waiting, slot)
+        reservation.cancel()
+        self.assertEqual(jobs.run_due_jobs('test'), 1)
+        self.assertEqual(mail.outbox[1].to, ['waiting@example.com'])
+        self.assertIn('waitlist', mail.outbox[1].body)
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        calls = []
+
+        @jobs.task(name='flaky', max_attempts=2)
+        def flaky(value):
+            calls.append(value)
+            raise RuntimeError('try again')
+
+        self.addCleanup(jobs.tasks.pop, 'flaky')
+        job = jobs.enqueue('flaky', value=1)
+        with self.assertLogs('reservations.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_due_jobs('test'), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(jobs.run_due_jobs('test'), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('reservations.jobs', 'ERROR'):
+            jobs.run_due_jobs('test')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, calls), (Job.FAILED, 2, [1, 1]))
+        self.assertIn('RuntimeError: try again', job.last_error)
+
+    @override_settings(RESERVATIONS_JOBS={'PERIODIC': {'extend_horizons': 3600}})
+    # Like the test client, keep the test's connection and transaction open
+    @mock.patch('reservations.management.commands.run_jobs.close_old_connections')
+    def test_periodic_jobs_and_the_worker_command(self, close_old_connections):
+        out = StringIO()
+        call_command('run_jobs', '--once', stdout=out)
+        self.assertIn('ran 1 job(s)', out.getvalue())
+        self.facility.refresh_from_db()
+        self.assertEqual(self.facility.slots_horizon, timezone.localdate() + timedelta(days=6))
+
+        call_command('run_jobs', '--once', stdout=out)
+        self.assertIn('ran 0 job(s)', out.getvalue())
+        pending = Job.objects.get(status=Job.QUEUED)
+        self.assertEqual(pending.key, 'periodic:extend_horizons')
+        self.assertIsNone(jobs.enqueue('extend_horizons', key=pending.key))
+        self.assertGreater(pending.run_at, timezone.now() + timedelta(minutes=59))
+
+        Job.objects.filter(pk=pending.pk).update(
+            status=Job.RUNNING, locked_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+
+    def test_jobs_that_keep_losing_their_worker_fail(self):
+        lost = timezone.now() - timedelta(hours=1)
+        retried = jobs.enqueue('purge_jobs')
+        crashing = jobs.enqueue('purge_jobs')
+        Job.objects.filter(pk=retried.pk).update(status=Job.RUNNING, locked_at=lost, attempts=1)
+        Job.objects.filter(pk=crashing.pk).update(status=Job.RUNNING, locked_at=lost, attempts=crashing.max_attempts)
+        with self.assertLogs('reservations.jobs', 'ERROR'):
+            self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        retried.refresh_from_db()
+        crashing.refresh_from_db()
+        self.assertEqual(retried.status, Job.QUEUED)
+        self.assertEqual(crashing.status, Job.FAILED)
+        self.assertIsNotNone(crashing.finished_at)
+        self.assertEqual(jobs.run_due_jobs('test'), 1)
+
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.facility = SportFacility.objects.create(
+            name='Court 1', description='Indoor court', facility_type='badminton',
+            opening_time=time(8, 0), closing_time=time(12, 0), slot_duration=60,
+        )
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        self.user = User.objects.create_user('player')
+        self.waiting = User.objects.create_user('waiting')
+
+    def reconcile(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('reconcile_availability', '--chunk-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def cached_availability(self):
+        return {slot.start_time: slot.is_available for slot in cached_day_slots(self.facility, self.tomorrow)}
+
+    def test_drift_is_found_and_fixed(self):
+        slot = materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        materialize_time_slot(self.facility, self.tomorrow, time(10, 0))
+        reservation = book_time_slot(self.user, slot)
+        join_waitlist(self.waiting, slot)
+        self.assertEqual(self.cached_availability(), {time(9, 0): False, time(10, 0): True})
+        # Writes that skip the model methods: no invalidation and no promotion
+        Reservation.objects.filter(pk=reservation.pk).update(is_cancelled=True)
+        TimeSlot.objects.bulk_create([
+            TimeSlot(facility=self.facility, date=self.tomorrow, start_time=time(10, 30), end_time=time(11, 30)),
+        ])
+
+        output = self.reconcile('--dry-run')
+        self.assertIn('[dry run] Checked 3 slot(s): 1 stale cached day(s), 1 waitlist(s) on free slots', output)
+        self.assertIn('1 off-grid slot(s) (0 deleted)', output)
+        self.assertEqual(TimeSlot.objects.count(), 3)
+
+        output = self.reconcile()
+        self.assertIn('(1 promoted), 1 off-grid slot(s) (1 deleted)', output)
+        self.assertEqual(Reservation.objects.get(is_cancelled=False).user, self.waiting)
+        self.assertEqual(self.cached_availability(), {time(9, 0): False, time(10, 0): True})
+
+        self.assertIn('Checked 2 slot(s): 0 stale cached day(s), 0 waitlist(s)', self.reconcile())
+
+    def test_days_never_cached_are_not_written(self):
+        materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        materialize_time_slot(self.facility, self.tomorrow + timedelta(days=1), time(9, 0))
+        clear_caches()
+        self.assertIn('Checked 2 slot(s): 0 stale cached day(s)', self.reconcile())
+        self.assertIsNone(availability_cache.cache.get(availability_cache.facility_version_key(self.facility.id)))
+        self.assertIsNone(availability_cache.cache.get(availability_cache.day_version_key(self.facility.id, self.tomorrow)))
+
+    @override_settings(RESERVATIONS_JOBS={'PERIODIC': {}})
+    def test_reconciliation_job(self):
+        slot = materialize_time_slot(self.facility, self.tomorrow, time(9, 0))
+        join_waitlist(self.waiting, book_time_slot(self.user, slot).time_slot)
+        Reservation.objects.update(is_cancelled=True)
+        jobs.enqueue('reconcile_availability', days=2)
+        with self.assertLogs('reservations.jobs', 'WARNING'):
+            jobs.run_due_jobs('test')
+        self.assertEqual(Reservation.objects.get(is_cancelled=False).user, self.waiting)
@@ -1,76 +1,458 @@
 from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
-from .models import SportFacility, TimeSlot, Reservation
-from .serializers import SportFacilitySerializer, TimeSlotSerializer, ReservationSerializer
-from django.utils.dateparse import parse_date
+from rest_framework.views import APIView
+from .models import SportFacility, TimeSlot, Reservation, WaitlistEntry
+from .serializers import (
+    BulkReservationSerializer, ReservationSerializer, SportFacilitySerializer, TimeSlotSerializer,
+    WaitlistEntrySerializer,
+)
+from .cache import availability_cache, cached_day_slots, cached_facility
+from .catalog import catalog_data, catalog_version
+from .booking import (
+    AlreadyBooked, SlotAvailable, SlotUnavailable, book_time_slot, book_time_slots, join_waitlist, slot_key,
+)
+from .intake import BookingRateThrottle, IntakeFull, IntakeTimeout, get_intake, intake_key, slot_keys
+from .metrics import PerformanceMixin, registry
+from .filters import (
+    filter_reservations, filter_time_slots, param_bool, param_date, param_int, param_int_list,
+)
+from .pagination import FacilityPagination, ReservationPagination, TimeSlotPagination
+from .schedule import (
+    closures_by_day, facility_closures, free_intervals, interval_time_slot, open_intervals, to_time,
+)
+from .slots import (
+    availability_matrix, materialize_recurring_slots, materialize_time_slot, run_length_encode,
+    virtual_time_slots,
+)
+from datetime import timedelta
+from django.db import OperationalError
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_time
+from django.utils.http import http_date
 
-class SportFacilityViewSet(viewsets.ModelViewSet):
+class SportFacilityViewSet(PerformanceMixin, viewsets.ModelViewSet):
     queryset = SportFacility.objects.all()
     serializer_class = SportFacilitySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FacilityPagination
 
-class TimeSlotViewSet(viewsets.ModelViewSet):
-    queryset = TimeSlot.objects.all()
+    def get_queryset(self):
+        """Annotate today's booked slot count for the availability summary"""
+        now = timezone.localtime()
+        return SportFacility.objects.with_booked_count(now.date(), after=now.time())
+
+    @action(detail=False, pagination_class=None)
+    def catalog(self, request):
+        """
+        Every facility in the compact catalog form, with an ETag and
+        Last-Modified. A conditional GET of an unchanged catalog answers 304
+        after one aggregate query, without serializing anything.
+        """
+        etag, modified = catalog_version()
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if modified is not None:
+            headers['Last-Modified'] = http_date(modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(modified.timestamp()) if modified else None,
+        )
+        if response is None:
+            response = Response(catalog_data(request, etag))
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    @action(detail=True)
+    def schedule(self, request, pk=None):
+        """
+        Free/busy of a facility on ?date= (default today): its open hours
+        after closures, its bookings and the free intervals left, which
+        interval-mode facilities can book in any STEP-aligned length.
+        """
+        facility = cached_facility(int(pk)) if pk.isdigit() else None
+        if facility is None:
+            raise NotFound()
+        date = param_date(request.query_params, 'date') or timezone.localdate()
+        closures = facility_closures(facility, date) if facility.uses_intervals else []
+        busy = [slot for slot in cached_day_slots(facility, date) if not slot.is_available]
+        now = timezone.localtime()
+
+        def intervals(pairs):
+            return [{'start_time': to_time(start), 'end_time': to_time(end)} for start, end in pairs]
+
+        return Response({
+            'facility': facility.id,
+            'date': date,
+            'schedule_mode': facility.schedule_mode,
+            'open': intervals(open_intervals(facility, date, closures, now)),
+            'busy': [
+                {'time_slot': slot.id, 'start_time': slot.start_time, 'end_time': slot.end_time}
+                for slot in busy
+            ],
+            'free': intervals(free_intervals(
+                facility, date, [(slot.start_time, slot.end_time) for slot in busy], closures, now,
+            )),
+        })
+
+class TimeSlotViewSet(PerformanceMixin, viewsets.ModelViewSet):
+    queryset = TimeSlot.objects.with_availability()
     serializer_class = TimeSlotSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = TimeSlotPagination
 
     def get_queryset(self):
-        """Auto-generate slots and filter by facility and date"""
-        facility_id = self.request.query_params.get('facility_id')
-        date_str = self.request.query_params.get('date')
+        """Filter by facility, dates and availability. Never writes to the database."""
+        return filter_time_slots(TimeSlot.objects.with_availability(), self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        """
+        A facility-day lists its stored slots, served from the availability
+        cache, merged with the not yet materialized part of the grid.
+        Anything else is a paginated listing of stored slots.
+        """
+        params = request.query_params
+        facility_id = param_int(params, 'facility_id')
+        date = param_date(params, 'date')
+        if facility_id is None or date is None:
+            return super().list(request, *args, **kwargs)
 
-        if facility_id and date_str:
+        facility = cached_facility(facility_id)
+        if facility is None:
+            return Response([])
+
+        slots = virtual_time_slots(facility, date, stored=cached_day_slots(facility, date))
+        available = param_bool(params, 'available')
+        if available is not None:
+            slots = [slot for slot in slots if slot.is_available == available]
+        serializer = self.get_serializer(slots, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get', 'post', 'delete'], permission_classes=[permissions.IsAuthenticated])
+    def waitlist(self, request, pk=None):
+        """
+        The waitlist of a booked slot. GET gives its length and the user's
+        place, POST joins it and DELETE leaves it. Whoever is first gets the
+        slot as soon as its reservation is cancelled, so there is no need
+        to poll for it.
+        """
+        time_slot = self.get_object()
+        queue = WaitlistEntry.objects.filter(time_slot=time_slot)
+        if request.method == 'DELETE':
+            deleted, _ = queue.filter(user=request.user).delete()
+            if not deleted:
+                raise NotFound('You are not on the waitlist of this time slot.')
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        if request.method == 'POST':
             try:
-                facility = SportFacility.objects.get(id=facility_id)
-                date = parse_date(date_str)
-                if date:
-                    # Auto-generate slots for the given date
-                    facility.generate_time_slots(for_date=date)
-                    return TimeSlot.objects.filter(facility=facility, date=date)
-            except SportFacility.DoesNotExist:
-                return TimeSlot.objects.none()
-        
-        return TimeSlot.objects.none()
-
-class ReservationViewSet(viewsets.ModelViewSet):
+                entry, created = join_waitlist(request.user, time_slot)
+            except SlotAvailable:
+                return Response(
+                    {"detail": "This time slot is available, book it instead."},
+                    status=status.HTTP_409_CONFLICT
+                )
+            except AlreadyBooked:
+                return Response(
+                    {"detail": "You have already booked this time slot."},
+                    status=status.HTTP_409_CONFLICT
+                )
+            entry = queue.with_position().get(pk=entry.pk)
+            return Response(
+                WaitlistEntrySerializer(entry).data,
+                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+            )
+
+        entry = queue.with_position().filter(user=request.user).first()
+        return Response({
+            'time_slot': time_slot.pk,
+            'length': queue.count(),
+            'entry': WaitlistEntrySerializer(entry).data if entry is not None else None,
+        })
+
+class ReservationViewSet(PerformanceMixin, viewsets.ModelViewSet):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ReservationPagination
+    throttle_classes = [BookingRateThrottle]
+    # No PUT/PATCH: moving a booking is a cancellation and a new booking,
+    # each going through booking_transaction() and the waitlist
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
 
     def get_queryset(self):
         """Users can only see their own reservations"""
+        # Slots are prefetched rather than joined so that their availability
+        # annotation comes along: two queries however many reservations.
+        queryset = Reservation.objects.prefetch_related(Prefetch(
+            'time_slot',
+            queryset=TimeSlot.objects.with_availability().select_related('facility'),
+        ))
+        queryset = filter_reservations(queryset, self.request.query_params)
         if self.request.user.is_staff:
-            return Reservation.objects.all()
-        return Reservation.objects.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
 
     def create(self, request, *args, **kwargs):
-        """Create a new reservation and mark the time slot as unavailable"""
-        time_slot_id = request.data.get('time_slot')
-
+        """
+        Create a new reservation, which makes the time slot unavailable.
+        Accepts either a stored time_slot id or the facility, date and
+        start_time of a slot that has not been materialized yet. In surge
+        mode the attempt is queued behind earlier ones for the same slot.
+        """
+        data, user = request.data, request.user
+        intake = get_intake()
         try:
-            time_slot = TimeSlot.objects.get(id=time_slot_id)
-            if not time_slot.is_available:
-                return Response(
-                    {"detail": "This time slot is already booked."},
-                    status=status.HTTP_400_BAD_REQUEST
+            if intake is None:
+                reservation = book_time_slot(user, self.get_time_slot(data))
+            else:
+                reservation, wait = intake.submit(
+                    intake_key(data), lambda: book_time_slot(user, self.get_time_slot(data))
                 )
-
-            # Mark the time slot as unavailable
-            time_slot.is_available = False
-            time_slot.save()
-
-            # Create reservation with the current user
-            request.data['user'] = request.user.id
-            return super().create(request, *args, **kwargs)
-
-        except TimeSlot.DoesNotExist:
+                if getattr(request, 'timings', None) is not None:
+                    request.timings.queue = wait
+        except (TimeSlot.DoesNotExist, SportFacility.DoesNotExist):
             return Response(
                 {"detail": "Time slot not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except SlotUnavailable:
+            return Response(
+                {"detail": "This time slot is already booked."},
+                status=status.HTTP_409_CONFLICT
+            )
+        except IntakeFull:
+            return Response(
+                {"detail": "Too many people are booking this time slot. Please pick another one."},
+                status=status.HTTP_409_CONFLICT
+            )
+        except (IntakeTimeout, OperationalError):
+            # The queue or the database lock timed out: worth retrying
+            return self.busy_response()
+
+        serializer = self.get_serializer(reservation)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @staticmethod
+    def busy_response():
+        return Response(
+            {"detail": "Bookings are very busy right now. Please try again."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '1'},
+        )
+
+    def get_time_slot(self, data):
+        """
+        Resolve the slot being booked, materializing it when needed. Slots of
+        interval-mode facilities are checked against the schedule, and may
+        be given an end_time, which defaults to slot_duration later.
+        """
+        time_slot_id = data.get('time_slot')
+        if time_slot_id:
+            time_slot = TimeSlot.objects.select_related('facility').get(id=time_slot_id)
+            if time_slot.facility.uses_intervals:
+                time_slot = interval_time_slot(
+                    time_slot.facility, time_slot.date, time_slot.start_time, time_slot.end_time,
+                )
+        else:
+            facility = SportFacility.objects.get(id=data.get('facility'))
+            date = parse_date(data.get('date') or '')
+            start_time = parse_time(data.get('start_time') or '')
+            time_slot = None
+            if date and start_time and facility.uses_intervals:
+                end_time = parse_time(data.get('end_time') or '')
+                time_slot = interval_time_slot(facility, date, start_time, end_time)
+            elif date and start_time:
+                time_slot = materialize_time_slot(facility, date, start_time)
+        if time_slot is None:
+            raise TimeSlot.DoesNotExist
+        return time_slot
 
     def destroy(self, request, *args, **kwargs):
         """Cancel reservation and make slot available again"""
         reservation = self.get_object()
-        reservation.cancel()  # Custom model method updates availability
+        promoted = reservation.cancel()  # Goes to the head of the slot's waitlist, if any
+        intake = get_intake()
+        if intake is not None and promoted is None:
+            intake.forget(*slot_keys(reservation.time_slot))
         return Response({"detail": "Reservation cancelled."}, status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Book several slots in one transaction: a list of time_slots ids, or a
+        weekly recurrence materialized as needed. all_or_nothing (the
+        default) books every slot or none of them; best_effort books the
+        free ones. Returns the outcome of each slot.
+        """
+        serializer = BulkReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        all_or_nothing = data['mode'] == 'all_or_nothing'
+
+        unresolved = []
+        if 'recurrence' in data:
+            rule = data['recurrence']
+            slots, skipped = materialize_recurring_slots(
+                rule['facility'], rule['weekday'], rule['start_time'], rule['start_date'], rule['end_date'],
+            )
+            unresolved = [
+                {'time_slot': None, 'facility': rule['facility'].id, 'date': day,
+                 'start_time': rule['start_time'], 'status': 'not_scheduled', 'reservation': None}
+                for day in skipped
+            ]
+        else:
+            ids = list(dict.fromkeys(data['time_slots']))
+            found = TimeSlot.objects.select_related('facility').in_bulk(ids)
+            slots = [found[slot_id] for slot_id in ids if slot_id in found]
+            unresolved = [
+                {'time_slot': slot_id, 'status': 'not_found', 'reservation': None}
+                for slot_id in ids if slot_id not in found
+            ]
+            off_schedule = self.off_schedule(slots)
+            slots = [slot for slot in slots if slot.id not in off_schedule]
+            unresolved += [
+                {'time_slot': slot_id, 'status': 'not_scheduled', 'reservation': None}
+                for slot_id in ids if slot_id in off_schedule
+            ]
+
+        booked, taken = {}, set()
+        if slots and not (all_or_nothing and unresolved):
+            try:
+                booked, taken = book_time_slots(request.user, slots, all_or_nothing)
+            except SlotUnavailable as exc:
+                taken = set(exc.args)
+            except OperationalError:
+                return self.busy_response()
+
+        results = []
+        for slot in slots:
+            key = slot_key(slot)
+            reservation = booked.get(key)
+            results.append({
+                'time_slot': reservation.time_slot_id if reservation else slot.id,
+                'facility': slot.facility_id, 'date': slot.date, 'start_time': slot.start_time,
+                'status': 'booked' if reservation else 'taken' if key in taken else 'skipped',
+                'reservation': reservation.id if reservation else None,
+            })
+        return Response(
+            {'mode': data['mode'], 'booked': len(booked), 'results': results + unresolved},
+            status=status.HTTP_201_CREATED if booked else status.HTTP_409_CONFLICT,
+        )
+
+    @staticmethod
+    def off_schedule(time_slots):
+        """Ids of the stored interval-mode slots no longer within their facility's schedule"""
+        intervals = [slot for slot in time_slots if slot.facility.uses_intervals]
+        if not intervals:
+            return set()
+        closures = closures_by_day({slot.facility_id for slot in intervals}, {slot.date for slot in intervals})
+        return {
+            slot.id for slot in intervals
+            if interval_time_slot(
+                slot.facility, slot.date, slot.start_time, slot.end_time,
+                closures=closures.get((slot.facility_id, slot.date), ()),
+            ) is None
+        }
+
+    @action(detail=False, url_path='intake-stats', permission_classes=[permissions.IsAdminUser])
+    def intake_stats(self, request):
+        """Queue depth, wait times and outcomes of this process's surge-mode intake"""
+        intake = get_intake()
+        return Response({'enabled': intake is not None, **(intake.stats() if intake else {})})
+
+class AvailabilityViewSet(PerformanceMixin, viewsets.ViewSet):
+    """
+    Availability matrix of many facilities over a date range in one request.
+    Each facility-day is a '1'/'0' string with one character per grid slot
+    starting at opening_time, or its run-length encoding with ?encoding=rle.
+    """
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    max_days = 31
+    encodings = ('bitmap', 'rle')
+
+    def list(self, request):
+        params = request.query_params
+        start = param_date(params, 'start') or timezone.localdate()
+        end = param_date(params, 'end') or start + timedelta(days=6)
+        if end < start or (end - start).days >= self.max_days:
+            raise ValidationError({'end': f'Must be within {self.max_days} days on or after start.'})
+        encoding = params.get('encoding', 'bitmap')
+        if encoding not in self.encodings:
+            raise ValidationError({'encoding': f'Must be one of {", ".join(self.encodings)}.'})
+
+        facilities = SportFacility.objects.only(
+            'id', 'opening_time', 'closing_time', 'slot_duration', 'schedule_mode'
+        ).order_by('id')
+        facility_ids = param_int_list(params, 'facility_ids')
+        if facility_ids:
+            facilities = facilities.filter(id__in=facility_ids)
+
+        facilities = list(facilities)
+        matrix = availability_matrix(facilities, start, end)
+        encode = run_length_encode if encoding == 'rle' else str
+        return Response({
+            'start': start,
+            'end': end,
+            'encoding': encoding,
+            'facilities': [
+                {
+                    'id': facility.id,
+                    'opening_time': facility.opening_time,
+                    'slot_duration': facility.slot_duration,
+                    'days': {
+                        day.isoformat(): encode(bitmap)
+                        for day, bitmap in matrix[facility.id].items()
+                    },
+                }
+                for facility in facilities
+            ],
+        })
+
+    @action(detail=False, url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Hit/miss counters of this process's availability cache lookups"""
+        return Response(availability_cache.stats())
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return str(data).encode(self.charset)
+
+class MetricsView(APIView):
+    """Request and cache metrics of this process in Prometheus text format"""
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        stats = availability_cache.stats()
+        extra = [
+            ('reservations_availability_cache_hits_total', 'counter',
+             'Availability cache lookups served from the cache.', stats['hits']),
+            ('reservations_availability_cache_misses_total', 'counter',
+             'Availability cache lookups that went to the database.', stats['misses']),
+        ]
+        intake = get_intake()
+        if intake is not None:
+            stats = intake.stats()
+            extra += [
+                ('reservations_booking_queue_depth', 'gauge',
+                 'Booking attempts waiting in the surge-mode queue.', stats['depth']),
+                ('reservations_booking_queue_wait_seconds_total', 'counter',
+                 'Time processed attempts spent queued.', stats['wait_seconds_total']),
+                ('reservations_booking_queue_processed_total', 'counter',
+                 'Attempts taken off the queue.', stats['processed']),
+                ('reservations_booking_queue_rejected_total', 'counter',
+                 'Attempts turned away without a database write.',
+                 stats['rejected'] + stats['overflow'] + stats['timeouts']),
+            ]
+        body = registry.render_prometheus(extra=extra)
+        return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -9,7 +9,8 @@ const FacilityList = () => {
   useEffect(() => {
     const fetchFacilities = async () => {
       try {
-        const response = await api.get('facilities/');
+        // The catalog is small and revalidated with its ETag by the browser cache
+        const response = await api.get('facilities/catalog/');
         setFacilities(response.data);
         setLoading(false);
       } catch (error) {
@@ -30,9 +31,9 @@ const FacilityList = () => {
         {facilities.map(facility => (
           <div key={facility.id} className="col-md-4 mb-4">
             <div className="card">
-              {facility.image && (
+              {facility.thumbnail && (
                 <img 
-                  src={facility.image} 
+                  src={facility.thumbnail} 
                   className="card-img-top" 
                   alt={facility.name} 
                   style={{ height: '200px', objectFit: 'cover' }}
@@ -41,7 +42,7 @@ const FacilityList = () => {
               <div className="card-body">
                 <h5 className="card-title">{facility.name}</h5>
                 <p className="card-text">{facility.facility_type}</p>
-                <p className="card-text text-truncate">{facility.description}</p>
+                <p className="card-text text-truncate">{facility.summary}</p>
                 <Link to={`/facilities/${facility.id}`} className="btn btn-primary">
                   View Details
                 </Link>
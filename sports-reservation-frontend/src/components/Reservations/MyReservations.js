@@ -10,7 +10,7 @@ const MyReservations = () => {
     const fetchReservations = async () => {
       try {
         const response = await api.get('reservations/');
-        setReservations(response.data);
+        setReservations(response.data.results);
         setLoading(false);
       } catch (error) {
         console.error('Error fetching reservations:', error);
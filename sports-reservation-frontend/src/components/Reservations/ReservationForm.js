@@ -3,7 +3,7 @@ import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import DatePicker from 'react-datepicker';
 import "react-datepicker/dist/react-datepicker.css";
-import { getFacility, getTimeSlots, createReservation } from '../../services/api';
+import { getFacility, getTimeSlots, createReservation, subscribeToTimeSlots } from '../../services/api';
 
 const ReservationForm = () => {
   const { facilityId } = useParams();
@@ -52,6 +52,35 @@ const ReservationForm = () => {
     }
   }, [facilityId, date]);
 
+  // Keep the slots live while the form is open instead of polling
+  useEffect(() => {
+    if (!facilityId || !date) return undefined;
+    const formattedDate = date.toISOString().split('T')[0];
+    const source = subscribeToTimeSlots(facilityId, formattedDate, {
+      onSnapshot: (slots) => setTimeSlots(slots),
+      onSlot: (event) => {
+        setTimeSlots(slots => slots.map(slot => (
+          slot.start_time === event.start_time
+            ? { ...slot, id: event.id, is_available: event.is_available }
+            : slot
+        )));
+        if (!event.is_available) {
+          setSelectedTimeSlot(selected => {
+            if (selected?.start_time !== event.start_time) return selected;
+            setError('That time slot was just taken. Please pick another one.');
+            return null;
+          });
+        }
+      },
+      onResync: async () => {
+        const response = await getTimeSlots(facilityId, formattedDate);
+        setTimeSlots(response.data);
+      },
+    });
+    // Without the ASGI app the stream answers 501 and the fetched slots stay
+    return () => source.close();
+  }, [facilityId, date]);
+
   const handleReservation = async () => {
     if (!selectedTimeSlot) {
       setError('Please select a time slot');
@@ -109,11 +138,11 @@ const ReservationForm = () => {
                 ) : (
                   <div className="row row-cols-1 row-cols-md-3 g-3 mt-2">
                     {timeSlots.map(slot => (
-                      <div className="col" key={slot.id}>
+                      <div className="col" key={slot.start_time}>
                         <div 
-                          className={`card h-100 ${selectedTimeSlot === slot.id ? 'border-primary' : ''} ${!slot.is_available ? 'bg-light' : ''}`}
+                          className={`card h-100 ${selectedTimeSlot?.start_time === slot.start_time ? 'border-primary' : ''} ${!slot.is_available ? 'bg-light' : ''}`}
                           style={{ cursor: slot.is_available ? 'pointer' : 'not-allowed' }}
-                          onClick={() => slot.is_available && setSelectedTimeSlot(slot.id)}
+                          onClick={() => slot.is_available && setSelectedTimeSlot(slot)}
                         >
                           <div className="card-body text-center">
                             <h5 className="card-title">
@@ -124,7 +153,7 @@ const ReservationForm = () => {
                             {!slot.is_available && (
                               <span className="badge bg-secondary">Already Booked</span>
                             )}
-                            {selectedTimeSlot === slot.id && (
+                            {selectedTimeSlot?.start_time === slot.start_time && (
                               <span className="badge bg-success mt-2">Selected</span>
                             )}
                           </div>
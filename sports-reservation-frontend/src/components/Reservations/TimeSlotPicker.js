@@ -41,7 +41,7 @@ const TimeSlotPicker = ({ facilityId, onSlotSelect }) => {
         <div className="slots-grid">
           {slots.map((slot) => (
             <button
-              key={slot.id}
+              key={slot.start_time}
               onClick={() => onSlotSelect(slot)}
               disabled={!slot.is_available}
               className={`slot-btn ${!slot.is_available ? 'booked' : ''}`}
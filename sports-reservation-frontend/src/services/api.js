@@ -56,9 +56,26 @@ export const getTimeSlots = async (facilityId, date) => {
   });
 };
 
+// Live availability of a facility-day over server-sent events. Calls
+// onSnapshot(slots) on (re)connection and onSlot(event) when a slot is
+// booked or freed. Returns the EventSource; close() it when done.
+export const subscribeToTimeSlots = (facilityId, date, { onSnapshot, onSlot, onResync }) => {
+  const params = new URLSearchParams({ facility_id: facilityId, date });
+  const source = new EventSource(`${API_URL}async/timeslots/events/?${params}`);
+  source.addEventListener('snapshot', (e) => onSnapshot(JSON.parse(e.data)));
+  source.addEventListener('slot', (e) => onSlot(JSON.parse(e.data)));
+  source.addEventListener('resync', () => onResync && onResync());
+  return source;
+};
+
 // Reservation services
-export const createReservation = async (timeSlotId) => {
-  return await api.post('reservations/', { time_slot: timeSlotId });
+// Slots that have not been booked yet have no id; they are identified by
+// facility, date and start time instead.
+export const createReservation = async (slot) => {
+  const data = slot.id
+    ? { time_slot: slot.id }
+    : { facility: slot.facility, date: slot.date, start_time: slot.start_time };
+  return await api.post('reservations/', data);
 };
 
 export const getMyReservations = async () => {
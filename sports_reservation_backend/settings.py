@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,14 +59,15 @@ ACCOUNT_LOGIN_METHODS = {'username', 'email'}
 ACCOUNT_SIGNUP_FIELDS = ['email*', 'username*', 'password1*', 'password2*']
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 MIDDLEWARE = [
+    'reservations.middleware.PerformanceMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'reservations.middleware.SiteSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'reservations.middleware.SiteAuthenticationMiddleware',
+    'reservations.middleware.SiteMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 CORS_ALLOWED_ORIGINS = [
@@ -78,10 +82,14 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 ROOT_URLCONF = 'sports_reservation_backend.urls'
+# Logging in through the API hands out a token, not a session
+REST_AUTH = {
+    'SESSION_LOGIN': False,
+}
 REST_FRAMEWORK = {
+    # /api/ is token-only: the session middleware does not run there (RESERVATIONS_SLIM_API)
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',],
+        'reservations.authentication.CachedTokenAuthentication',],
 'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
@@ -108,12 +116,168 @@ WSGI_APPLICATION = 'sports_reservation_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE selects the database: 'sqlite' (the default) or 'postgres'.
+# Both keep connections open across requests.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'sportsched'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('POSTGRES_POOL', '1') == '1':
+        # psycopg's connection pool (needs psycopg[pool]); incompatible with CONN_MAX_AGE
+        DATABASES['default']['OPTIONS'] = {'pool': {'min_size': 2, 'max_size': 20, 'timeout': 10}}
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = 600
+elif DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # A file rather than the in-memory default, so that the tests run
+            # concurrent writers against the busy timeout and the WAL journal
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Busy timeout in seconds: writers wait for the lock instead of failing
+                'timeout': 20,
+                # WAL lets readers run alongside the writer; NORMAL only syncs at checkpoints
+                'init_command': (
+                    'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+                    'PRAGMA mmap_size=268435456; PRAGMA temp_store=MEMORY'
+                ),
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"DATABASE_PROFILE must be 'sqlite' or 'postgres', not {DATABASE_PROFILE!r}.")
+
+# Booking transactions (reservations/booking.py)
+RESERVATIONS_DATABASE = {
+    # SQLite: take the write lock with BEGIN IMMEDIATE when a booking starts,
+    # so concurrent bookings queue on the busy timeout rather than failing
+    # with "database is locked" when upgrading from a read lock.
+    'IMMEDIATE_BOOKINGS': True,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# In-process by default; set REDIS_URL to share the cache between workers.
+
+# locmem caches are per process: each worker only invalidates its own copy.
+# Set REDIS_URL to share them between workers.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sports-reservation',
+    },
+    # Kept apart from catalog and token entries so that they never cull its
+    # version keys; a culled version key turns a facility's days into misses.
+    # locmem is per process: invalidations only reach other workers through
+    # a shared backend, so run several workers with REDIS_URL set.
+    # Sized for ~300 facilities x 60 days of entries and version keys.
+    'availability': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sports-reservation-availability',
+        'OPTIONS': {'MAX_ENTRIES': 40000},
+    },
+}
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
     }
+    CACHES['availability'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'availability',
+    }
+
+# Facility-day availability cache (reservations/cache.py)
+RESERVATIONS_AVAILABILITY_CACHE = {
+    'ALIAS': 'availability',
+    'TIMEOUT': 300,  # seconds; writes also invalidate entries, in every process if the alias is shared
+}
+
+# Token lookups (reservations/authentication.py)
+RESERVATIONS_AUTH_CACHE = {
+    'ALIAS': 'default',
+    # Seconds in the shared cache; tokens are also forgotten on logout and rotation.
+    # A locmem ALIAS is not shared, so its entries only live LOCAL_TTL seconds.
+    'TIMEOUT': 300,
+    'LOCAL_SIZE': 1024,  # tokens kept per process
+    'LOCAL_TTL': 10,  # seconds a revoked token may still pass in other processes
+}
+
+# Paths that skip the session, auth and message middleware (reservations/middleware.py).
+# The API authenticates with tokens only; the admin keeps its sessions.
+RESERVATIONS_SLIM_API = {
+    'PREFIX': '/api/',
+    'EXCEPT': ['/api/auth/'],
+}
+
+# Request instrumentation (reservations/middleware.py, served at /api/metrics/)
+RESERVATIONS_PERFORMANCE = {
+    'SLOW_REQUEST_MS': 500,  # log requests slower than this with their worst SQL
+    'SLOW_STATEMENTS': 5,
+    'WINDOW_SECONDS': 300,  # rolling window of the latency quantiles
+    'WINDOW_SIZE': 1000,  # samples kept per endpoint for the quantiles
+}
+
+# Availability push (reservations/events.py, /api/async/timeslots/events/)
+RESERVATIONS_EVENTS = {
+    'BACKEND': 'reservations.events.LocalBroadcaster',
+    'OPTIONS': {'queue_size': 100},  # events buffered per subscriber before a resync
+    'HEARTBEAT_SECONDS': 15,
+    'RETRY_MS': 3000,
 }
+if os.environ.get('REDIS_URL'):
+    RESERVATIONS_EVENTS['BACKEND'] = 'reservations.events.RedisBroadcaster'
+    RESERVATIONS_EVENTS['OPTIONS']['url'] = os.environ['REDIS_URL']
+
+# Surge mode (reservations/intake.py): queue booking attempts behind a single
+# writer per process and rate-limit them per user. Off by default.
+RESERVATIONS_SURGE = {
+    'ENABLED': os.environ.get('RESERVATIONS_SURGE') == '1',
+    'QUEUE_SIZE': 20,  # attempts queued per slot; later ones are turned away
+    'TIMEOUT': 10,  # seconds an attempt may wait before it is withdrawn
+    'TAKEN_TTL': 30,  # seconds a booked slot is rejected without a query
+    'RATE': '10/min',  # booking attempts per user
+}
+
+# History archival (reservations/archive.py, manage.py archive_history)
+RESERVATIONS_ARCHIVE = {
+    'RETENTION_DAYS': 90,  # slots older than this move to the archive tables
+    'BATCH_SIZE': 1000,  # slots moved per transaction
+}
+
+# Job queue in the database, run by `manage.py run_jobs` (reservations/jobs.py)
+RESERVATIONS_JOBS = {
+    'POLL_INTERVAL': 1.0,  # seconds a worker sleeps when nothing is due
+    'BATCH_SIZE': 10,  # jobs claimed at a time
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY': 30,  # seconds before the first retry, doubled for each one after
+    'LOCK_TIMEOUT': 600,  # seconds before a running job is assumed lost and queued again
+    'KEEP_DAYS': 7,  # finished jobs are deleted by purge_jobs after this
+    'PERIODIC': {  # task name -> seconds between runs
+        'extend_horizons': 3600,
+        'reconcile_availability': 3600,
+        'archive_history': 24 * 3600,
+        'purge_jobs': 24 * 3600,
+    },
+}
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'SportSched <noreply@sportsched.local>')
 
 
 # Password validation
@@ -4,15 +4,24 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from reservations.views import SportFacilityViewSet, TimeSlotViewSet, ReservationViewSet
+from reservations import async_views
+from reservations.views import (
+    SportFacilityViewSet, TimeSlotViewSet, ReservationViewSet, AvailabilityViewSet, MetricsView,
+)
 
 router = DefaultRouter()
 router.register(r'facilities', SportFacilityViewSet)
 router.register(r'timeslots', TimeSlotViewSet)
 router.register(r'reservations', ReservationViewSet)
+router.register(r'availability', AvailabilityViewSet, basename='availability')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+    path('api/async/facilities/', async_views.facility_list, name='async-facility-list'),
+    path('api/async/timeslots/', async_views.time_slot_list, name='async-timeslot-list'),
+    path('api/async/timeslots/events/', async_views.time_slot_events, name='async-timeslot-events'),
+    path('api/async/reservations/', async_views.reservation_list, name='async-reservation-list'),
     path('api/', include(router.urls)),
     path('api/auth/', include('dj_rest_auth.urls')),
     path('api/auth/registration/', include('dj_rest_auth.registration.urls')),